@@ -0,0 +1,311 @@
+"""
+
+    Benchmark suite for the recommenders and the Streamlit app.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures, in fresh processes so that runs do not warm
+    each other up:
+
+      - import time of `edsa_recommender`, `recommenders.content_based`
+        and `recommenders.collaborative_based`;
+      - p50/p95/p99 latency and peak RSS of `content_model` and
+        `collab_model` over a fixed set of favourite-movie triples;
+        `collab_model` runs with the `COLLAB_MODE` given by `--collab-mode`
+        (default 'cooccurrence') instead of the environment's, and the
+        mode is recorded with the results;
+      - optionally, the wall-clock time of the SVD training script and
+        of the parallel trainer in `recommenders.training`.
+
+    Results are written as a flat JSON dictionary of metrics in which
+    lower is always better, so two runs can be compared metric by metric.
+
+    Usage (from the root of the repo):
+
+        python -m benchmarks.run run --output baseline.json
+        python -m benchmarks.run run --output current.json
+        python -m benchmarks.run compare baseline.json current.json --threshold 0.1
+
+"""
+# Dependencies
+import os
+import sys
+import json
+import time
+import shutil
+import queue
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from recommenders.collaborative_based import COLLAB_MODES
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Favourite-movie triples drawn from the most rated movies in ratings.csv.
+TRIPLES = [
+    ['Forrest Gump (1994)', 'Pulp Fiction (1994)', 'Shawshank Redemption, The (1994)'],
+    ['Silence of the Lambs, The (1991)', 'Star Wars: Episode IV - A New Hope (1977)', 'Jurassic Park (1993)'],
+    ['Matrix, The (1999)', 'Toy Story (1995)', "Schindler's List (1993)"],
+    ['Terminator 2: Judgment Day (1991)', 'Star Wars: Episode V - The Empire Strikes Back (1980)', 'Braveheart (1995)'],
+    ['Back to the Future (1985)', 'Fargo (1996)', 'American Beauty (1999)'],
+    ['Independence Day (a.k.a. ID4) (1996)', 'Star Wars: Episode VI - Return of the Jedi (1983)', 'Aladdin (1992)'],
+    ['Fugitive, The (1993)', 'Dances with Wolves (1990)', 'Fight Club (1999)'],
+    ['Usual Suspects, The (1995)', 'Seven (a.k.a. Se7en) (1995)', 'Godfather, The (1972)'],
+    ['Lion King, The (1994)', 'Apollo 13 (1995)', 'True Lies (1994)'],
+    ['Toy Story (1995)', 'Jumanji (1995)', 'Heat (1995)'],
+]
+
+# Seconds an engine process may take before it is considered stuck
+ENGINE_TIMEOUT = 600
+# `COLLAB_MODE` benchmarked unless another one is chosen
+COLLAB_MODE = 'cooccurrence'
+
+MODULES = ['recommenders.content_based', 'recommenders.collaborative_based', 'edsa_recommender']
+
+ENGINES = {
+    'content_model': ('recommenders.content_based', 'content_model'),
+    'collab_model': ('recommenders.collaborative_based', 'collab_model'),
+}
+
+def percentile(values, q):
+    """Linear-interpolated percentile of a list of numbers."""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def time_import(module, repeats=3, collab_mode=COLLAB_MODE):
+    """Median seconds to import `module` in a fresh interpreter."""
+    code = ('import time; start = time.perf_counter(); '
+            f'import {module}; print(time.perf_counter() - start)')
+    samples = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT,
+                                capture_output=True, text=True,
+                                env=dict(os.environ, COLLAB_MODE=collab_mode))
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return percentile(samples, 50)
+
+def _engine_worker(name, triples, repeats, top_n, collab_mode, results):
+    """Run one engine in a fresh process and report latencies and peak RSS."""
+    import importlib
+    import resource
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    os.environ['COLLAB_MODE'] = collab_mode
+    try:
+        module_name, function_name = ENGINES[name]
+        if name == 'content_model':
+            # Benchmark the index, not the fallback used while it is built
+            from recommenders.content_based import ensure_content_index
+            ensure_content_index()
+        engine = getattr(importlib.import_module(module_name), function_name)
+        # The first call pays for lazily loaded models and indexes.
+        start = time.perf_counter()
+        engine(triples[0], top_n)
+        first = time.perf_counter() - start
+        latencies = []
+        for _ in range(repeats):
+            for triple in triples:
+                start = time.perf_counter()
+                engine(triple, top_n)
+                latencies.append(time.perf_counter() - start)
+        # ru_maxrss is reported in kilobytes on Linux.
+        results.put({'first_call_ms': 1000 * first,
+                     'latencies_ms': [1000 * t for t in latencies],
+                     'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+    except Exception as e:
+        results.put({'error': f'{type(e).__name__}: {e}'})
+
+def bench_engine(name, triples=TRIPLES, repeats=5, top_n=10, timeout=ENGINE_TIMEOUT,
+                 collab_mode=COLLAB_MODE):
+    """Latency percentiles (ms) and peak RSS (MB) of one recommender.
+
+    The engine runs with `COLLAB_MODE` set to `collab_mode`. Raises
+    `RuntimeError` if the engine fails, or reports nothing within
+    `timeout` seconds (its process is then terminated).
+
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_engine_worker,
+                              args=(name, triples, repeats, top_n, collab_mode, results))
+    process.start()
+    try:
+        result = results.get(timeout=timeout)
+    except queue.Empty:
+        process.terminate()
+        process.join()
+        raise RuntimeError(f'{name} reported no results within {timeout}s '
+                           f'(exit code {process.exitcode})') from None
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    latencies = result['latencies_ms']
+    return {'first_call_ms': result['first_call_ms'],
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'peak_rss_mb': result['peak_rss_mb']}
+
+def bench_training(timeout=3600, sgd=False):
+    """Wall-clock seconds of resources/models/train_colbased.py.
+
+    The script reads `ratings.csv` from, and writes `SVD.pkl` to, its
+    working directory, so it is run in a scratch directory. With `sgd`,
+    `recommenders.training` is timed instead, on the same data.
+
+    """
+    scratch = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(REPO_ROOT, 'resources', 'data', 'ratings.csv'), scratch)
+        if sgd:
+            command = [sys.executable, '-m', 'recommenders.training',
+                       '--ratings', os.path.join(scratch, 'ratings.csv'),
+                       '--output', os.path.join(scratch, 'svd_factors')]
+            cwd = REPO_ROOT
+        else:
+            command = [sys.executable, os.path.join(REPO_ROOT, 'resources', 'models', 'train_colbased.py')]
+            cwd = scratch
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True, timeout=timeout)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def run(output, repeats=5, import_repeats=3, training=False, collab_mode=COLLAB_MODE):
+    """Run the suite and write the results to `output` as JSON."""
+    if collab_mode not in COLLAB_MODES:
+        raise ValueError(f"Unknown COLLAB_MODE {collab_mode!r}; expected one of {list(COLLAB_MODES)}")
+    metrics, errors = {}, {}
+    for module in MODULES:
+        try:
+            metrics[f'import.{module}.seconds'] = time_import(module, import_repeats, collab_mode)
+        except Exception as e:
+            errors[f'import.{module}'] = str(e)
+    for name in ENGINES:
+        try:
+            for metric, value in bench_engine(name, repeats=repeats, collab_mode=collab_mode).items():
+                metrics[f'{name}.{metric}'] = value
+        except Exception as e:
+            errors[name] = str(e)
+    if training:
+        try:
+            metrics['train_colbased.seconds'] = bench_training()
+        except Exception as e:
+            errors['train_colbased'] = str(e)
+        try:
+            metrics['training_sgd.seconds'] = bench_training(sgd=True)
+        except Exception as e:
+            errors['training_sgd'] = str(e)
+    results = {
+        'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'cpus': os.cpu_count(),
+                 'triples': len(TRIPLES),
+                 'repeats': repeats,
+                 'collab_mode': collab_mode},
+        'metrics': {k: round(v, 6) for k, v in metrics.items()},
+        'errors': errors,
+    }
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+def compare(baseline, current, threshold=0.1, min_delta=0.0):
+    """Compare two result files metric by metric.
+
+    Parameters
+    ----------
+    baseline, current : str
+        Paths to JSON files written by `run`.
+    threshold : float
+        Relative increase (0.1 = 10%) above which a metric regressed.
+    min_delta : float
+        Absolute increase a metric must also exceed to count as a
+        regression, to ignore noise on very small values.
+
+    Returns
+    -------
+    list[dict]
+        One row per metric of the baseline, with `baseline`, `current`,
+        relative `change` and a `regressed` flag, then one row per error
+        of the current run. A metric missing from the current run (e.g.
+        because its benchmark failed) and every error count as
+        regressions; `current` and `change` are then None. Runs of
+        different `COLLAB_MODE`s are not comparable, which is reported as
+        a regressed 'meta.collab_mode' row.
+
+    """
+    with open(baseline) as f:
+        previous = json.load(f)
+    with open(current) as f:
+        results = json.load(f)
+    before = previous['metrics']
+    after, errors = results['metrics'], results.get('errors') or {}
+    rows = []
+    modes = [(r.get('meta') or {}).get('collab_mode') for r in (previous, results)]
+    if modes[0] != modes[1]:
+        rows.append({'metric': 'meta.collab_mode', 'baseline': None, 'current': None, 'change': None,
+                     'regressed': True,
+                     'error': f'COLLAB_MODE {modes[0]!r} in the baseline, {modes[1]!r} now'})
+    for metric in sorted(before):
+        old, new = before[metric], after.get(metric)
+        if new is None:
+            rows.append({'metric': metric, 'baseline': old, 'current': None, 'change': None,
+                         'regressed': True})
+            continue
+        change = (new - old) / old if old else 0.0
+        rows.append({'metric': metric, 'baseline': old, 'current': new, 'change': change,
+                     'regressed': change > threshold and new - old > min_delta})
+    for name, message in sorted(errors.items()):
+        rows.append({'metric': f'error.{name}', 'baseline': None, 'current': None, 'change': None,
+                     'regressed': True, 'error': message})
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recommender benchmark suite.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--output', default='bench_results.json')
+    run_parser.add_argument('--repeats', type=int, default=5,
+                            help='passes over the triples per recommender')
+    run_parser.add_argument('--import-repeats', type=int, default=3)
+    run_parser.add_argument('--training', action='store_true',
+                            help='also time the SVD training scripts')
+    run_parser.add_argument('--collab-mode', default=COLLAB_MODE, choices=list(COLLAB_MODES),
+                            help='COLLAB_MODE of the collab_model benchmark')
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    compare_parser.add_argument('--min-delta', type=float, default=0.0)
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        results = run(args.output, args.repeats, args.import_repeats, args.training,
+                      args.collab_mode)
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return 0
+    rows = compare(args.baseline, args.current, args.threshold, args.min_delta)
+    for row in rows:
+        flag = 'REGRESSED' if row['regressed'] else 'ok'
+        if 'error' in row:
+            print(f"{row['metric']:<55} {row['error']}  {flag}")
+        elif row['current'] is None:
+            print(f"{row['metric']:<55} {row['baseline']:>12.4f} {'missing':>12}  {flag}")
+        else:
+            print(f"{row['metric']:<55} {row['baseline']:>12.4f} {row['current']:>12.4f} "
+                  f"{100 * row['change']:>+8.1f}%  {flag}")
+    return 1 if any(row['regressed'] for row in rows) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
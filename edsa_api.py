@@ -0,0 +1,401 @@
+"""
+
+    HTTP/JSON recommendation API.
+
+    Author: Explore Data Science Academy.
+
+    Description: A small asyncio web service (standard library only)
+    serving the recommenders of `recommenders.registry`, independently of
+    the Streamlit UI. Models are loaded once per process. Concurrent
+    requests for the same algorithm are collected for a few milliseconds
+    and scored together in a single vectorised pass on a worker pool, so
+    the event loop itself never does CPU-bound work.
+
+    Endpoints:
+
+        GET  /health            status and loaded backends
+        GET  /metrics           batching, cache, ratings stream and stage timing counters
+        GET  /metrics/prometheus  the stage timings in Prometheus text format
+
+    With worker processes (`--processes`), /health and /metrics only
+    report what the server process itself knows: its uptime and batching.
+        POST /recommend         {"movies": [...], "algorithm": "content", "top_n": 10}
+        POST /recommend/batch   {"requests": [{"movies": [...], ...}, ...]}
+        GET  /titles?q=dark+kni&limit=10   typeahead search over the titles
+        POST /ratings           {"ratings": [{"userId": 1, "movieId": 31, "rating": 4.5}, ...]}
+
+    `movies` is a list of titles or a mapping of title to weight;
+    `algorithm` is any of `registry.names()` ("content", "collaborative",
+    "cooccurrence", "svd_factor", "popularity" or "hybrid"); `method` ("sum", "max" or "weighted")
+    is optional, as is `filters`, e.g.
+    {"include": ["Comedy"], "exclude": ["Horror"], "years": [1990, 1999]}.
+
+    Usage (from the root of the repo):
+
+        python edsa_api.py --port 8000 --workers 4
+
+"""
+# Dependencies
+import sys
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from recommenders import registry
+from recommenders.ingestion import append_ratings, load_ratings_store
+from utils import instrumentation
+from utils.resources import timings
+from utils.scoring import AGGREGATIONS, IndexNotReadyError
+from utils.title_search import load_title_index
+
+MAX_BODY = 1 << 20
+MAX_TITLE_RESULTS = 100
+MAX_TOP_N = 100
+# Endpoints answering GET requests
+GET_ENDPOINTS = ('/titles', '/health', '/metrics', '/metrics/prometheus')
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class RequestError(Exception):
+    """A client error, reported with an HTTP status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def parse_request(payload):
+    """Validate one recommendation request and fill in its defaults."""
+    if not isinstance(payload, dict):
+        raise RequestError(400, 'A request must be a JSON object')
+    movies = payload.get('movies')
+    if not isinstance(movies, (list, dict)) or not movies:
+        raise RequestError(400, '"movies" must be a non-empty list of titles or a title -> weight object')
+    algorithm = payload.get('algorithm', 'content')
+    if algorithm not in registry.names():
+        raise RequestError(400, f'Unknown algorithm {algorithm!r}; expected one of {registry.names()}')
+    top_n = payload.get('top_n', 10)
+    # bool is a subclass of int, but `true` is not a number of movies
+    if not isinstance(top_n, int) or isinstance(top_n, bool) or not 1 <= top_n <= MAX_TOP_N:
+        raise RequestError(400, f'"top_n" must be an integer from 1 to {MAX_TOP_N}')
+    method = payload.get('method', 'sum')
+    if not isinstance(method, str) or method not in AGGREGATIONS:
+        raise RequestError(400, f'"method" must be one of {list(AGGREGATIONS)}')
+    filters = payload.get('filters') or None
+    if filters is not None:
+        if not isinstance(filters, dict) or set(filters) - {'include', 'exclude', 'years'}:
+            raise RequestError(400, '"filters" may only have "include", "exclude" and "years"')
+        for name in ('include', 'exclude'):
+            genres = filters.get(name)
+            if genres is not None and (not isinstance(genres, list) or
+                                       not all(isinstance(genre, str) for genre in genres)):
+                raise RequestError(400, f'"{name}" must be a list of genres')
+        years = filters.get('years')
+        if years is not None and (not isinstance(years, list) or len(years) != 2 or
+                                  not all(year is None or (isinstance(year, int) and not isinstance(year, bool))
+                                          for year in years)):
+            raise RequestError(400, '"years" must be a [first, last] pair of years (either may be null)')
+        filters = dict(filters, years=tuple(years)) if years else filters
+    return {'movies': movies, 'algorithm': algorithm, 'top_n': top_n,
+            'method': method, 'filters': filters}
+
+def run_batch(algorithm, method, requests):
+    """Score a batch of requests sharing an algorithm and method.
+
+    Runs on the worker pool. Returns one `(ok, result)` pair per request;
+    if the batch as a whole fails (e.g. because of an unknown title), the
+    requests are retried one by one so that only the bad ones fail.
+
+    """
+    try:
+        with instrumentation.trace('api_batch'):
+            results = registry.recommend_many([r['movies'] for r in requests], algorithm,
+                                              [r['top_n'] for r in requests], method,
+                                              filters=[r['filters'] for r in requests])
+        return [(True, result) for result in results]
+    except Exception:
+        outcomes = []
+        for r in requests:
+            try:
+                outcomes.append((True, registry.recommend(r['movies'], algorithm, r['top_n'], method,
+                                                          filters=r['filters'])))
+            except KeyError as e:
+                outcomes.append((False, f'Unknown movie: {e.args[0]}'))
+            except Exception as e:
+                outcomes.append((False, f'{type(e).__name__}: {e}'))
+        return outcomes
+
+def ratings_stream_stats():
+    """Counters of the ratings store, or None until a recommender opens it."""
+    if not timings()['ratings_store']['loaded']:
+        return None
+    return load_ratings_store().stats()
+
+def search_titles(query, limit):
+    """Typeahead matches of `query` (run on the worker pool)."""
+    return load_title_index().search(query, limit)
+
+def warm(algorithms):
+    """Load the title index and the given backends (run in each worker process).
+
+    A backend whose index is still being built is loaded on a later
+    request, once the index is ready.
+
+    """
+    load_title_index()
+    for algorithm in algorithms:
+        for name in (list(registry.HYBRID_BLEND) if algorithm == 'hybrid' else [algorithm]):
+            try:
+                registry.backend(name).load()
+            except IndexNotReadyError:
+                pass
+
+class MicroBatcher:
+    """Collect concurrent requests and score them in batches.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Pool on which batches are scored.
+    max_batch : int
+        Largest number of requests scored together.
+    max_wait : float
+        Seconds the first request of a batch waits for others to join.
+
+    """
+
+    def __init__(self, executor, max_batch=64, max_wait=0.002):
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self._queues = {}
+
+    async def submit(self, request):
+        """Score one parsed request; returns its recommendations."""
+        key = (request['algorithm'], request['method'])
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue()
+            asyncio.get_running_loop().create_task(self._collect(key, queue))
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((request, future))
+        ok, result = await future
+        if not ok:
+            raise RequestError(400, result)
+        return result
+
+    async def _collect(self, key, queue):
+        """Group queued requests for `key` into batches, forever."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            loop.create_task(self._run(key, batch))
+
+    async def _run(self, key, batch):
+        self.requests += len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            outcomes = await asyncio.get_running_loop().run_in_executor(
+                self.executor, run_batch, key[0], key[1], [request for request, _ in batch])
+        except Exception as e:
+            outcomes = [(False, f'{type(e).__name__}: {e}')] * len(batch)
+        for (_, future), outcome in zip(batch, outcomes):
+            if not future.done():
+                future.set_result(outcome)
+
+    def stats(self):
+        return {'requests': self.requests,
+                'batches': self.batches,
+                'mean_batch': round(self.requests / self.batches, 2) if self.batches else None,
+                'largest_batch': self.largest_batch}
+
+class RecommendationServer:
+    """The HTTP front end.
+
+    Parameters
+    ----------
+    batcher : MicroBatcher
+        Scores the recommendation requests.
+    processes : bool
+        Whether the batcher scores on worker processes. The models, result
+        caches and stage timings then live in the workers, so /health and
+        /metrics leave them out and /metrics/prometheus is unavailable.
+
+    """
+
+    def __init__(self, batcher, processes=False):
+        self.batcher = batcher
+        self.processes = processes
+        self.started = time.time()
+
+    async def handle(self, method, path, body, query=''):
+        """Route one request; returns `(status, payload)`, where a string
+        payload is sent as plain text."""
+        if path in GET_ENDPOINTS and method != 'GET':
+            raise RequestError(405, f'{path} only accepts GET')
+        if path == '/titles':
+            params = parse_qs(query)
+            try:
+                limit = min(int(params.get('limit', ['10'])[0]), MAX_TITLE_RESULTS)
+            except ValueError:
+                raise RequestError(400, '"limit" must be an integer') from None
+            titles = await asyncio.get_running_loop().run_in_executor(
+                self.batcher.executor, search_titles, params.get('q', [''])[0], limit)
+            return 200, {'titles': titles}
+        if path == '/health':
+            health = {'status': 'ok', 'uptime_seconds': round(time.time() - self.started, 1)}
+            if not self.processes:
+                health['loaded'] = registry.loaded()
+            return 200, health
+        if path == '/metrics':
+            if self.processes:
+                return 200, {'batching': self.batcher.stats()}
+            return 200, {'batching': self.batcher.stats(), 'cache': registry.cache.stats(),
+                         'ratings_stream': ratings_stream_stats(), 'stages': instrumentation.metrics()}
+        if path == '/metrics/prometheus':
+            if self.processes:
+                raise RequestError(404, 'Stage timings are kept by the worker processes')
+            return 200, instrumentation.prometheus_text()
+        if path not in ('/recommend', '/recommend/batch', '/ratings'):
+            raise RequestError(404, f'No such endpoint: {path}')
+        if method != 'POST':
+            raise RequestError(405, f'{path} only accepts POST')
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            raise RequestError(400, 'The request body is not valid JSON') from None
+        if path == '/ratings':
+            ratings = payload.get('ratings') if isinstance(payload, dict) else None
+            if not isinstance(ratings, list):
+                raise RequestError(400, '"ratings" must be a list')
+            try:
+                # Appended to the ratings stream, which every worker tails
+                appended = await asyncio.get_running_loop().run_in_executor(
+                    self.batcher.executor, append_ratings, ratings)
+            except (ValueError, TypeError, KeyError, IndexError) as e:
+                raise RequestError(400, f'Invalid rating: {e}') from None
+            return 200, {'appended': appended}
+        if path == '/recommend':
+            request = parse_request(payload)
+            return 200, {'recommendations': await self.batcher.submit(request)}
+        requests = payload.get('requests') if isinstance(payload, dict) else None
+        if not isinstance(requests, list):
+            raise RequestError(400, '"requests" must be a list')
+        parsed = [parse_request(r) for r in requests]
+        outcomes = await asyncio.gather(*(self.batcher.submit(r) for r in parsed),
+                                        return_exceptions=True)
+        return 200, {'results': [{'recommendations': o} if not isinstance(o, Exception)
+                                 else {'error': str(o)} for o in outcomes]}
+
+    async def serve_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one (keep-alive) connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                keep_alive = headers.get('connection', '').lower() != 'close' and \
+                    not version.strip().endswith('1.0')
+                try:
+                    if length > MAX_BODY:
+                        raise RequestError(413, 'The request body is too large')
+                    body = await reader.readexactly(length) if length else b''
+                    path, _, query = path.partition('?')
+                    status, payload = await self.handle(method, path, body, query)
+                except RequestError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': f'{type(e).__name__}: {e}'}
+                if isinstance(payload, str):
+                    data, content_type = payload.encode(), 'text/plain; version=0.0.4'
+                else:
+                    data, content_type = json.dumps(payload).encode(), 'application/json'
+                writer.write((f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+                              f'Content-Type: {content_type}\r\n'
+                              f'Content-Length: {len(data)}\r\n'
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + data)
+                await writer.drain()
+                if not keep_alive or status == 413:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(host='127.0.0.1', port=8000, workers=None, processes=False,
+                preload=('content',), max_batch=64, max_wait=0.002):
+    """Start the API and serve until cancelled.
+
+    Parameters
+    ----------
+    host, port : str, int
+        Address to listen on.
+    workers : int, optional
+        Size of the scoring pool. Defaults to the executor's default.
+    processes : bool
+        Score on a process pool instead of a thread pool.
+    preload : tuple (str)
+        Algorithms loaded before the first request.
+    max_batch, max_wait : int, float
+        Micro-batching limits; see `MicroBatcher`.
+
+    """
+    if processes:
+        executor = ProcessPoolExecutor(workers, initializer=warm, initargs=(tuple(preload),))
+    else:
+        executor = ThreadPoolExecutor(workers)
+        warm(preload)
+    server = RecommendationServer(MicroBatcher(executor, max_batch, max_wait), processes)
+    listener = await asyncio.start_server(server.serve_connection, host, port)
+    address = listener.sockets[0].getsockname()
+    print(f"Serving recommendations on http://{address[0]}:{address[1]}", flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP/JSON recommendation API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--processes', action='store_true',
+                        help='score on worker processes instead of threads')
+    parser.add_argument('--preload', nargs='*', default=['content'], choices=registry.names(),
+                        help='algorithms to load before serving')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.processes, tuple(args.preload),
+                          args.max_batch, args.max_wait_ms / 1000))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
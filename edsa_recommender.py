@@ -19,26 +19,33 @@
 # Streamlit dependencies
 import streamlit as st
 from streamlit_option_menu import option_menu
-import time
 # Data handling dependencies
-import pandas as pd
-import requests
 import base64
 import os
 # Custom Libraries
-from utils.data_loader import load_movie_titles
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
+from utils.catalog import load_catalog
+from utils.posters import PosterResolver
+from utils.resources import resource, warm_up, timings
+from utils.instrumentation import trace, last_trace
+from utils.title_search import load_title_index
+from utils.genre_index import load_genre_index
+from recommenders import registry
+from recommenders.collaborative_based import collab_backend
 
 # Data Loading
-df_links = pd.read_csv('resources/data/links.csv')
-title_list = load_movie_titles('resources/data/movies.csv')
-movies_df =  pd.read_csv('resources/data/movies.csv', index_col='movieId')
-movies = movies_df.dropna()
-#Loading page
-with st.spinner('# CineSage Loading...'):
-    # Simulate a long computation
-    time.sleep(6) 
+catalog = load_catalog()
+title_list = catalog.titles.tolist()
+# Algorithm choices of the app -> recommender registry backends. Each
+# backend is only loaded the first time it is chosen.
+ALGORITHMS = {
+    'Content Based Filtering': 'content',
+    'Collaborative Based Filtering': collab_backend(),
+    'Hybrid Filtering': 'hybrid',
+}
+# Number of search matches offered per favourite-movie box
+SEARCH_RESULTS = 50
+# Show the per-stage breakdown of each recommendation request
+SHOW_STAGE_TIMINGS = bool(os.environ.get('SHOW_STAGE_TIMINGS'))
 #trailer
 def create_imdb_link_1(movie_imdbId):
     imdb_url1 = f"https://www.imdb.com/title/tt00{movie_imdbId}/"
@@ -47,44 +54,70 @@ def create_imdb_link_2(movie_imdbId):
     imdb_url2 = f"https://www.imdb.com/title/tt0{movie_imdbId}/"
     return imdb_url2
 #poster
-def fetch_poster(movie_id):
-    url = "https://api.themoviedb.org/3/movie/{}?api_key=c7ec19ffdd3279641fb606d19ceb9bb1&language=en-US".format(movie_id)
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for 4XX or 5XX errors
-        data = response.json()
-        
-        if 'poster_path' in data and data['poster_path']:
-            poster_path = data['poster_path']
-            full_path = "https://image.tmdb.org/t/p/w500/" + poster_path
-            return full_path
-        else:
-            return None  # Return None if poster_path is missing or empty
-    
-    except requests.exceptions.RequestException as e:
+@resource('poster_resolver')
+def poster_resolver():
+    # One resolver (HTTP pool and caches) per server process
+    return PosterResolver()
+def fetch_posters(movie_ids):
+    resolver = poster_resolver()
+    errors = resolver.errors
+    poster_urls = resolver.resolve_many(movie_ids)
+    if resolver.errors > errors:
         st.error("Error fetching data. Please try again.")
-        return None
-    
-#data
-df_links.dropna(subset=['tmdbId'], inplace=True)
-df_links['tmdbId'] = df_links['tmdbId'].astype(int)
-movie_df = pd.merge(movies_df, df_links, on='movieId', how='inner')
-def add_bg_from_local(image_file):
+    return poster_urls
+def fetch_poster(movie_id):
+    return fetch_posters([movie_id])[0]
+@resource('background_css')
+def background_css(image_file):
+    # The image is read and base64-encoded once per server process
     with open(image_file, "rb") as image_file:
         encoded_string = base64.b64encode(image_file.read())
-    st.markdown(
-    f"""
+    return f"""
     <style>
     .stApp {{
         background-image: url(data:image/{"avif"};base64,{encoded_string.decode()});
         background-size: cover
     }}
     </style>
-    """,
-    unsafe_allow_html=True
-    )
+    """
+def add_bg_from_local(image_file):
+    st.markdown(background_css(image_file), unsafe_allow_html=True)
+#Loading page: load shared assets once per server process; models and
+#indexes are loaded with their recommender on first use
+with st.spinner('# CineSage Loading...'):
+    warm_up(['catalog', 'title_index', 'genre_index', 'poster_resolver'])
+    background_css('resources/imgs/back.jpg')
+if os.environ.get('SHOW_RESOURCE_TIMINGS'):
+    with st.expander('Resource load timings'):
+        st.json(timings())
+        st.json({'recommendation_cache': registry.cache.stats()})
 add_bg_from_local('resources/imgs/back.jpg')  
+
+def pick_movie(label, suggestions, key):
+    """Search box plus drop-down for one favourite movie.
+
+    While the search box is empty, `suggestions` are offered; otherwise
+    the best matches from the whole catalogue, searched server-side.
+
+    """
+    query = st.text_input(f'Search for your {label.lower()}', key=f'{key}_query',
+                          placeholder='Start typing a title...')
+    options = load_title_index().search(query, SEARCH_RESULTS) if query.strip() else suggestions
+    if not options:
+        st.caption(f'No titles match "{query}".')
+    return st.selectbox(label, options, key=key)
+
+def pick_filters():
+    """Genre and release-year filters, in the form of `registry.apply_filters`."""
+    genre_index = load_genre_index()
+    first, last = genre_index.year_range()
+    with st.expander('Filter the recommendations'):
+        include = st.multiselect('Only these genres', genre_index.genres)
+        exclude = st.multiselect('Not these genres', genre_index.genres)
+        years = st.slider('Released between', first, last, (first, last))
+    return {'include': include, 'exclude': exclude,
+            'years': years if tuple(years) != (first, last) else None}
+
 def main():
     selected = option_menu(
         menu_title=None,  # required
@@ -104,49 +137,55 @@ def main():
         st.image("resources/imgs/engine.jpg", width=700)
         
         columns = st.columns(len([299536, 429422, 240, 155, 572154]))
-        for i, movie_id in enumerate([299536, 429422, 240, 155, 572154]):
-            poster_url = fetch_poster(movie_id)
+        header_posters = fetch_posters([299536, 429422, 240, 155, 572154])
+        for i, poster_url in enumerate(header_posters):
             columns[i].image(poster_url, width=150)
             # Recommender System algorithm selection
         sys = st.radio("Select an algorithm",
-                       ('Content Based Filtering',
-                        'Collaborative Based Filtering'))
+                       tuple(ALGORITHMS))
         # User-based preferences
         st.write('### Enter Your Three Favorite Movies')
-        movie_1 = st.selectbox('Fisrt Option',title_list[14930:15200])
-        movie_2 = st.selectbox('Second Option',title_list[25055:25255])
-        movie_3 = st.selectbox('Third Option',title_list[21100:21200])
-        fav_movies = [ movie_1 , movie_2, movie_3]
+        movie_1 = pick_movie('First Option', title_list[14930:15200], 'movie_1')
+        movie_2 = pick_movie('Second Option', title_list[25055:25255], 'movie_2')
+        movie_3 = pick_movie('Third Option', title_list[21100:21200], 'movie_3')
+        fav_movies = [movie for movie in (movie_1, movie_2, movie_3) if movie]
+        filters = pick_filters()
         
         # Perform top-10 movie recommendation generation
         if st.button("Recommend"):
             try:
-                with st.spinner('Crunching the numbers...'):
-                    if sys == 'Content Based Filtering':
-                        top_recommendations = content_model(movie_list=fav_movies,
-                                                            top_n=10)
-                    elif sys == 'Collaborative Based Filtering':
-                        top_recommendations = collab_model(movie_list=fav_movies,
-                                                           top_n=10)
-                    
-                # Display recommended movies with posters and trailer links
-                st.title("We think you'll like:")
-                text = """Try URL 1 or URL 2"""
-                st.info(text)
+                with trace('recommend'):
+                    with st.spinner('Crunching the numbers...'):
+                        top_recommendations = registry.recommend(fav_movies, ALGORITHMS[sys],
+                                                                 top_n=10, filters=filters)
+
+                    # Display recommended movies with posters and trailer links
+                    st.title("We think you'll like:")
+                    text = """Try URL 1 or URL 2"""
+                    st.info(text)
+                    # Fetch all posters concurrently before rendering
+                    poster_urls = fetch_posters([catalog.tmdb_id(movie_name) for movie_name in top_recommendations])
                 for i, movie_name in enumerate(top_recommendations):
                     st.subheader(str(i+1) + '. ' + movie_name)
 
                     # Display movie poster
-                    movie_id = movie_df.loc[movie_df['title'] == movie_name, 'tmdbId'].values[0]
-                    poster_url = fetch_poster(movie_id)
+                    poster_url = poster_urls[i]
                     st.image(poster_url, width=150)
                     
                     # Display trailer link
-                    movie_imdbId = movie_df.loc[movie_df['title'] == movie_name, 'imdbId'].values[0]
+                    movie_imdbId = catalog.imdb_id(movie_name)
                     trailer_url1 = create_imdb_link_1(movie_imdbId)
                     trailer_url2 = create_imdb_link_2(movie_imdbId)
                     st.markdown(f"imdbId URL 1: [{movie_name} imdbId]({trailer_url1})")
                     st.markdown(f"imdbId URL 2: [{movie_name} imdbId]({trailer_url2})")
+                if SHOW_STAGE_TIMINGS:
+                    with st.expander('Stage timings of this request'):
+                        recorded = last_trace('recommend')
+                        st.table(recorded.breakdown())
+                        if recorded.profile:
+                            st.text(recorded.profile)
+                        if recorded.memory:
+                            st.json(recorded.memory)
                     
             except:
                 st.error("Oops! Looks like this algorithm doesn't work. We'll need to fix it!")
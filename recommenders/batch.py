@@ -0,0 +1,195 @@
+"""
+
+    Offline batch recommendation job.
+
+    Author: Explore Data Science Academy.
+
+    Description: Precomputes recommendations for many favourite-movie
+    triples so that they can be served from a lookup. The input triples
+    are sharded across a process pool; every worker loads the models and
+    indexes once, when it starts, and results are streamed to a JSON-lines
+    output file in input order.
+
+    Usage (from the root of the repo):
+
+        python -m recommenders.batch triples.jsonl recommendations.jsonl --workers 4
+
+    Each input line is either a JSON list of titles or a tab-separated
+    list of titles. `--user-triples N` writes the top-3 rated movies of the
+    first N users in ratings.csv to the input file first.
+
+"""
+# Dependencies
+import os
+import sys
+import json
+import time
+import argparse
+import resource as rusage
+from multiprocessing import Pool
+import numpy as np
+from recommenders.collaborative_based import collab_backend
+
+# Name -> (module, function) of the engines a worker can run.
+ALGORITHMS = {
+    'content': ('recommenders.content_based', 'content_model'),
+    'collab': ('recommenders.collaborative_based', 'collab_model'),
+}
+
+# Engine -> recommender registry backend whose resources it reads.
+BACKENDS = {
+    'content': 'content',
+    'collab': collab_backend(),
+}
+
+# Engines loaded by the current worker process.
+_engines = {}
+
+def worker_resources(algorithms):
+    """Names of the resources used by the given engines: those of their
+    registry backends, plus the popularity rankings they fall back to."""
+    from recommenders import registry
+    names = []
+    for backend in [BACKENDS[name] for name in algorithms] + ['popularity']:
+        names += [r for r in registry.backend(backend).resources if r not in names]
+    return names
+
+def _init_worker(algorithms):
+    """Import the requested engines and warm their resources, once per worker."""
+    import importlib
+    from utils.resources import warm_up
+    if 'content' in algorithms:
+        from recommenders.content_based import ensure_content_index
+        ensure_content_index()
+    for name in algorithms:
+        module_name, function_name = ALGORITHMS[name]
+        _engines[name] = getattr(importlib.import_module(module_name), function_name)
+    warm_up(worker_resources(algorithms))
+
+def _recommend(job):
+    """Run every loaded engine on one triple."""
+    movies, top_n = job
+    record = {'movies': movies}
+    for name, engine in _engines.items():
+        try:
+            record[name] = engine(movies, top_n)
+        except Exception as e:
+            record[name] = None
+            record.setdefault('errors', {})[name] = f'{type(e).__name__}: {e}'
+    # ru_maxrss is reported in kilobytes on Linux.
+    return record, os.getpid(), rusage.getrusage(rusage.RUSAGE_SELF).ru_maxrss
+
+def read_triples(path):
+    """Yield the favourite-movie lists stored in `path`, one per line."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            yield json.loads(line) if line.lstrip().startswith('[') else line.split('\t')
+
+def user_triples(n_users=None, ratings_path=None):
+    """Top-3 rated movie titles of each user in ratings.csv.
+
+    Parameters
+    ----------
+    n_users : int, optional
+        Only use the first `n_users` users.
+    ratings_path : str, optional
+        Path to ratings.csv.
+
+    Returns
+    -------
+    list[list[str]]
+        One list of three titles per user with at least three rated
+        movies in the catalogue.
+
+    """
+    from utils.catalog import load_catalog
+    from utils.data_loader import RATINGS_PATH, load_table
+    catalog = load_catalog()
+    ratings = load_table(ratings_path or RATINGS_PATH)
+    users = np.asarray(ratings['userId'])
+    rows = catalog.rows(np.asarray(ratings['movieId']).tolist(), missing=-1)
+    known = rows >= 0
+    # Sort by user, then by descending rating (ties by catalogue row).
+    order = np.lexsort((rows[known], -np.asarray(ratings['rating'])[known], users[known]))
+    users, rows = users[known][order], rows[known][order]
+    _, starts = np.unique(users, return_index=True)
+    stops = np.append(starts[1:], len(users))
+    triples = []
+    for start, stop in list(zip(starts, stops))[:n_users]:
+        if stop - start >= 3:
+            triples.append(catalog.titles_at(rows[start:start + 3]))
+    return triples
+
+def run(input_path, output_path, algorithms=('content', 'collab'), workers=None,
+        top_n=10, chunksize=16):
+    """Compute recommendations for every triple in `input_path`.
+
+    Parameters
+    ----------
+    input_path : str
+        File of favourite-movie triples (see module docstring).
+    output_path : str
+        JSON-lines file receiving one record per input triple.
+    algorithms : tuple(str)
+        Engines to run, out of `ALGORITHMS`.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    top_n : int
+        Number of recommendations per engine and triple.
+    chunksize : int
+        Triples handed to a worker at a time.
+
+    Returns
+    -------
+    dict
+        Summary with the number of triples, errors, elapsed seconds,
+        throughput (triples/sec) and peak RSS (MB) of each worker.
+
+    """
+    jobs = ((movies, top_n) for movies in read_triples(input_path))
+    # Loading in the parent lets forked workers share the loaded pages;
+    # workers started with 'spawn' load everything in their initializer.
+    _init_worker(tuple(algorithms))
+    count = errors = 0
+    peak_rss = {}
+    start = time.perf_counter()
+    with Pool(workers, initializer=_init_worker, initargs=(tuple(algorithms),)) as pool, \
+            open(output_path, 'w', encoding='utf-8') as out:
+        for record, pid, rss in pool.imap(_recommend, jobs, chunksize=chunksize):
+            out.write(json.dumps(record) + '\n')
+            count += 1
+            errors += 'errors' in record
+            peak_rss[pid] = max(peak_rss.get(pid, 0), rss)
+    elapsed = time.perf_counter() - start
+    return {'triples': count,
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'triples_per_second': round(count / elapsed, 2) if elapsed else None,
+            'worker_peak_rss_mb': {str(pid): round(rss / 1024, 1) for pid, rss in peak_rss.items()}}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='file of favourite-movie triples')
+    parser.add_argument('output', help='JSON-lines file to write recommendations to')
+    parser.add_argument('--algorithms', nargs='+', default=list(ALGORITHMS), choices=list(ALGORITHMS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--user-triples', type=int, metavar='N', default=None,
+                        help='first write the top-3 movies of the first N users to INPUT')
+    args = parser.parse_args(argv)
+    if args.user_triples is not None:
+        with open(args.input, 'w', encoding='utf-8') as f:
+            for triple in user_triples(args.user_triples):
+                f.write(json.dumps(triple) + '\n')
+    summary = run(args.input, args.output, args.algorithms, args.workers,
+                  args.top_n, args.chunksize)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    main()
@@ -28,25 +28,166 @@
 """
 
 # Script dependencies
-import pandas as pd
+import os
 import numpy as np
 
-import pickle
-from surprise import Reader, Dataset
-from sklearn.metrics.pairwise import cosine_similarity
+from functools import partial
+from scipy import sparse
+from recommenders.factor_model import FactorModel, convert, load_factor_pickle, read_meta
+from recommenders.quantization import load_quantized
+from recommenders.ingestion import live_ratings, load_user_ratings
+from recommenders.cooccurrence import COOCCURRENCE_PATH, build_cooccurrence_index, is_fresh
+from recommenders.popularity import recommend_rows
+from utils.ann import IVFIndex
+from utils.similarity_index import l2_normalize_rows, load_index
+from utils.catalog import load_catalog
+from utils.data_loader import RATINGS_PATH
+from utils.instrumentation import span
+from utils.resources import resource
+from utils.scoring import UnknownFavouritesError, aggregate, favourite_weights
+
+# Location of the trained SVD model and of its array-format export
+MODEL_PATH = 'resources/models/SVD.pkl'
+FACTORS_PATH = 'resources/models/svd_factors'
+# Strategies of `collab_model` -> recommender registry backend serving
+# them: 'cooccurrence' (precomputed neighbours of movies rated highly by
+# the same users), 'neighbourhood' (ratings of similar users) or
+# 'item_factors' (nearest neighbours in SVD item-factor space).
+COLLAB_MODES = {
+    'cooccurrence': 'cooccurrence',
+    'neighbourhood': 'collaborative',
+    'item_factors': 'svd_factor',
+}
+# Strategy used by `collab_model`, one of `COLLAB_MODES`
+COLLAB_MODE = os.environ.get('COLLAB_MODE', 'cooccurrence')
+# Serve a quantized copy of the SVD factors: 'float16', 'int8' or unset
+SVD_QUANTIZATION = os.environ.get('SVD_QUANTIZATION') or None
+
+def collab_backend(mode=None):
+    """Name of the recommender registry backend serving a `collab_model`
+    strategy.
 
-# Importing data
-movies_df = pd.read_csv('resources/data/movies.csv')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
+    Parameters
+    ----------
+    mode : str, optional
+        One of `COLLAB_MODES`; defaults to `COLLAB_MODE`.
+
+    Returns
+    -------
+    str
+        Registry backend name.
 
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
+    """
+    mode = COLLAB_MODE if mode is None else mode
+    if mode not in COLLAB_MODES:
+        raise ValueError(f"Unknown COLLAB_MODE {mode!r}; expected one of {list(COLLAB_MODES)}")
+    return COLLAB_MODES[mode]
 
 # We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('resources/models/SVD.pkl', 'rb'))
+@resource('svd_model')
+def load_factor_model(path=FACTORS_PATH, pickle_path=MODEL_PATH):
+    """Load the SVD model as an array-backed `FactorModel`.
+
+    The model is loaded once per process, on first use, by memory-mapping
+    its array export. The export is (re)created from the pickled model
+    when it is missing or was converted from an older version of it.
+    A conversion whose predictions differ from the pickled model's by
+    more than `PARITY_TOLERANCE` raises `ValueError` and is not used.
+    With `SVD_QUANTIZATION` set, its float16 or int8 copy is served.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the model in the format written by
+        `FactorModel.save`, or path to a pickled model.
+    pickle_path : str
+        Pickled `surprise.SVD` model to convert from.
+
+    Returns
+    -------
+    FactorModel
+        The model's parameters, ready for batched scoring.
+
+    """
+    if os.path.isfile(path):
+        return load_factor_pickle(path)
+    if os.path.exists(pickle_path):
+        meta = read_meta(path) if os.path.exists(os.path.join(path, 'meta.json')) else {}
+        stat = os.stat(pickle_path)
+        if not meta or (meta.get('source') == pickle_path and
+                        (meta.get('source_size'), meta.get('source_mtime_ns')) != (stat.st_size, stat.st_mtime_ns)):
+            convert(pickle_path, path, sample=100)
+    if SVD_QUANTIZATION:
+        return load_quantized(path, SVD_QUANTIZATION)
+    return FactorModel.load(path)
+
+def neighbourhood_matrix(user_ids, movie_ids):
+    """Build the sparse movie-by-user rating matrix of a neighbourhood.
+
+    Users seen in the ratings stream contribute their current ratings;
+    every other user their ratings from the snapshot.
+
+    Parameters
+    ----------
+    user_ids : list
+        MovieLens users forming the neighbourhood.
+    movie_ids : list
+        Favourite movies of the app user, who is added as the last
+        column with a rating of 5 for each of them.
+
+    Returns
+    -------
+    tuple(scipy.sparse.csr_matrix, numpy.ndarray)
+        Ratings matrix with one row per rated movie, and the movieId of
+        each row (ascending).
+
+    """
+    index = load_user_ratings()
+    users = np.unique(user_ids)
+    live = live_ratings().user_ratings(users)
+    pos = np.minimum(np.searchsorted(index['user_ids'], users), len(index['user_ids']) - 1)
+    in_snapshot = index['user_ids'][pos] == users
+    items, ratings = [], []
+    for user, p, known in zip(users.tolist(), pos, in_snapshot):
+        if user in live:
+            items.append(live[user][0])
+            ratings.append(live[user][1])
+        elif known:
+            start, stop = index['offsets'][p], index['offsets'][p + 1]
+            items.append(index['movie_ids'][start:stop])
+            ratings.append(index['ratings'][start:stop])
+    favourites = np.unique(movie_ids)
+    n_users = len(items)
+    columns = np.concatenate([np.repeat(np.arange(n_users), [len(i) for i in items]),
+                              np.full(len(favourites), n_users)])
+    items = np.concatenate(items + [favourites])
+    ratings = np.concatenate(ratings + [np.full(len(favourites), 5, dtype=np.float32)])
+    movie_index, rows = np.unique(items, return_inverse=True)
+    matrix = sparse.csr_matrix((ratings, (rows, columns)), shape=(len(movie_index), n_users + 1))
+    return matrix, movie_index
+
+def minmax_rows(matrix):
+    """Min-max scale every row of a sparse ratings matrix to [0, 1].
+
+    Unrated entries count as 0, exactly as in a zero-filled pivot table,
+    so they stay 0 after scaling and the matrix stays sparse. Rows whose
+    values are all equal become all-zero.
+
+    """
+    matrix = matrix.tocsr(copy=True)
+    counts = np.diff(matrix.indptr)
+    row_min = np.minimum.reduceat(matrix.data, matrix.indptr[:-1])
+    row_max = np.maximum.reduceat(matrix.data, matrix.indptr[:-1])
+    row_min = np.where(counts < matrix.shape[1], np.minimum(row_min, 0), row_min)
+    width = row_max - row_min
+    scale = np.divide(1.0, width, out=np.zeros_like(width), where=width > 0)
+    matrix.data = (matrix.data - np.repeat(row_min, counts)) * np.repeat(scale, counts)
+    matrix.eliminate_zeros()
+    return matrix
 
 def prediction_item(item_id):
-    """Map a given favourite movie to users within the
-       MovieLens dataset with the same preference.
+    """Estimate how every user within the MovieLens dataset would rate
+       a given favourite movie.
 
     Parameters
     ----------
@@ -55,19 +196,11 @@ def prediction_item(item_id):
 
     Returns
     -------
-    list
-        User IDs of users with similar high ratings for the given movie.
+    numpy.ndarray
+        Estimated rating of the movie by each user of the SVD model.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0.5, 5))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
-
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
-    return predictions
+    return load_factor_model().score_users([item_id])[:, 0]
 
 def pred_movies(movie_list):
     """Maps the given favourite movies selected within the app to corresponding
@@ -76,7 +209,7 @@ def pred_movies(movie_list):
     Parameters
     ----------
     movie_list : list
-        Three favourite movies selected by the app user.
+        Favourite movies selected by the app user.
 
     Returns
     -------
@@ -84,94 +217,252 @@ def pred_movies(movie_list):
         User-ID's of users with similar high ratings for each movie.
 
     """
-    # Store the id of users
-    id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
-    # Return a list of user id's
-    return id_store
+    catalog = load_catalog()
+    movie_ids = [catalog.movie_id(title) for title in movie_list]
+    # Take the top 10 user id's from each movie with highest rankings,
+    # scoring all users (including those folded in from the ratings
+    # stream) against all movies in a single pass.
+    return load_factor_model().top_users(movie_ids, n=10,
+                                         overrides=live_ratings().folded_users(load_factor_model())).ravel().tolist()
+
+@resource('svd_item_index')
+def load_item_index():
+    """Build the approximate nearest-neighbour index over the SVD item
+    factors (once per process, on first use).
 
-# !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
-# You are, however, encouraged to change its content.  
+    Returns
+    -------
+    IVFIndex
+        Cosine index whose rows are the SVD model's item rows.
 
-def collab_model(movie_list,top_n=10):
-    """Short summary.
-    arameters
+    """
+    return IVFIndex(load_factor_model().item_vectors(slice(None)))
+
+def item_factor_scores(favourites, method='sum', k=50):
+    """Score the movies closest to the favourites in the item-factor
+       space learnt by the SVD model.
+
+    Parameters
+    ----------
+    favourites : list (str) or dict
+        Favourite titles, or a mapping of title to weight.
+    method : str
+        How the favourites' similarities are combined; see
+        `utils.scoring.AGGREGATIONS`.
+    k : int
+        Neighbours searched per favourite.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        Score of every catalogue row (`-inf` for movies that neighbour no
+        favourite) and the catalogue rows of the favourites. Raises
+        `UnknownFavouritesError` when the SVD model knows no favourite.
+
+    """
+    catalog = load_catalog()
+    titles, weights = favourite_weights(favourites, known=catalog.__contains__)
+    model = load_factor_model()
+    rows = model.item_rows([catalog.movie_id(title) for title in titles])
+    known = rows >= 0
+    if not known.any():
+        raise UnknownFavouritesError('None of the chosen movies are known to the SVD model')
+    with span('svd_factor.candidates'):
+        neighbours, similarity = load_item_index().search(model.item_vectors(rows[known]), k=k)
+    # Sparse favourites x item-rows matrix of the neighbours' similarities
+    lengths = [len(n) for n in neighbours]
+    matrix = sparse.csr_matrix((np.concatenate(similarity), np.concatenate(neighbours),
+                                np.concatenate([[0], np.cumsum(lengths)])),
+                               shape=(known.sum(), len(model.item_ids)))
+    # Only movies that neighbour a favourite are candidates.
+    candidates = np.unique(matrix.indices)
+    with span('svd_factor.similarity'):
+        item_scores = aggregate(matrix[:, candidates], weights[known], method)
+    movie_rows = catalog.rows(model.item_ids[candidates], missing=-1)
+    scores = np.full(len(catalog), -np.inf)
+    scores[movie_rows[movie_rows >= 0]] = item_scores[movie_rows >= 0]
+    return scores, catalog.title_rows(titles)
+
+def item_factor_model(movie_list, top_n=10):
+    """Recommend the movies closest to the favourites in the item-factor
+       space learnt by the SVD model.
+
+    Parameters
     ----------
-    movie_list : type
-        Description of parameter `movie_list`.
-    top_n : type
-        Description of parameter `top_n`.
+    movie_list : list (str) or dict
+        Favorite movies chosen by the app user, or a mapping of title to
+        weight.
+    top_n : int
+        Number of top recommendations to return to the user.
+
     Returns
     -------
-    type
-        Description of returned object.
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
     """
-    #getting list of ids of 10 users that rated movies highly
-    user_ids = pred_movies(movie_list)
+    # Spare neighbours cover the favourites themselves and unlisted movies.
+    k = top_n + len(movie_list) + 10
+    return load_catalog().titles_at(recommend_rows(partial(item_factor_scores, k=k), movie_list, top_n))
+
+@resource('cooccurrence_index')
+def load_cooccurrence_index(path=COOCCURRENCE_PATH):
+    """Open the co-occurrence index, building it first if it is missing
+    or was built from an older ratings.csv.
+
+    Returns
+    -------
+    dict
+        Memory-mapped index, as returned by `load_index`.
+
+    """
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        index = load_index(path)
+        if is_fresh(index, RATINGS_PATH):
+            return index
+    return build_cooccurrence_index(path, RATINGS_PATH)
+
+def cooccurrence_scores(favourites, method='sum'):
+    """Score the movies most often rated highly together with the
+       favourites.
+
+    Parameters
+    ----------
+    favourites : list (str) or dict
+        Favourite titles, or a mapping of title to weight.
+    method : str
+        How the favourites' similarities are combined; see
+        `utils.scoring.AGGREGATIONS`.
 
-    #obtaining the ratings of the users
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        Score of every catalogue row (`-inf` for movies that neighbour no
+        favourite) and the catalogue rows of the favourites. Raises
+        `UnknownFavouritesError` when no favourite has neighbours.
 
-    df_init_users = ratings_df[ratings_df['userId'].isin(user_ids)]
+    """
+    catalog = load_catalog()
+    titles, weights = favourite_weights(favourites, known=catalog.__contains__)
+    index = load_cooccurrence_index()
+    item_ids = index['item_ids']
+    movie_ids = np.array([catalog.movie_id(title) for title in titles], dtype=np.int64)
+    rows = np.minimum(np.searchsorted(item_ids, movie_ids), len(item_ids) - 1)
+    known = item_ids[rows] == movie_ids
+    if not known.any():
+        raise UnknownFavouritesError('None of the chosen movies has been rated highly enough to have neighbours')
+    with span('cooccurrence.candidates'):
+        neighbours = np.asarray(index['neighbours'][rows[known]])
+        similarity = np.asarray(index['scores'][rows[known]])
+        valid = neighbours >= 0
+        # Sparse favourites x indexed-movies matrix of the neighbours' similarities
+        matrix = sparse.csr_matrix((similarity[valid], neighbours[valid],
+                                    np.concatenate([[0], np.cumsum(valid.sum(axis=1))])),
+                                   shape=(known.sum(), len(item_ids)))
+        candidates = np.unique(matrix.indices)
+    with span('cooccurrence.similarity'):
+        item_scores = aggregate(matrix[:, candidates], weights[known], method)
+    movie_rows = catalog.rows(item_ids[candidates].tolist(), missing=-1)
+    scores = np.full(len(catalog), -np.inf)
+    scores[movie_rows[movie_rows >= 0]] = item_scores[movie_rows >= 0]
+    return scores, catalog.title_rows(titles)
+
+def collab_scores(favourites, method='sum'):
+    """Score every catalogue movie against any number of favourites using
+       the ratings of the users most likely to enjoy them.
 
-    # for i in user_ids:
-    #     df_init_users = df_init_users.append(ratings_df[ratings_df['userId']==i])
+    Parameters
+    ----------
+    favourites : list (str) or dict
+        Favourite titles, or a mapping of title to weight.
+    method : str
+        How the favourites' similarities are combined; see
+        `utils.scoring.AGGREGATIONS`.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        Score of every catalogue row (0 for movies the neighbourhood did
+        not rate) and the catalogue rows of the favourites. Favourites
+        unknown to the SVD model are ignored; `UnknownFavouritesError` is
+        raised when there are none left.
+
+    """
+    catalog = load_catalog()
+    titles, weights = favourite_weights(favourites, known=catalog.__contains__)
+    idx = catalog.title_rows(titles)
+    rated = load_factor_model().item_rows([catalog.movie_id(movie) for movie in titles]) >= 0
+    if not rated.any():
+        raise UnknownFavouritesError('None of the chosen movies are known to the SVD model')
+    titles, weights = [title for title, r in zip(titles, rated) if r], weights[rated]
+    #getting list of ids of 10 users per favourite that rated it highly
+    with span('collab.candidate_users'):
+        user_ids = pred_movies(titles)
 
-    df_init_users=df_init_users.drop_duplicates().reset_index(drop=True)
-    
     #obtaining movieIds from movie titles
-    movie_ids = []
-    for movie in movie_list:
-        movie_ids.append(int(movies_df['movieId'][movies_df['title']==movie]))
-    
-    #adding new user
-    new_row1 = {'userId':1234567, 'movieId':movie_ids[0], 'rating':5}
-    new_row2 = {'userId':1234567, 'movieId':movie_ids[1], 'rating':5}
-    new_row3 = {'userId':1234567, 'movieId':movie_ids[2], 'rating': 5}
-    df_init_users = df_init_users.append([new_row1,new_row2,new_row3],ignore_index=True)
-
-    #pivot ratings
-    pivot_user = pd.pivot_table(df_init_users,values='rating',columns='userId',index='movieId')
-    pivot_user.fillna(0, inplace=True)
-    
-    pivot_user = pivot_user.apply(lambda x: (x-np.min(x))/(np.max(x)-np.min(x)), axis=1)
-
-    pivot_user_arr =  np.array(pivot_user)
-    
-    #finding movies similarities based on users
-    cosine_sim=cosine_similarity(pivot_user_arr,pivot_user_arr)
-    
-    #mat
-    m_index_list = list(pivot_user.index)
-    df = movies_df[movies_df['movieId'].isin(m_index_list)].reset_index(drop=True)
-
-    #Obtaining indices
-    indices = pd.Series(df['title'])
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-
-    # Appending the names of movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-    recommended_movies = []
-    # Choose top 50
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies_df['title'])[i])
-    return recommended_movies
\ No newline at end of file
+    movie_ids = [catalog.movie_id(movie) for movie in titles]
+
+    #sparse ratings of the users, plus the app user rating each favourite 5
+    with span('collab.neighbourhood'):
+        ratings_matrix, m_index_list = neighbourhood_matrix(user_ids, movie_ids)
+        ratings_matrix = l2_normalize_rows(minmax_rows(ratings_matrix))
+
+    #finding movies similarities based on users, for the chosen movies only
+    with span('collab.similarity'):
+        query_rows = np.searchsorted(m_index_list, movie_ids)
+        similarity = aggregate(ratings_matrix[query_rows].dot(ratings_matrix.T), weights, method)
+
+    #spreading the neighbourhood's movies over the catalogue
+    scores = np.zeros(len(catalog))
+    rows = catalog.rows(m_index_list.tolist(), missing=-1)
+    scores[rows[rows >= 0]] = similarity[rows >= 0]
+    return scores, idx
+
+# !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
+# You are, however, encouraged to change its content.  
+
+def collab_model(movie_list,top_n=10):
+    """Performs collaborative filtering based upon a list of movies supplied
+       by the app user.
+
+    The strategy is chosen by `COLLAB_MODE`:
+
+    - 'cooccurrence' (default): the favourites' precomputed neighbours in
+      the co-occurrence index of movies rated highly by the same users.
+    - 'neighbourhood': similarities between movies over the ratings of
+      users who rated the favourites highly, including streamed users.
+    - 'item_factors': nearest neighbours of the favourites in the SVD
+      model's item-factor space.
+
+    Popular movies of the favourites' genres fill in for favourites that
+    the chosen strategy does not know.
+
+    Parameters
+    ----------
+    movie_list : list (str) or dict
+        Favorite movies chosen by the app user, or a mapping of title to
+        weight.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    Raises
+    ------
+    ValueError
+        If `COLLAB_MODE` is not one of `COLLAB_MODES`.
+
+    """
+    backend = collab_backend()
+    if backend == 'svd_factor':
+        return item_factor_model(movie_list, top_n)
+    if backend == 'cooccurrence':
+        return load_catalog().titles_at(recommend_rows(cooccurrence_scores, movie_list, top_n))
+
+    # Summing the similarities to each favourite, then taking the best
+    # scoring movies other than the favourites; popular movies of the
+    # favourites' genres fill in for favourites without ratings
+    return load_catalog().titles_at(recommend_rows(collab_scores, movie_list, top_n))
\ No newline at end of file
@@ -29,23 +29,36 @@
 
 # Script dependencies
 import os
-import pandas as pd
+import fcntl
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+from scipy import sparse
+from recommenders.content_features import FEATURES_VERSION, build_features
+from recommenders.popularity import recommend_rows
+from utils.similarity_index import top_k_similarity, save_index, load_index
+from utils.catalog import load_catalog
+from utils.data_loader import MOVIES_PATH, load_frame
+from utils.instrumentation import span
+from utils.resources import resource
+from utils.scoring import IndexNotReadyError, UnknownFavouritesError, aggregate, aggregate_groups, favourite_weights
 
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
+# Location of the precomputed top-K similarity index
+INDEX_PATH = 'resources/models/content_index'
+# Number of neighbours stored per movie
+INDEX_K = 50
 
-def data_preprocessing(subset_size):
+# Thread building a missing or stale index for this process
+_builder = None
+_builder_lock = threading.Lock()
+
+def data_preprocessing(subset_size=None):
     """Prepare data for use within Content filtering algorithm.
 
     Parameters
     ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+    subset_size : int, optional
+        Number of movies to use within the algorithm. Defaults to the
+        full catalogue.
 
     Returns
     -------
@@ -53,12 +66,183 @@ def data_preprocessing(subset_size):
         Subset of movies selected for content-based filtering.
 
     """
+    # Importing data
+    movies = load_frame(MOVIES_PATH)
+    movies.dropna(inplace=True)
+    movies.reset_index(drop=True, inplace=True)
     # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ',regex=True)
+    movies['keyWords'] = movies['genres'].str.replace('|', ' ', regex=False)
     # Subset of the data
     movies_subset = movies[:subset_size]
     return movies_subset
 
+def build_content_index(path=INDEX_PATH, k=INDEX_K, block_size=512):
+    """Compute and persist the top-k content neighbours of every movie.
+
+    Movies are compared on the TF-IDF genre, title and release year
+    features of `recommenders.content_features`; only movies appended to
+    movies.csv since the last build are tokenised again.
+
+    Parameters
+    ----------
+    path : str
+        Directory in which to store the index.
+    k : int
+        Number of neighbours to keep per movie.
+    block_size : int
+        Number of movies scored at a time.
+
+    Returns
+    -------
+    dict
+        The freshly built index, as returned by `load_index`.
+
+    """
+    features = build_features(catalog=load_catalog())
+    neighbours, scores = top_k_similarity(features['matrix'], k=k, block_size=block_size)
+    save_index(path, features['movie_ids'], neighbours, scores,
+               meta={'features': 'tfidf', 'features_version': FEATURES_VERSION,
+                     'vocabulary_size': features['meta']['n_tokens']})
+    return load_index(path)
+
+def _current_index(path):
+    """The index stored at `path`, or None if it is missing or was built
+    from a different version of movies.csv or of the features."""
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        index = load_index(path)
+        if np.array_equal(index['item_ids'], load_catalog().movie_ids) and \
+                index['meta'].get('features_version') == FEATURES_VERSION:
+            return index
+    return None
+
+def _build_exclusively(path, wait=False):
+    """Build the index unless another process is building it.
+
+    With `wait`, wait for that other build instead, and only build if
+    the index is still missing or stale once it is over.
+
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{os.path.normpath(path)}.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return
+        if _current_index(path) is None:
+            build_content_index(path)
+
+def build_in_background(path=INDEX_PATH):
+    """Start building the index on a daemon thread, unless one is running."""
+    global _builder
+    with _builder_lock:
+        if _builder is None or not _builder.is_alive():
+            _builder = threading.Thread(target=_build_exclusively, args=(path,),
+                                        name='content-index-build', daemon=True)
+            _builder.start()
+        return _builder
+
+def ensure_content_index(path=INDEX_PATH):
+    """Build the index now if it is missing or stale (for offline jobs)."""
+    if _current_index(path) is None:
+        _build_exclusively(path, wait=True)
+
+@resource('content_index')
+def load_content_index(path=INDEX_PATH):
+    """Open the content index (once per process, on first use).
+
+    A missing or stale index takes over a minute to build, so it is not
+    built on the request path: it is built in the background and, until
+    it is ready, `IndexNotReadyError` makes the recommenders fall back
+    to the popularity rankings. Build it ahead of time with
+    `python -m recommenders.content_based`.
+
+    Parameters
+    ----------
+    path : str
+        Directory containing the index.
+
+    Returns
+    -------
+    dict
+        Memory-mapped index, as returned by `load_index`.
+
+    """
+    index = _current_index(path)
+    if index is None:
+        build_in_background(path)
+        raise IndexNotReadyError('The content index is being built; popular movies are recommended meanwhile')
+    return index
+
+def content_scores(favourites, method='sum'):
+    """Score every catalogue movie against any number of favourites.
+
+    Parameters
+    ----------
+    favourites : list (str) or dict
+        Favourite titles, or a mapping of title to weight.
+    method : str
+        How the favourites' similarities are combined; see
+        `utils.scoring.AGGREGATIONS`.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        Score of every catalogue row (0 outside the favourites' top-K
+        neighbours) and the catalogue rows of the favourites. Titles
+        missing from the catalogue are ignored; `UnknownFavouritesError`
+        is raised when none is found.
+
+    """
+    catalog = load_catalog()
+    titles, weights = favourite_weights(favourites, known=catalog.__contains__)
+    if not titles:
+        raise UnknownFavouritesError('None of the chosen movies are in the catalogue')
+    # Getting the index of the movies that match the titles
+    idx = catalog.title_rows(titles)
+    with span('content.candidates'):
+        neighbours = _neighbour_matrix(idx)
+    with span('content.similarity'):
+        return aggregate(neighbours, weights, method), idx
+
+def content_scores_many(favourite_lists, method='sum'):
+    """Score every catalogue movie for several requests in one pass.
+
+    Parameters
+    ----------
+    favourite_lists : list
+        One set of favourites (titles or title -> weight mapping) per
+        request.
+    method : str
+        How each request's similarities are combined.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, list (numpy.ndarray))
+        Scores of shape `(n_requests, n_movies)` and the catalogue rows
+        of each request's favourites. Requests without any favourite in
+        the catalogue score 0 everywhere.
+
+    """
+    catalog = load_catalog()
+    split = [favourite_weights(favourites, known=catalog.__contains__) for favourites in favourite_lists]
+    idx = [catalog.title_rows(titles) for titles, _ in split]
+    groups = np.repeat(np.arange(len(split)), [len(rows) for rows in idx])
+    weights = np.concatenate([w for _, w in split] + [np.empty(0)])
+    rows = np.concatenate(idx + [np.empty(0, dtype=np.int64)])
+    scores = np.zeros((len(split), len(catalog)))
+    totals = aggregate_groups(_neighbour_matrix(rows), groups, weights, method)
+    scores[:len(totals)] = totals
+    return scores, idx
+
+def _neighbour_matrix(idx):
+    """Sparse favourites x movies matrix of the favourites' neighbour scores."""
+    index = load_content_index()
+    neighbours = np.asarray(index['neighbours'][idx])
+    return sparse.csr_matrix(
+        (np.asarray(index['scores'][idx]).ravel(), neighbours.ravel(),
+         np.arange(0, neighbours.size + 1, max(neighbours.shape[1], 1))[:len(idx) + 1]),
+        shape=(len(idx), len(load_catalog())))
+
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
 def content_model(movie_list,top_n=10):
@@ -67,8 +251,9 @@ def content_model(movie_list,top_n=10):
 
     Parameters
     ----------
-    movie_list : list (str)
-        Favorite movies chosen by the app user.
+    movie_list : list (str) or dict
+        Favorite movies chosen by the app user, any number of them, or a
+        mapping of title to weight.
     top_n : type
         Number of top recommendations to return to the user.
 
@@ -78,35 +263,12 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
-    return recommended_movies
\ No newline at end of file
+    # Highest total score first, excluding the chosen movies; ties are
+    # broken by catalogue order. Popular movies of the favourites' genres
+    # make up for favourites with too few (or no) neighbours.
+    return load_catalog().titles_at(recommend_rows(content_scores, movie_list, top_n))
+
+if __name__ == '__main__':
+    # Offline build step: python -m recommenders.content_based
+    build_content_index()
+    print(f"Content index saved to: {INDEX_PATH}")
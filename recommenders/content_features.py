@@ -0,0 +1,180 @@
+"""
+
+    Sparse TF-IDF content features of the movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds the feature matrix behind content-based filtering.
+    Every movie is described by three groups of tokens:
+
+      - its genres;
+      - the words and word pairs of its title (without the release year,
+        with trailing articles such as ", The" removed and common stop
+        words dropped);
+      - buckets of its release year, parsed from the title (the decade
+        and the half-decade).
+
+    Token counts are weighted by inverse document frequency, scaled per
+    group and L2-normalised, so the cosine similarity of two movies is the
+    dot product of their rows. Tokens seen in a single movie carry no
+    similarity and are left out.
+
+    The raw token counts are persisted, so when rows
+    are appended to movies.csv only the new movies are tokenised.
+
+"""
+# Dependencies
+import os
+import re
+import json
+import numpy as np
+from scipy import sparse
+from utils.catalog import load_catalog
+from utils.data_loader import staged_directory
+from utils.genre_index import parse_year, strip_year
+from utils.similarity_index import l2_normalize_rows
+
+# Location of the persisted features
+FEATURES_PATH = 'resources/models/content_features'
+# Bumped whenever tokenisation or weighting changes
+FEATURES_VERSION = 1
+# Relative weight of each token group
+GROUP_WEIGHTS = {'genre': 1.0, 'title': 0.5, 'year': 0.5}
+# Tokens must appear in at least this many movies to be used
+MIN_DF = 2
+
+STOP_WORDS = frozenset(
+    'a an and as at by for from in into is it its of on or the to with '
+    'le la les l de des du el los un une der die das aka'.split())
+_ARTICLE = re.compile(r',\s*(the|a|an|le|la|les|l\'|el|los|der|die|das)\b', re.IGNORECASE)
+_WORD = re.compile(r'[a-z0-9]+')
+
+def title_tokens(title):
+    """Words and adjacent word pairs of a title, without its year."""
+    text = _ARTICLE.sub('', strip_year(title)).lower()
+    words = [w for w in _WORD.findall(text) if w not in STOP_WORDS]
+    return ([f'title:{w}' for w in words] +
+            [f'title:{a}_{b}' for a, b in zip(words, words[1:])])
+
+def year_tokens(year):
+    """Decade and half-decade buckets of a release year."""
+    if year is None:
+        return ['year:unknown']
+    return [f'year:{year // 10 * 10}s', f'year:{year // 5 * 5}-{year // 5 * 5 + 4}']
+
+def genre_tokens(genres):
+    """One token per genre of a pipe-separated genre string."""
+    if not isinstance(genres, str) or genres == '(no genres listed)':
+        return []
+    return [f'genre:{g.strip().lower()}' for g in genres.split('|') if g.strip()]
+
+def movie_tokens(title, genres):
+    """All feature tokens of one movie."""
+    return genre_tokens(genres) + title_tokens(title) + year_tokens(parse_year(title))
+
+def _count_rows(titles, genres, vocabulary):
+    """Token-count CSR rows of several movies, growing `vocabulary`."""
+    indptr, indices = [0], []
+    for title, genre in zip(titles, genres):
+        columns = [vocabulary.setdefault(token, len(vocabulary)) for token in movie_tokens(title, genre)]
+        indices.extend(columns)
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    counts = sparse.csr_matrix((data, np.array(indices, dtype=np.int32), np.array(indptr)),
+                               shape=(len(titles), len(vocabulary)))
+    counts.sum_duplicates()
+    return counts
+
+def tfidf(counts, tokens):
+    """Weighted, L2-normalised TF-IDF matrix of raw token counts.
+
+    Parameters
+    ----------
+    counts : scipy.sparse.csr_matrix
+        Token counts, one row per movie.
+    tokens : list (str)
+        Token of every column.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        float32 feature matrix with unit-norm rows (or all-zero rows).
+
+    """
+    n_docs = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+    group = np.array([GROUP_WEIGHTS[token.split(':', 1)[0]] for token in tokens])
+    weights = np.where(df >= MIN_DF, idf * group, 0.0)
+    return l2_normalize_rows(counts.dot(sparse.diags(weights.astype(np.float32))))
+
+def build_features(path=FEATURES_PATH, catalog=None):
+    """Build or update the persisted features of the catalogue.
+
+    If the stored features cover a prefix of the catalogue (i.e. rows
+    were only appended to movies.csv), only the new movies are tokenised;
+    otherwise everything is rebuilt.
+
+    Parameters
+    ----------
+    path : str
+        Directory holding the features.
+    catalog : MovieCatalog, optional
+        Defaults to `load_catalog()`.
+
+    Returns
+    -------
+    dict
+        `matrix` (TF-IDF CSR), `movie_ids`, `tokens` and `meta`, where
+        `meta['added']` is the number of newly tokenised movies.
+
+    """
+    catalog = catalog or load_catalog()
+    movie_ids = np.asarray(catalog.movie_ids)
+    stored = _load_counts(path)
+    if stored is not None and len(stored['movie_ids']) <= len(movie_ids) and \
+            np.array_equal(stored['movie_ids'], movie_ids[:len(stored['movie_ids'])]):
+        vocabulary = {token: i for i, token in enumerate(stored['tokens'])}
+        counts, start = stored['counts'], len(stored['movie_ids'])
+    else:
+        vocabulary, counts, start = {}, None, 0
+    if counts is None or start < len(movie_ids):
+        new = _count_rows(catalog.titles[start:], catalog.genres[start:], vocabulary)
+        if counts is not None:
+            counts = sparse.vstack([sparse.csr_matrix(counts, shape=(counts.shape[0], len(vocabulary))),
+                                    new]).tocsr()
+        else:
+            counts = new
+        tokens = sorted(vocabulary, key=vocabulary.get)
+        _save_counts(path, counts, movie_ids, tokens, len(movie_ids) - start)
+    else:
+        tokens = stored['tokens']
+    meta = {'version': FEATURES_VERSION, 'n_movies': len(movie_ids), 'n_tokens': len(tokens),
+            'added': len(movie_ids) - start}
+    return {'matrix': tfidf(counts, tokens), 'movie_ids': movie_ids, 'tokens': tokens, 'meta': meta}
+
+def _save_counts(path, counts, movie_ids, tokens, added):
+    # Replaced in one rename, so a build never sees half of an older one
+    with staged_directory(path) as staging:
+        sparse.save_npz(os.path.join(staging, 'counts.npz'), counts)
+        np.save(os.path.join(staging, 'movie_ids.npy'), np.asarray(movie_ids, dtype=np.int32))
+        with open(os.path.join(staging, 'tokens.json'), 'w', encoding='utf-8') as f:
+            json.dump(tokens, f, ensure_ascii=False)
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump({'version': FEATURES_VERSION, 'n_movies': len(movie_ids),
+                       'n_tokens': len(tokens), 'added': added,
+                       'group_weights': GROUP_WEIGHTS, 'min_df': MIN_DF}, f, indent=2)
+
+def _load_counts(path):
+    """Stored counts, ids and tokens, or None if missing or outdated."""
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            if json.load(f).get('version') != FEATURES_VERSION:
+                return None
+        with open(os.path.join(path, 'tokens.json'), encoding='utf-8') as f:
+            tokens = json.load(f)
+        return {'counts': sparse.load_npz(os.path.join(path, 'counts.npz')).tocsr(),
+                'movie_ids': np.load(os.path.join(path, 'movie_ids.npy')),
+                'tokens': tokens}
+    except (OSError, ValueError):
+        return None
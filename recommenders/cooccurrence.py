@@ -0,0 +1,118 @@
+"""
+
+    Item co-occurrence index built from the ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Two movies co-occur when the same user rated both highly.
+    `build_cooccurrence_index` streams ratings.csv in chunks, keeping only
+    ratings of at least `MIN_RATING`, into a sparse binary user x movie
+    matrix X and computes the cosine similarity of the movies' columns,
+    D^-1/2 X'X D^-1/2 (D holding each movie's number of high ratings),
+    a block of movies at a time with sparse products. Neither the full
+    ratings table nor the movie x movie matrix is ever held in memory.
+
+    Only the top-K neighbours of every movie are kept, stored as
+    memory-mappable arrays in the format of `utils.similarity_index`, so
+    that `collab_model` looks up its candidates in O(K) per favourite.
+    Ratings streamed after the build (see `recommenders.ingestion`) are
+    picked up by the next build.
+
+    Usage (from the root of the repo):
+
+        python -m recommenders.cooccurrence --k 100 --min-rating 4
+
+"""
+# Dependencies
+import os
+import time
+import argparse
+import numpy as np
+from scipy import sparse
+from recommenders.training import read_ratings
+from utils.data_loader import RATINGS_PATH
+from utils.similarity_index import top_k_sparse_rows, save_index, load_index
+
+COOCCURRENCE_PATH = 'resources/models/cooccurrence_index'
+# Neighbours stored per movie
+COOCCURRENCE_K = 100
+# Ratings below this value are ignored
+MIN_RATING = 4.0
+
+def build_cooccurrence_index(path=COOCCURRENCE_PATH, ratings_path=RATINGS_PATH, k=COOCCURRENCE_K,
+                             min_rating=MIN_RATING, block_size=512, chunksize=1_000_000):
+    """Compute and persist the top-k co-occurrence neighbours of every movie.
+
+    Parameters
+    ----------
+    path : str
+        Directory in which to store the index.
+    ratings_path : str
+        Ratings CSV.
+    k : int
+        Number of neighbours to keep per movie.
+    min_rating : float
+        Lowest rating counted as a co-occurrence.
+    block_size : int
+        Number of movies scored at a time. The product of a block holds
+        at most `block_size * n_movies` entries.
+    chunksize : int
+        Rows of the CSV parsed at a time.
+
+    Returns
+    -------
+    dict
+        The freshly built index, as returned by `load_index`. Movies with
+        fewer than k neighbours have their remaining neighbours set to -1.
+
+    """
+    users, items, _ = read_ratings(ratings_path, chunksize, min_rating)
+    item_ids, columns = np.unique(items, return_inverse=True)
+    _, rows = np.unique(users, return_inverse=True)
+    del users, items
+    liked = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                              shape=(rows.max() + 1 if len(rows) else 0, len(item_ids)))
+    # A user rating a movie twice still counts once
+    liked.data[:] = 1.0
+    norms = np.sqrt(np.asarray(liked.sum(axis=0)).ravel())
+    liked = liked.dot(sparse.diags(1.0 / np.maximum(norms, 1.0)).astype(np.float32)).tocsr()
+    liked_t = liked.T.tocsr()
+    k = min(k, max(len(item_ids) - 1, 1))
+    neighbours = np.empty((len(item_ids), k), dtype=np.int32)
+    scores = np.empty((len(item_ids), k), dtype=np.float32)
+    for start in range(0, len(item_ids), block_size):
+        stop = min(start + block_size, len(item_ids))
+        block = liked_t[start:stop].dot(liked)
+        neighbours[start:stop], scores[start:stop] = top_k_sparse_rows(block, k, skip=np.arange(start, stop))
+    stat = os.stat(ratings_path)
+    save_index(path, item_ids, neighbours, scores,
+               meta={'features': 'cooccurrence', 'similarity': 'cosine', 'min_rating': min_rating,
+                     'n_ratings': len(rows), 'source': ratings_path,
+                     'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns})
+    return load_index(path)
+
+def is_fresh(index, ratings_path=RATINGS_PATH):
+    """Whether `index` was built from the current version of the ratings."""
+    meta = index['meta']
+    try:
+        stat = os.stat(ratings_path)
+    except OSError:
+        return True
+    return (meta.get('source'), meta.get('source_size'), meta.get('source_mtime_ns')) == \
+        (ratings_path, stat.st_size, stat.st_mtime_ns)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the item co-occurrence index.')
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--output', default=COOCCURRENCE_PATH)
+    parser.add_argument('--k', type=int, default=COOCCURRENCE_K)
+    parser.add_argument('--min-rating', type=float, default=MIN_RATING)
+    parser.add_argument('--block-size', type=int, default=512)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    index = build_cooccurrence_index(args.output, args.ratings, args.k, args.min_rating, args.block_size)
+    print(f"Co-occurrence index of {len(index['item_ids'])} movies built in "
+          f"{time.perf_counter() - start:.2f}s. Saved to: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+
+    Offline evaluation of the recommender backends.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures how well each registered backend predicts what
+    users go on to like, so that optimisations can be checked against
+    accuracy as well as speed.
+
+    ratings.csv is split on its `timestamp` column: the ratings before
+    the cutoff are the past and those after it the future. For every
+    user with enough past ratings, the user's highest rated past movies
+    are the favourites given to a backend, and the future movies the
+    user rated at least `RELEVANT_RATING` are the relevant ones. Users
+    are sharded across a process pool; each worker loads the backends
+    once and scores its users with `registry.recommend_many`. The top-K
+    lists are then compared with the relevant movies as a users x K hit
+    matrix, from which precision@K, recall@K, NDCG@K and catalogue
+    coverage are computed with a few NumPy operations.
+
+    The shipped models and indexes were fitted on the whole of
+    ratings.csv, which includes the future ratings, so collaborative
+    scores are optimistic. `--write-split DIR` writes the past and future
+    ratings to `DIR/train.csv` and `DIR/test.csv`, from which the models
+    can be rebuilt (e.g. `python -m recommenders.cooccurrence --ratings
+    DIR/train.csv`) for an unbiased comparison.
+
+    Usage (from the root of the repo):
+
+        python -m recommenders.evaluation --algorithms content cooccurrence --k 10 --workers 4
+
+"""
+# Dependencies
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from utils.catalog import load_catalog
+from utils.data_loader import RATINGS_PATH, SCHEMAS, load_table
+
+# Share of the ratings, by time, held out as the future
+TEST_FRACTION = 0.2
+# Favourites given to a backend per user
+N_FAVOURITES = 3
+# Lowest future rating counted as relevant
+RELEVANT_RATING = 4.0
+
+def load_ratings(path=RATINGS_PATH):
+    """Columns of a ratings CSV.
+
+    ratings.csv itself is read through the columnar cache of
+    `utils.data_loader`; other files with the same columns, such as the
+    train.csv written by `--write-split`, are parsed with pandas.
+
+    Returns
+    -------
+    dict
+        Column name to array, as returned by `load_table`.
+
+    """
+    if os.path.basename(path) == os.path.basename(RATINGS_PATH):
+        return load_table(path)
+    schema = SCHEMAS['ratings']
+    frame = pd.read_csv(path, usecols=list(schema), dtype=schema)
+    return {column: frame[column].to_numpy() for column in schema}
+
+def time_split(ratings, test_fraction=TEST_FRACTION):
+    """Boolean mask of the ratings after the time cutoff.
+
+    Parameters
+    ----------
+    ratings : dict
+        Columns of ratings.csv, as returned by `load_ratings`.
+    test_fraction : float
+        Share of the ratings, latest first, that fall after the cutoff.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, int)
+        The mask and the cutoff timestamp.
+
+    """
+    timestamps = np.asarray(ratings['timestamp'])
+    cutoff = int(np.quantile(timestamps, 1 - test_fraction))
+    return timestamps >= cutoff, cutoff
+
+def _group_starts(sorted_users):
+    users, starts = np.unique(sorted_users, return_index=True)
+    return users, starts, np.append(starts[1:], len(sorted_users))
+
+def evaluation_cases(ratings, test, catalog, n_favourites=N_FAVOURITES,
+                     relevant_rating=RELEVANT_RATING, n_users=None, seed=0):
+    """Favourites and relevant movies of every evaluated user.
+
+    Parameters
+    ----------
+    ratings : dict
+        Columns of ratings.csv.
+    test : numpy.ndarray
+        Mask of the future ratings (see `time_split`).
+    catalog : MovieCatalog
+        The shared catalogue. Ratings of movies missing from it are
+        ignored, and movies sharing a title count as the one the title
+        resolves to.
+    n_favourites : int
+        Highest rated past movies given as favourites (the latest first
+        among equal ratings). Users with fewer past movies are skipped.
+    relevant_rating : float
+        Lowest future rating counted as relevant. Users without relevant
+        future movies are skipped.
+    n_users : int, optional
+        Evaluate a random sample of this many users.
+    seed : int
+        Seed of the user sample.
+
+    Returns
+    -------
+    dict
+        `user_ids`, `favourites` (lists of titles), and the relevant
+        catalogue rows of every user in CSR form (`relevant_ptr`,
+        `relevant_rows`, rows ascending within a user).
+
+    """
+    users = np.asarray(ratings['userId'], dtype=np.int64)
+    values = np.asarray(ratings['rating'], dtype=np.float32)
+    # Movie id -> catalogue row, then row -> row its title resolves to
+    order = np.argsort(catalog.movie_ids)
+    sorted_ids = catalog.movie_ids[order]
+    movie_ids = np.asarray(ratings['movieId'], dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_ids, movie_ids), len(sorted_ids) - 1)
+    canonical = catalog.title_rows(catalog.titles)
+    rows = np.where(sorted_ids[pos] == movie_ids, canonical[order[pos]], -1)
+
+    past = ~test & (rows >= 0)
+    order = np.lexsort((-np.asarray(ratings['timestamp'], dtype=np.int64)[past], -values[past], users[past]))
+    past_users, past_rows = users[past][order], rows[past][order]
+    past_ids, starts, stops = _group_starts(past_users)
+    enough = stops - starts >= n_favourites
+    past_ids, starts = past_ids[enough], starts[enough]
+
+    future = test & (rows >= 0) & (values >= relevant_rating)
+    order = np.lexsort((rows[future], users[future]))
+    future_users, future_rows = users[future][order], rows[future][order]
+    future_ids, future_starts, future_stops = _group_starts(future_users)
+
+    user_ids, in_past, in_future = np.intersect1d(past_ids, future_ids, return_indices=True)
+    if n_users is not None and n_users < len(user_ids):
+        sample = np.sort(np.random.default_rng(seed).choice(len(user_ids), n_users, replace=False))
+        user_ids, in_past, in_future = user_ids[sample], in_past[sample], in_future[sample]
+    favourite_rows = past_rows[starts[in_past][:, None] + np.arange(n_favourites)]
+    relevant = [np.unique(future_rows[a:b]) for a, b in zip(future_starts[in_future], future_stops[in_future])]
+    return {
+        'user_ids': user_ids,
+        'favourites': [catalog.titles_at(fav) for fav in favourite_rows],
+        'relevant_ptr': np.concatenate([[0], np.cumsum([len(r) for r in relevant])]).astype(np.int64),
+        'relevant_rows': np.concatenate(relevant + [np.empty(0, dtype=np.int64)]).astype(np.int64),
+    }
+
+def ranking_metrics(recommended, relevant_ptr, relevant_rows, n_items):
+    """Precision, recall, NDCG and coverage of top-K lists.
+
+    Parameters
+    ----------
+    recommended : numpy.ndarray
+        `(n_users, K)` catalogue rows recommended to each user, best
+        first, padded with -1.
+    relevant_ptr, relevant_rows : numpy.ndarray
+        Relevant catalogue rows of every user in CSR form, ascending
+        within a user.
+    n_items : int
+        Size of the catalogue.
+
+    Returns
+    -------
+    dict
+        Means over users of precision@K, recall@K and NDCG@K (binary
+        relevance), the share of users with at least one hit, and the
+        share of the catalogue recommended to anyone.
+
+    """
+    n_users, k = recommended.shape
+    n_relevant = np.diff(relevant_ptr)
+    # One key per (user, row) pair, so all lists are matched in one pass
+    relevant_keys = np.repeat(np.arange(n_users, dtype=np.int64), n_relevant) * n_items + relevant_rows
+    hits = np.isin(np.arange(n_users, dtype=np.int64)[:, None] * n_items + recommended, relevant_keys)
+    hits &= recommended >= 0
+    n_hits = hits.sum(axis=1)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = np.cumsum(discounts)[np.minimum(n_relevant, k) - 1]
+    shown = recommended[recommended >= 0]
+    return {
+        f'precision@{k}': float(np.mean(n_hits / k)),
+        f'recall@{k}': float(np.mean(n_hits / n_relevant)),
+        f'ndcg@{k}': float(np.mean(hits.dot(discounts) / ideal)),
+        f'hit_rate@{k}': float(np.mean(n_hits > 0)),
+        'coverage': len(np.unique(shown)) / n_items,
+    }
+
+# Algorithm evaluated by the current worker process
+_worker = {}
+
+def _init_worker(algorithm):
+    """Load `algorithm`'s backends once per worker."""
+    from recommenders import registry
+    from recommenders.content_based import ensure_content_index
+    for name in (registry.HYBRID_BLEND if algorithm == 'hybrid' else [algorithm]):
+        if name == 'content':
+            # Built now rather than scoring popularity while it is built
+            ensure_content_index()
+        registry.backend(name).load()
+    _worker['algorithm'] = algorithm
+
+def _recommend_rows(job):
+    """Top-K catalogue rows of a shard of users, padded with -1."""
+    from recommenders import registry
+    start, favourite_lists, k = job
+    algorithm = _worker['algorithm']
+    catalog = load_catalog()
+    began = time.perf_counter()
+    try:
+        results = registry.recommend_many(favourite_lists, algorithm, k, use_cache=False)
+        errors = 0
+    except Exception:
+        # Isolate the requests the backend cannot serve
+        results, errors = [], 0
+        for favourites in favourite_lists:
+            try:
+                results.append(registry.recommend(favourites, algorithm, k, use_cache=False))
+            except Exception:
+                results.append([])
+                errors += 1
+    rows = np.full((len(favourite_lists), k), -1, dtype=np.int64)
+    for i, titles in enumerate(results):
+        rows[i, :len(titles)] = catalog.title_rows(titles)
+    return start, rows, errors, time.perf_counter() - began
+
+def evaluate(cases, algorithm, k=10, workers=None, shard_size=64):
+    """Recommend to every evaluated user with one algorithm and score the lists.
+
+    Parameters
+    ----------
+    cases : dict
+        As returned by `evaluation_cases`.
+    algorithm : str
+        One of `registry.names()`.
+    k : int
+        Length of the recommendation lists.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    shard_size : int
+        Users handed to a worker at a time.
+
+    Returns
+    -------
+    dict
+        The `ranking_metrics`, the number of users and failed requests,
+        the elapsed seconds and the throughput (users/sec).
+
+    """
+    favourites = cases['favourites']
+    jobs = [(start, favourites[start:start + shard_size], k)
+            for start in range(0, len(favourites), shard_size)]
+    recommended = np.full((len(favourites), k), -1, dtype=np.int64)
+    # Loading in the parent lets forked workers share the loaded pages
+    _init_worker(algorithm)
+    errors = 0
+    start = time.perf_counter()
+    with Pool(workers, initializer=_init_worker, initargs=(algorithm,)) as pool:
+        for first, rows, failed, _ in pool.imap_unordered(_recommend_rows, jobs):
+            recommended[first:first + len(rows)] = rows
+            errors += failed
+    elapsed = time.perf_counter() - start
+    report = {'algorithm': algorithm, 'users': len(favourites), 'errors': errors}
+    report.update(ranking_metrics(recommended, cases['relevant_ptr'], cases['relevant_rows'],
+                                  len(load_catalog())))
+    report.update(seconds=round(elapsed, 3),
+                  users_per_second=round(len(favourites) / elapsed, 2) if elapsed else None)
+    return report
+
+def write_split(ratings, test, directory):
+    """Write the past and future ratings to `directory`/train.csv and test.csv."""
+    os.makedirs(directory, exist_ok=True)
+    frame = pd.DataFrame({column: np.asarray(ratings[column])
+                          for column in ('userId', 'movieId', 'rating', 'timestamp')})
+    frame[~test].to_csv(os.path.join(directory, 'train.csv'), index=False)
+    frame[test].to_csv(os.path.join(directory, 'test.csv'), index=False)
+
+def main(argv=None):
+    from recommenders import registry
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--algorithms', nargs='+', default=registry.names(), choices=registry.names())
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--test-fraction', type=float, default=TEST_FRACTION)
+    parser.add_argument('--favourites', type=int, default=N_FAVOURITES)
+    parser.add_argument('--relevant-rating', type=float, default=RELEVANT_RATING)
+    parser.add_argument('--users', type=int, default=None, help='evaluate a sample of this many users')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--shard-size', type=int, default=64)
+    parser.add_argument('--write-split', metavar='DIR', default=None,
+                        help='also write the train and test ratings to DIR')
+    args = parser.parse_args(argv)
+    ratings = load_ratings(args.ratings)
+    test, cutoff = time_split(ratings, args.test_fraction)
+    if args.write_split:
+        write_split(ratings, test, args.write_split)
+    cases = evaluation_cases(ratings, test, load_catalog(), args.favourites,
+                             args.relevant_rating, args.users)
+    reports = [evaluate(cases, algorithm, args.k, args.workers, args.shard_size)
+               for algorithm in args.algorithms]
+    json.dump({'cutoff_timestamp': cutoff, 'users': len(cases['user_ids']), 'reports': reports},
+              sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""
+
+    Vectorised scoring with matrix-factorisation (SVD) models.
+
+    Author: Explore Data Science Academy.
+
+    Description: The trained SVD model is only needed for its
+    learnt parameters. `FactorModel` copies the user/item factors, biases
+    and id mappings into plain NumPy arrays so that a whole column of
+    user scores can be produced by a single matrix-vector product instead
+    of one `model.predict` call (and one `Prediction` object) per user.
+
+    `FactorModel.save` writes those arrays as `.npy` files plus a small
+    `meta.json`; `FactorModel.load` memory-maps them, so opening a model
+    is near-instant and every process serving it shares the same pages.
+    Convert a pickled `surprise.SVD` model with (from the root of the repo):
+
+        python -m recommenders.factor_model resources/models/SVD.pkl resources/models/svd_factors
+
+"""
+# Data handling dependencies
+import os
+import sys
+import json
+import pickle
+import numpy as np
+from utils.data_loader import staged_directory
+
+FORMAT_VERSION = 1
+# Largest prediction difference tolerated between a converted model and
+# the pickle it was converted from
+PARITY_TOLERANCE = 1e-6
+
+# Arrays written by `FactorModel.save`, in constructor order.
+ARRAYS = ['user_factors', 'user_bias', 'item_factors', 'item_bias', 'user_ids', 'item_ids']
+
+def _lookup(raw_ids):
+    """Sorted copy of `raw_ids` and the factor row of each sorted id."""
+    order = np.argsort(raw_ids, kind='stable')
+    return raw_ids[order], order
+
+def _rows(lookup, ids):
+    """Map raw ids to factor rows through a `_lookup`, using -1 if unknown."""
+    sorted_ids, order = lookup
+    ids = np.asarray(ids)
+    rows = np.full(ids.shape, -1, dtype=np.int64)
+    numeric = 'iuf'
+    if ids.size == 0 or len(sorted_ids) == 0 or \
+            (ids.dtype.kind in numeric) != (sorted_ids.dtype.kind in numeric):
+        return rows
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    found = sorted_ids[positions] == ids
+    rows[found] = order[positions[found]]
+    return rows
+
+class FactorModel:
+    """Biased matrix-factorisation model held as NumPy arrays.
+
+    The estimated rating of user `u` for item `i` is
+    `global_mean + user_bias[u] + item_bias[i] + user_factors[u] @ item_factors[i]`,
+    as in `surprise.SVD`. Items unknown to the model contribute neither
+    bias nor factors.
+
+    Parameters
+    ----------
+    user_factors, item_factors : numpy.ndarray
+        Latent factor matrices of shape `(n_users, k)` and `(n_items, k)`.
+    user_bias, item_bias : numpy.ndarray
+        Bias vectors of length `n_users` and `n_items`.
+    global_mean : float
+        Mean rating of the training data.
+    user_ids, item_ids : array-like
+        Raw (MovieLens) id of every factor row.
+    rating_scale : tuple(float, float)
+        Lowest and highest possible rating, used to clip predictions.
+    lookups : tuple, optional
+        Precomputed `(sorted ids, rows)` pairs for users and items, as
+        stored by `save`.
+
+    """
+
+    def __init__(self, user_factors, user_bias, item_factors, item_bias,
+                 global_mean, user_ids, item_ids, rating_scale=(0.5, 5.0), lookups=None):
+        self.user_factors = user_factors
+        self.user_bias = user_bias
+        self.item_factors = item_factors
+        self.item_bias = item_bias
+        self.global_mean = float(global_mean)
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        self.rating_scale = tuple(rating_scale)
+        self._user_lookup, self._item_lookup = lookups or (_lookup(self.user_ids), _lookup(self.item_ids))
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in ARRAYS + ['global_mean', 'rating_scale']}
+
+    def __setstate__(self, state):
+        self.__init__(*(state[name] for name in ARRAYS[:4]), state['global_mean'],
+                      state['user_ids'], state['item_ids'], state['rating_scale'])
+
+    @classmethod
+    def from_surprise(cls, model):
+        """Extract the learnt parameters of a fitted `surprise.SVD` model.
+
+        Parameters
+        ----------
+        model : surprise.SVD
+            Fitted model, e.g. as unpickled from `resources/models/SVD.pkl`.
+
+        Returns
+        -------
+        FactorModel
+            Array-backed copy of the model parameters.
+
+        """
+        trainset = model.trainset
+        user_ids = [trainset.to_raw_uid(u) for u in range(trainset.n_users)]
+        item_ids = [trainset.to_raw_iid(i) for i in range(trainset.n_items)]
+        return cls(np.asarray(model.pu), np.asarray(model.bu),
+                   np.asarray(model.qi), np.asarray(model.bi),
+                   trainset.global_mean, user_ids, item_ids,
+                   trainset.rating_scale)
+
+    def save(self, path, meta=None):
+        """Write the model as memory-mappable `.npy` files.
+
+        The files are written to a staging directory which then replaces
+        `path` in one rename, so processes serving the previous version
+        from its memory-mapped files are unaffected.
+
+        Parameters
+        ----------
+        path : str
+            Directory in which to store the model. Created if missing.
+        meta : dict, optional
+            Extra JSON-serialisable information stored in `meta.json`.
+
+        """
+        with staged_directory(path) as staging:
+            self._write(staging, meta)
+
+    def _write(self, path, meta=None):
+        """Write the arrays and `meta.json` of the model into `path`."""
+        for name in ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+        for kind, (_, order) in (('user', self._user_lookup), ('item', self._item_lookup)):
+            np.save(os.path.join(path, f'{kind}_order.npy'), order.astype(np.int32))
+        meta = dict(meta or {}, format_version=FORMAT_VERSION,
+                    global_mean=self.global_mean, rating_scale=list(self.rating_scale),
+                    n_users=len(self.user_ids), n_items=len(self.item_ids),
+                    n_factors=int(self.item_factors.shape[1]))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a model written by `save`.
+
+        Parameters
+        ----------
+        path : str
+            Directory containing the model.
+        mmap_mode : str or None
+            Passed on to `numpy.load`. The default memory-maps the arrays
+            read-only, so loading costs almost nothing and the pages are
+            shared by every process that opens the same files.
+
+        Returns
+        -------
+        FactorModel
+            The stored model.
+
+        """
+        meta = read_meta(path)
+        if meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported model format in {path}: {meta.get('format_version')}")
+        if meta.get('quantization') and cls is FactorModel:
+            from recommenders.quantization import QuantizedFactorModel
+            return QuantizedFactorModel.load(path, mmap_mode)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS}
+        lookups = []
+        for kind in ('user', 'item'):
+            order = np.load(os.path.join(path, f'{kind}_order.npy'), mmap_mode=mmap_mode)
+            lookups.append((arrays[f'{kind}_ids'][order], order))
+        return cls(*(arrays[name] for name in ARRAYS[:4]), meta['global_mean'],
+                   arrays['user_ids'], arrays['item_ids'], meta['rating_scale'], tuple(lookups))
+
+    def item_rows(self, item_ids):
+        """Map raw item ids to factor rows, using -1 for unknown items."""
+        return _rows(self._item_lookup, item_ids)
+
+    def user_rows(self, user_ids):
+        """Map raw user ids to factor rows, using -1 for unknown users."""
+        return _rows(self._user_lookup, user_ids)
+
+    def user_vectors(self, rows):
+        """Latent factors of the given user rows (or slice), as floats."""
+        return np.asarray(self.user_factors[rows])
+
+    def item_vectors(self, rows):
+        """Latent factors of the given item rows (or slice), as floats."""
+        return np.asarray(self.item_factors[rows])
+
+    def _item_terms(self, rows):
+        """Factor and bias terms of the given item rows (zero if unknown)."""
+        known = rows >= 0
+        vectors = self.item_vectors(rows[known])
+        factors = np.zeros((len(rows), self.item_factors.shape[1]), dtype=vectors.dtype)
+        bias = np.zeros(len(rows), dtype=self.item_bias.dtype)
+        factors[known] = vectors
+        bias[known] = self.item_bias[rows[known]]
+        return factors, bias
+
+    def score_users(self, item_ids):
+        """Estimate every user's (unclipped) rating of the given items.
+
+        Parameters
+        ----------
+        item_ids : list
+            Raw ids of the items to score.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of shape `(n_users, len(item_ids))`.
+
+        """
+        factors, bias = self._item_terms(self.item_rows(item_ids))
+        scores = self.user_factors.dot(factors.T)
+        scores += self.user_bias[:, None]
+        scores += bias + self.global_mean
+        return scores
+
+    def top_users(self, item_ids, n=10, overrides=None):
+        """Find the users with the highest estimated rating of each item.
+
+        Parameters
+        ----------
+        item_ids : list
+            Raw ids of the items to score.
+        n : int
+            Number of users to return per item.
+        overrides : tuple, optional
+            `(user_ids, user_bias, user_factors)` of users whose
+            parameters replace the model's, or who are added to it (e.g.
+            users folded in by `recommenders.ingestion`).
+
+        Returns
+        -------
+        numpy.ndarray
+            Raw user ids of shape `(len(item_ids), n)`, best first.
+
+        """
+        scores = self.score_users(item_ids).T
+        user_ids = self.user_ids
+        if overrides is not None and len(overrides[0]):
+            override_ids, bias, factors = overrides
+            item_factors, item_bias = self._item_terms(self.item_rows(item_ids))
+            extra = (factors.dot(item_factors.T) + bias[:, None] + item_bias + self.global_mean).T
+            rows = self.user_rows(override_ids)
+            known = rows >= 0
+            scores[:, rows[known]] = extra[:, known]
+            scores = np.hstack([scores, extra[:, ~known]])
+            user_ids = np.concatenate([user_ids, np.asarray(override_ids)[~known].astype(user_ids.dtype)])
+        n = min(n, scores.shape[1])
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+        return user_ids[np.take_along_axis(top, order, axis=1)]
+
+    def predict(self, user_ids, item_ids):
+        """Estimate the rating of each (user, item) pair.
+
+        Mirrors `surprise.SVD.predict`: unknown users and items fall back
+        to the biases that are available and estimates are clipped to the
+        rating scale.
+
+        Parameters
+        ----------
+        user_ids, item_ids : list
+            Raw ids of equal length.
+
+        Returns
+        -------
+        numpy.ndarray
+            Estimated ratings.
+
+        """
+        user_rows = self.user_rows(user_ids)
+        known = user_rows >= 0
+        vectors = self.user_vectors(user_rows[known])
+        user_factors = np.zeros((len(user_rows), self.user_factors.shape[1]), dtype=vectors.dtype)
+        user_bias = np.zeros(len(user_rows), dtype=self.user_bias.dtype)
+        user_factors[known] = vectors
+        user_bias[known] = self.user_bias[user_rows[known]]
+        item_factors, item_bias = self._item_terms(self.item_rows(item_ids))
+        estimates = self.global_mean + user_bias + item_bias
+        estimates += np.einsum('ij,ij->i', user_factors, item_factors)
+        return np.clip(estimates, *self.rating_scale)
+
+def read_meta(path):
+    """Read the `meta.json` of a model written by `FactorModel.save`."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+def load_factor_pickle(path):
+    """Load a pickled model as a `FactorModel`.
+
+    Parameters
+    ----------
+    path : str
+        Pickle of either a fitted `surprise.SVD` model (as written by
+        `resources/models/train_colbased.py`) or a `FactorModel` (as
+        written by `recommenders/training.py`).
+
+    Returns
+    -------
+    FactorModel
+        The model's parameters.
+
+    """
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    return model if isinstance(model, FactorModel) else FactorModel.from_surprise(model)
+
+def convert(pickle_path, path, sample=10000, seed=0, tolerance=PARITY_TOLERANCE):
+    """Convert a pickled model to the array format and check its predictions.
+
+    Parameters
+    ----------
+    pickle_path : str
+        Pickled `surprise.SVD` model (or `FactorModel`).
+    path : str
+        Directory to write the converted model to.
+    sample : int
+        Number of random (user, item) pairs on which the converted model's
+        predictions are compared with the pickled model's.
+    tolerance : float or None
+        Largest prediction difference accepted. Above it, `ValueError` is
+        raised and `path` is left as it was. None disables the check.
+
+    Returns
+    -------
+    float
+        Largest absolute difference between the two models' predictions.
+
+    """
+    with open(pickle_path, 'rb') as f:
+        original = pickle.load(f)
+    model = original if isinstance(original, FactorModel) else FactorModel.from_surprise(original)
+    stat = os.stat(pickle_path)
+    rng = np.random.default_rng(seed)
+    users = model.user_ids[rng.integers(len(model.user_ids), size=sample)].tolist()
+    items = model.item_ids[rng.integers(len(model.item_ids), size=sample)].tolist()
+    if isinstance(original, FactorModel):
+        expected = original.predict(users, items)
+    else:
+        expected = np.array([original.predict(u, i).est for u, i in zip(users, items)])
+    # The export is checked before it replaces `path`
+    with staged_directory(path) as staging:
+        model._write(staging, {'source': pickle_path, 'source_size': stat.st_size,
+                               'source_mtime_ns': stat.st_mtime_ns})
+        error = float(np.max(np.abs(FactorModel.load(staging).predict(users, items) - expected)))
+        if tolerance is not None and error > tolerance:
+            raise ValueError(f'The model converted from {pickle_path} predicts ratings up to '
+                             f'{error:.2e} away from the original (tolerance {tolerance:.0e})')
+    return error
+
+if __name__ == '__main__':
+    source, target = sys.argv[1:3]
+    error = convert(source, target)
+    print(f"Model converted to {target}; largest prediction difference: {error:.2e}")
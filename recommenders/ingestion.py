@@ -0,0 +1,346 @@
+"""
+
+    Streaming ingestion of new ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: ratings.csv is a static snapshot. New ratings are
+    appended to a second, append-only CSV file (the ratings stream, with
+    the same columns) and every serving process tails that file, so fresh
+    ratings reach the recommenders within seconds and without a restart.
+
+    `RatingsStore` applies the streamed ratings on top of the snapshot:
+
+      - the ratings of every user seen in the stream (a later rating of the
+        same movie replaces the earlier one), which `collab_model` uses
+        instead of the snapshot's for that user;
+      - per-movie rating counts and sums, from which the popularity
+        fallback of every recommender ranks movies;
+      - the bias and latent factors of those users, re-fitted against the
+        fixed item factors of the SVD model ("folding in"), so new users
+        become candidate neighbours without retraining the model.
+
+    Only these follow the stream. The co-occurrence index and the SVD
+    model itself are rebuilt offline from ratings.csv, so the default
+    `COLLAB_MODE` ('cooccurrence') and 'item_factors' reflect streamed
+    ratings through the popularity fallback alone; 'neighbourhood' uses
+    them for its neighbours as well.
+
+    Append a CSV of ratings to the stream with (from the root of the repo):
+
+        python -m recommenders.ingestion new_ratings.csv
+
+    or POST them to the `/ratings` endpoint of `edsa_api.py`.
+
+"""
+# Dependencies
+import os
+import sys
+import time
+import threading
+import numpy as np
+from utils.catalog import load_catalog
+from utils.data_loader import RATINGS_PATH, load_frame
+from utils.resources import resource
+
+# Append-only CSV of ratings received after the ratings.csv snapshot
+RATINGS_STREAM_PATH = os.environ.get('RATINGS_STREAM_PATH', 'resources/data/ratings_stream.csv')
+STREAM_HEADER = 'userId,movieId,rating,timestamp\n'
+RATING_SCALE = (0.5, 5.0)
+# Ridge penalties of the folded-in user bias and factors
+BIAS_REG = 1.0
+FACTOR_REG = 1.0
+
+def parse_ratings(records):
+    """Validate ratings given as dicts or `(user, movie, rating[, timestamp])`.
+
+    Returns
+    -------
+    list (tuple)
+        `(userId, movieId, rating, timestamp)` tuples. Raises `ValueError`
+        for a malformed record or a rating outside `RATING_SCALE`.
+
+    """
+    parsed = []
+    for record in records:
+        if isinstance(record, dict):
+            record = (record.get('userId'), record.get('movieId'), record.get('rating'),
+                      record.get('timestamp'))
+        user, movie, rating = int(record[0]), int(record[1]), float(record[2])
+        timestamp = record[3] if len(record) > 3 and record[3] is not None else time.time()
+        if not RATING_SCALE[0] <= rating <= RATING_SCALE[1]:
+            raise ValueError(f'Rating {rating} is outside {RATING_SCALE}')
+        parsed.append((user, movie, rating, int(timestamp)))
+    return parsed
+
+def append_ratings(records, path=RATINGS_STREAM_PATH):
+    """Append ratings to the ratings stream.
+
+    The batch is written with a single `write` to a file opened in append
+    mode, so batches from concurrent writers are not interleaved.
+
+    Parameters
+    ----------
+    records : iterable
+        Ratings, as accepted by `parse_ratings`.
+    path : str
+        The ratings stream.
+
+    Returns
+    -------
+    int
+        Number of ratings appended.
+
+    """
+    ratings = parse_ratings(records)
+    if not ratings:
+        return 0
+    lines = ''.join(f'{u},{m},{r:g},{t}\n' for u, m, r, t in ratings)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(lines if f.tell() else STREAM_HEADER + lines)
+    return len(ratings)
+
+class RatingsLog:
+    """Reader of the lines appended to the ratings stream since the last read.
+
+    Parameters
+    ----------
+    path : str
+        The ratings stream. It may not exist yet.
+
+    """
+
+    def __init__(self, path=RATINGS_STREAM_PATH):
+        self.path = path
+        self.offset = 0
+        self.malformed = 0
+
+    def read_new(self):
+        """Complete lines appended since the last call.
+
+        Returns
+        -------
+        tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray, bool)
+            User ids, movie ids and ratings, and whether the stream was
+            truncated (in which case it is read again from the start).
+
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        restarted = size < self.offset
+        if restarted:
+            self.offset = 0
+        users, movies, ratings = [], [], []
+        if size > self.offset:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+            # A partly written last line is picked up by the next read.
+            data = data[:data.rfind(b'\n') + 1]
+            self.offset += len(data)
+            for line in data.decode('utf-8').splitlines():
+                fields = line.split(',')
+                try:
+                    user, movie, rating = int(fields[0]), int(fields[1]), float(fields[2])
+                except (ValueError, IndexError):
+                    self.malformed += line != STREAM_HEADER.strip()
+                    continue
+                users.append(user)
+                movies.append(movie)
+                ratings.append(rating)
+        return (np.array(users, dtype=np.int64), np.array(movies, dtype=np.int64),
+                np.array(ratings, dtype=np.float32), restarted)
+
+class RatingsStore:
+    """The ratings snapshot plus everything streamed since.
+
+    Parameters
+    ----------
+    index : dict
+        Snapshot ratings grouped by user, as returned by
+        `load_user_ratings`.
+    catalog : MovieCatalog
+        The shared catalogue; movie aggregates follow its rows.
+    path : str
+        The ratings stream.
+
+    """
+
+    def __init__(self, index, catalog, path=RATINGS_STREAM_PATH):
+        self.index = index
+        self.catalog = catalog
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.log = RatingsLog(self.path)
+        # User -> {movieId: rating} for every user seen in the stream
+        self.users = {}
+        # User -> (bias, factors) re-fitted after the user's last rating,
+        # and the users rated since their last fold-in
+        self.fold_ins = {}
+        self._unfolded = set()
+        self.version = 0
+        self.ingested = 0
+        self._folded = None
+        rows = self.catalog.rows(self.index['movie_ids'].tolist(), missing=-1)
+        known = rows >= 0
+        self.item_count = np.bincount(rows[known], minlength=len(self.catalog)).astype(np.int64)
+        self.item_sum = np.bincount(rows[known], weights=self.index['ratings'][known],
+                                    minlength=len(self.catalog))
+
+    def refresh(self):
+        """Apply the ratings appended to the stream since the last refresh.
+
+        Cheap when nothing was appended (a single `stat` call).
+
+        Returns
+        -------
+        int
+            The store's version, incremented by every applied batch.
+
+        """
+        with self._lock:
+            users, movies, ratings, restarted = self.log.read_new()
+            if restarted:
+                self._reset()
+                users, movies, ratings, _ = self.log.read_new()
+            if len(users):
+                self._apply(users, movies, ratings)
+            return self.version
+
+    def _snapshot_ratings(self, user):
+        """{movieId: rating} of `user` in the snapshot."""
+        user_ids = self.index['user_ids']
+        pos = np.searchsorted(user_ids, user)
+        if pos == len(user_ids) or user_ids[pos] != user:
+            return {}
+        span = slice(self.index['offsets'][pos], self.index['offsets'][pos + 1])
+        return dict(zip(self.index['movie_ids'][span].tolist(), self.index['ratings'][span].tolist()))
+
+    def _apply(self, users, movies, ratings):
+        rows = self.catalog.rows(movies.tolist(), missing=-1)
+        for user, movie, rating, row in zip(users.tolist(), movies.tolist(), ratings.tolist(), rows):
+            rated = self.users.get(user)
+            if rated is None:
+                rated = self.users[user] = self._snapshot_ratings(user)
+            previous = rated.get(movie)
+            rated[movie] = rating
+            if row >= 0:
+                self.item_count[row] += previous is None
+                self.item_sum[row] += rating - (previous or 0.0)
+        self._unfolded.update(users.tolist())
+        self.ingested += len(users)
+        self.version += 1
+        self._folded = None
+
+    @staticmethod
+    def _fold_in(model, rated):
+        """Bias and factors of a user with ratings `rated`, fitted by
+        ridge regression against the model's fixed item parameters."""
+        rows = model.item_rows(list(rated))
+        known = rows >= 0
+        n_factors = model.item_factors.shape[1]
+        if not known.any():
+            return 0.0, np.zeros(n_factors)
+        factors = np.asarray(model.item_vectors(rows[known]), dtype=np.float64)
+        residual = np.fromiter(rated.values(), dtype=np.float64)[known] - model.global_mean \
+            - model.item_bias[rows[known]]
+        bias = residual.sum() / (BIAS_REG + known.sum())
+        gram = factors.T.dot(factors) + FACTOR_REG * np.eye(n_factors)
+        return bias, np.linalg.solve(gram, factors.T.dot(residual - bias))
+
+    def folded_users(self, model):
+        """User ids, biases and factors of every streamed user, in the
+        form expected by `FactorModel.top_users(overrides=...)`.
+
+        Users are folded into the item factors of `model` the first time
+        they are asked for after a new rating.
+
+        """
+        with self._lock:
+            for user in self._unfolded:
+                self.fold_ins[user] = self._fold_in(model, self.users[user])
+            self._unfolded.clear()
+            if self._folded is None:
+                user_ids = np.array(sorted(self.fold_ins), dtype=np.int64)
+                n_factors = model.item_factors.shape[1]
+                self._folded = (user_ids,
+                                np.array([self.fold_ins[u][0] for u in user_ids.tolist()]),
+                                np.array([self.fold_ins[u][1] for u in user_ids.tolist()]).reshape(-1, n_factors))
+            return self._folded
+
+    def user_ratings(self, user_ids):
+        """Current ratings of those `user_ids` that were seen in the stream.
+
+        Returns
+        -------
+        dict
+            User id to `(movie_ids, ratings)` arrays.
+
+        """
+        with self._lock:
+            return {user: (np.fromiter(self.users[user], dtype=np.int64, count=len(self.users[user])),
+                           np.fromiter(self.users[user].values(), dtype=np.float32,
+                                       count=len(self.users[user])))
+                    for user in set(np.asarray(user_ids).tolist()) if user in self.users}
+
+    def item_stats(self):
+        """Number of ratings and sum of the ratings of every catalogue
+        movie, streamed ratings included."""
+        with self._lock:
+            return self.item_count.copy(), self.item_sum.copy()
+
+    def stats(self):
+        """Counters of the store, reported by the API's `/metrics`."""
+        return {'version': self.version, 'ingested': self.ingested,
+                'stream_users': len(self.users), 'malformed_lines': self.log.malformed}
+
+@resource('user_ratings_index')
+def load_user_ratings():
+    """Group the ratings by user (once per process, on first use).
+
+    Returns
+    -------
+    dict
+        `user_ids` (sorted), `offsets` into the per-user slices, and the
+        `movie_ids` and `ratings` arrays ordered by user.
+
+    """
+    ratings_df = load_frame(RATINGS_PATH, columns=['userId', 'movieId', 'rating'])
+    users = ratings_df['userId'].to_numpy()
+    order = np.argsort(users, kind='stable')
+    user_ids, starts = np.unique(users[order], return_index=True)
+    return {'user_ids': user_ids,
+            'offsets': np.append(starts, len(order)),
+            'movie_ids': ratings_df['movieId'].to_numpy()[order],
+            'ratings': ratings_df['rating'].to_numpy()[order]}
+
+@resource('ratings_store')
+def load_ratings_store():
+    """Open the store of streamed ratings (once per process, on first use).
+
+    Returns
+    -------
+    RatingsStore
+        The snapshot ratings plus those appended to the ratings stream.
+
+    """
+    return RatingsStore(load_user_ratings(), load_catalog())
+
+def live_ratings():
+    """The ratings store, after applying newly streamed ratings."""
+    store = load_ratings_store()
+    store.refresh()
+    return store
+
+if __name__ == '__main__':
+    import pandas as pd
+    frame = pd.read_csv(sys.argv[1])
+    columns = [c for c in ('userId', 'movieId', 'rating', 'timestamp') if c in frame]
+    appended = append_ratings(frame[columns].itertuples(index=False, name=None))
+    print(f"Appended {appended} ratings to {RATINGS_STREAM_PATH}")
@@ -0,0 +1,339 @@
+"""
+
+    Popularity rankings used when the recommenders have too little to go on.
+
+    Author: Explore Data Science Academy.
+
+    Description: `build_popularity_index` streams ratings.csv once and
+    stores, for every catalogue movie, its number of ratings, its mean
+    rating and its Bayesian average
+
+        (C * m + sum of its ratings) / (C + number of its ratings),
+
+    which shrinks the mean of rarely rated movies towards the mean rating
+    m of all movies (C is the prior count). Movies are then ranked by
+    Bayesian average, overall and within every genre, and the rankings
+    are stored as memory-mappable arrays.
+
+    The recommenders fall back to these rankings when none of the
+    favourites is known to them (`UnknownFavouritesError`), and use them
+    to complete a top-N list when the favourites have fewer neighbours
+    than requested. The fallback ranks movies of the favourites' most
+    common genres (all movies when no favourite is in the catalogue) and
+    only reads the first entries of the precomputed rankings.
+
+    Ratings appended to the ratings stream (see `recommenders.ingestion`)
+    count too: once the stream has ratings, the rankings are computed
+    again from the counts and sums of `RatingsStore`, whenever a new
+    batch of ratings arrives.
+
+    The index is rebuilt automatically when ratings.csv or movies.csv
+    changes. Build it ahead of time with (from the root of the repo):
+
+        python -m recommenders.popularity
+
+"""
+# Dependencies
+import os
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+import numpy as np
+from recommenders.cooccurrence import is_fresh
+from recommenders.ingestion import RATINGS_STREAM_PATH, live_ratings
+from recommenders.training import read_ratings
+from utils.catalog import load_catalog
+from utils.data_loader import RATINGS_PATH, staged_directory
+from utils.genre_index import load_genre_index
+from utils.resources import resource
+from utils.scoring import UnknownFavouritesError, favourite_weights, top_n as select_top
+
+POPULARITY_PATH = 'resources/models/popularity'
+ARRAYS = ('item_ids', 'counts', 'means', 'scores', 'ranking', 'rank', 'genre_ptr', 'genre_rows')
+
+# Rankings including the streamed ratings: (index, store version, rankings)
+_live = (None, None, None)
+_live_lock = threading.Lock()
+
+def build_popularity_index(path=POPULARITY_PATH, ratings_path=RATINGS_PATH, prior_count=None,
+                           chunksize=1_000_000):
+    """Compute and persist the popularity rankings of the catalogue.
+
+    Parameters
+    ----------
+    path : str
+        Directory in which to store the index.
+    ratings_path : str
+        Ratings CSV.
+    prior_count : float, optional
+        Weight C of the mean rating in the Bayesian average. Defaults to
+        the mean number of ratings of the rated movies.
+    chunksize : int
+        Rows of the CSV parsed at a time.
+
+    Returns
+    -------
+    dict
+        The freshly built index, as returned by `load_popularity_arrays`.
+        `ranking` holds every catalogue row, rated movies first, by
+        decreasing Bayesian average (then number of ratings);
+        `genre_rows[genre_ptr[g]:genre_ptr[g + 1]]` is the same ranking
+        restricted to the g-th genre of `meta['genres']`.
+
+    """
+    catalog = load_catalog()
+    genres = load_genre_index()
+    _, movie_ids, ratings = read_ratings(ratings_path, chunksize)
+    order = np.argsort(catalog.movie_ids)
+    pos = np.minimum(np.searchsorted(catalog.movie_ids[order], movie_ids), len(order) - 1)
+    known = catalog.movie_ids[order][pos] == movie_ids
+    rows = order[pos[known]]
+    counts = np.bincount(rows, minlength=len(catalog))
+    sums = np.bincount(rows, weights=ratings[known], minlength=len(catalog))
+    rated = counts > 0
+    if prior_count is None:
+        prior_count = float(counts[rated].mean()) if rated.any() else 1.0
+    arrays, global_mean = rank_movies(counts, sums, prior_count, genres)
+    arrays['item_ids'] = catalog.movie_ids.astype(np.int32)
+    stat = os.stat(ratings_path)
+    meta = {'genres': genres.genres, 'global_mean': global_mean, 'prior_count': prior_count,
+            'n_ratings': int(known.sum()), 'n_rated': int(rated.sum()), 'source': ratings_path,
+            'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+    # Replaced in one rename: running processes memory-map the old arrays
+    with staged_directory(path) as staging:
+        for name in ARRAYS:
+            np.save(os.path.join(staging, f'{name}.npy'), arrays[name])
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+    return load_popularity_arrays(path)
+
+def rank_movies(counts, sums, prior_count, genres):
+    """Rank the catalogue by Bayesian average rating.
+
+    Parameters
+    ----------
+    counts, sums : numpy.ndarray
+        Number of ratings and sum of the ratings of every catalogue row.
+    prior_count : float
+        Weight C of the mean rating in the Bayesian average.
+    genres : GenreIndex
+        Genres of the catalogue rows.
+
+    Returns
+    -------
+    tuple(dict, float)
+        The arrays of `ARRAYS` but `item_ids`, and the mean rating m.
+
+    """
+    rated = counts > 0
+    global_mean = float(sums.sum() / max(counts.sum(), 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    scores = (prior_count * global_mean + sums) / (prior_count + counts)
+    ranking = np.lexsort((np.arange(len(counts)), -counts, -scores, ~rated))
+    rank = np.empty(len(counts), dtype=np.int64)
+    rank[ranking] = np.arange(len(counts))
+    per_genre = [ranking[(genres.bits[ranking] & genres.bit[genre]) != 0] for genre in genres.genres]
+    arrays = {
+        'counts': counts.astype(np.int32),
+        'means': means.astype(np.float32),
+        'scores': scores.astype(np.float32),
+        'ranking': ranking.astype(np.int32),
+        'rank': rank.astype(np.int32),
+        'genre_ptr': np.concatenate([[0], np.cumsum([len(r) for r in per_genre])]).astype(np.int64),
+        'genre_rows': np.concatenate(per_genre + [np.empty(0, dtype=np.int64)]).astype(np.int32),
+    }
+    return arrays, global_mean
+
+def load_popularity_arrays(path, mmap_mode='r'):
+    """Load an index written by `build_popularity_index`.
+
+    Returns
+    -------
+    dict
+        The arrays named in `ARRAYS` (memory-mapped by default) and `meta`.
+
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    index = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS}
+    index['meta'] = meta
+    return index
+
+@resource('popularity_index')
+def load_popularity_index(path=POPULARITY_PATH):
+    """Open the popularity index, building it first if it is missing or
+    was built from other versions of ratings.csv or movies.csv."""
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        index = load_popularity_arrays(path)
+        if is_fresh(index, RATINGS_PATH) and np.array_equal(index['item_ids'], load_catalog().movie_ids):
+            return index
+    return build_popularity_index(path, RATINGS_PATH)
+
+def live_popularity_index():
+    """The popularity index, ranked again with the streamed ratings.
+
+    The ratings store is only opened once the ratings stream exists, and
+    the rankings are only computed again when it applied new ratings.
+
+    """
+    global _live
+    index = load_popularity_index()
+    if not os.path.exists(RATINGS_STREAM_PATH):
+        return index
+    store = live_ratings()
+    if not store.version:
+        return index
+    with _live_lock:
+        if _live[0] is not index or _live[1] != store.version:
+            counts, sums = store.item_stats()
+            arrays, global_mean = rank_movies(counts, sums, index['meta']['prior_count'], load_genre_index())
+            arrays['item_ids'] = index['item_ids']
+            arrays['meta'] = dict(index['meta'], global_mean=global_mean, n_ratings=int(counts.sum()),
+                                  n_rated=int((counts > 0).sum()), stream_version=store.version)
+            _live = (index, store.version, arrays)
+        return _live[2]
+
+def favourite_rows(favourites):
+    """Catalogue rows of the favourites found in the catalogue."""
+    catalog = load_catalog()
+    return catalog.title_rows(favourite_weights(favourites, known=catalog.__contains__)[0])
+
+def favourite_genres(rows):
+    """Genres shared by the most favourites (none for no favourites)."""
+    genres = load_genre_index()
+    counts = Counter(genre for row in np.asarray(rows).tolist() for genre in genres.genres_of(row))
+    if not counts:
+        return []
+    most = max(counts.values())
+    return sorted(genre for genre, n in counts.items() if n == most)
+
+def popular_rows(n, genres=None, exclude=None, mask=None):
+    """Catalogue rows of the `n` most popular movies.
+
+    Parameters
+    ----------
+    n : int
+        Number of rows to return.
+    genres : list (str), optional
+        Only rank movies of any of these genres.
+    exclude : array-like, optional
+        Rows that must not be returned (e.g. the favourites).
+    mask : numpy.ndarray, optional
+        Boolean mask of the rows that may be returned (see
+        `utils.genre_index.GenreIndex.mask`).
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to `n` int64 rows, by decreasing Bayesian average. Without a
+        mask, only the first `n + len(exclude)` entries of each ranking
+        are read.
+
+    """
+    index = live_popularity_index()
+    exclude = np.asarray(exclude if exclude is not None else [], dtype=np.int64)
+    if genres:
+        position = {genre: i for i, genre in enumerate(index['meta']['genres'])}
+        rankings = [index['genre_rows'][index['genre_ptr'][position[g]]:index['genre_ptr'][position[g] + 1]]
+                    for g in genres if g in position]
+    else:
+        rankings = [index['ranking']]
+    candidates = []
+    for ranking in rankings:
+        ranking = np.asarray(ranking if mask is None else ranking[mask[ranking]], dtype=np.int64)
+        ranking = ranking[:n + len(exclude)]
+        candidates.append(ranking[~np.isin(ranking, exclude)][:n])
+    rows = np.unique(np.concatenate(candidates + [np.empty(0, dtype=np.int64)]))
+    return rows[np.argsort(index['rank'][rows], kind='stable')][:n]
+
+def popularity_scores(favourites, method='sum'):
+    """Score the movies of the favourites' most common genres by Bayesian
+    average rating (every movie when no favourite is in the catalogue).
+
+    `method` is accepted for compatibility with the other scoring
+    functions and ignored. Unrated movies, and movies of other genres,
+    score `-inf`.
+
+    """
+    index = live_popularity_index()
+    idx = favourite_rows(favourites)
+    scores = np.where(np.asarray(index['counts']) > 0, np.asarray(index['scores'], dtype=np.float64), -np.inf)
+    genres = favourite_genres(idx)
+    if genres:
+        scores = load_genre_index().apply(scores, include=genres)
+    return scores, idx
+
+def fill(scores, idx, n, mask=None):
+    """Top-n rows of `scores`, completed from the popularity rankings.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        Score of every catalogue row. Only positive, finite scores count
+        as recommendations.
+    idx : array-like
+        Catalogue rows of the favourites, whose genres choose the
+        popularity ranking. Neither they nor other movies of the same
+        title are returned.
+    n : int
+        Number of rows to return.
+    mask : numpy.ndarray, optional
+        Rows that may be returned by the popularity ranking.
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to `n` int64 rows: the best scored first, then the most popular
+        movies of the favourites' genres, then the most popular overall.
+
+    """
+    catalog = load_catalog()
+    idx = np.asarray(idx, dtype=np.int64)
+    exclude = catalog.all_title_rows(catalog.titles_at(idx))
+    top = select_top(scores, n, exclude=exclude)
+    top = top[scores[top] > 0]
+    if len(top) < n:
+        for genres in (favourite_genres(idx), None):
+            more = popular_rows(n - len(top), genres, np.concatenate([exclude, top]), mask)
+            top = np.concatenate([top, more])
+            if len(top) >= n or not genres:
+                break
+    return top
+
+def recommend_rows(scoring, favourites, n, method='sum'):
+    """Top-n rows of a scoring function, falling back to popularity.
+
+    Parameters
+    ----------
+    scoring : callable
+        Called as `scoring(favourites, method)`; returns the score of
+        every catalogue row and the favourites' rows, or raises
+        `UnknownFavouritesError`.
+    favourites : list (str) or dict
+        Favourite titles, or a mapping of title to weight.
+    n : int
+        Number of rows to return.
+
+    """
+    try:
+        scores, idx = scoring(favourites, method)
+    except UnknownFavouritesError:
+        scores, idx = np.full(len(load_catalog()), -np.inf), favourite_rows(favourites)
+    return fill(scores, idx, n)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the popularity rankings.')
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--output', default=POPULARITY_PATH)
+    parser.add_argument('--prior-count', type=float, default=None)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    index = build_popularity_index(args.output, args.ratings, args.prior_count)
+    print(f"Popularity rankings of {index['meta']['n_rated']} rated movies built in "
+          f"{time.perf_counter() - start:.2f}s. Saved to: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""
+
+    Quantized storage of the SVD factors.
+
+    Author: Explore Data Science Academy.
+
+    Description: The user and item factors (`pu` and `qi`) of the SVD
+    model are 200 float64 values per user and per item and dominate the
+    memory of every process serving the model. `QuantizedFactorModel`
+    stores them as float16, or as int8 codes with one float32 scale per
+    vector (`vector ~= scale * codes`, with the largest component mapped
+    to 127), which takes 4x or 8x less memory. Users are scored a block
+    at a time, so the factors are never converted back to float64 as a
+    whole. Biases stay in full precision.
+
+    Set `SVD_QUANTIZATION=float16` or `int8` to serve a quantized copy of
+    the model (written next to it, e.g. `resources/models/svd_factors_int8`).
+    Compare the memory saved with the agreement of the rankings with the
+    full-precision model with (from the root of the repo):
+
+        python -m recommenders.quantization --dtypes float16 int8
+
+"""
+# Dependencies
+import os
+import json
+import argparse
+import numpy as np
+from recommenders.factor_model import FactorModel, read_meta
+
+QUANTIZATIONS = ('float16', 'int8')
+# Users scored at a time by `QuantizedFactorModel.score_users`
+BLOCK_SIZE = 16384
+
+def quantize(matrix, dtype):
+    """Quantize the rows of a factor matrix.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        One vector per row.
+    dtype : str
+        One of `QUANTIZATIONS`.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray or None)
+        The codes, and for 'int8' the float32 scale of every row.
+
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == 'float16':
+        return matrix.astype(np.float16), None
+    if dtype == 'int8':
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization {dtype!r}; expected one of {QUANTIZATIONS}")
+
+def dequantize(codes, scales, rows=slice(None)):
+    """float32 vectors of the given rows (or slice) of quantized factors."""
+    vectors = np.asarray(codes[rows], dtype=np.float32)
+    return vectors if scales is None else vectors * scales[rows][:, None]
+
+class QuantizedFactorModel(FactorModel):
+    """`FactorModel` whose factors are held as float16 or scaled int8.
+
+    Parameters
+    ----------
+    user_factors, item_factors : numpy.ndarray
+        Quantized factors (float16, or int8 codes).
+    user_scales, item_scales : numpy.ndarray or None
+        Per-vector scales of int8 codes; None for float16.
+
+    The other parameters are those of `FactorModel`.
+
+    """
+
+    def __init__(self, user_factors, user_bias, item_factors, item_bias, global_mean, user_ids,
+                 item_ids, rating_scale=(0.5, 5.0), lookups=None, user_scales=None, item_scales=None):
+        super().__init__(user_factors, user_bias, item_factors, item_bias, global_mean,
+                         user_ids, item_ids, rating_scale, lookups)
+        self.user_scales = user_scales
+        self.item_scales = item_scales
+
+    @property
+    def quantization(self):
+        return 'int8' if self.user_factors.dtype == np.int8 else 'float16'
+
+    def __getstate__(self):
+        return dict(super().__getstate__(), user_scales=self.user_scales, item_scales=self.item_scales)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.user_scales = state['user_scales']
+        self.item_scales = state['item_scales']
+
+    @classmethod
+    def from_model(cls, model, dtype):
+        """Quantize the factors of a full-precision `FactorModel`."""
+        user_factors, user_scales = quantize(model.user_factors, dtype)
+        item_factors, item_scales = quantize(model.item_factors, dtype)
+        return cls(user_factors, np.asarray(model.user_bias), item_factors, np.asarray(model.item_bias),
+                   model.global_mean, model.user_ids, model.item_ids, model.rating_scale,
+                   (model._user_lookup, model._item_lookup), user_scales, item_scales)
+
+    def user_vectors(self, rows):
+        return dequantize(self.user_factors, self.user_scales, rows)
+
+    def item_vectors(self, rows):
+        return dequantize(self.item_factors, self.item_scales, rows)
+
+    def score_users(self, item_ids, block_size=BLOCK_SIZE):
+        """Estimate every user's (unclipped) rating of the given items,
+        scoring the quantized user factors a block at a time."""
+        factors, bias = self._item_terms(self.item_rows(item_ids))
+        factors = factors.T.astype(np.float32)
+        scores = np.empty((len(self.user_ids), factors.shape[1]))
+        for start in range(0, len(self.user_ids), block_size):
+            stop = min(start + block_size, len(self.user_ids))
+            block = np.asarray(self.user_factors[start:stop], dtype=np.float32).dot(factors)
+            if self.user_scales is not None:
+                block *= self.user_scales[start:stop, None]
+            scores[start:stop] = block
+        scores += self.user_bias[:, None]
+        scores += bias + self.global_mean
+        return scores
+
+    def _write(self, path, meta=None):
+        super()._write(path, dict(meta or {}, quantization=self.quantization))
+        for kind in ('user', 'item'):
+            scales = getattr(self, f'{kind}_scales')
+            if scales is not None:
+                np.save(os.path.join(path, f'{kind}_scales.npy'), scales)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        model = super().load(path, mmap_mode)
+        for kind in ('user', 'item'):
+            scales = os.path.join(path, f'{kind}_scales.npy')
+            setattr(model, f'{kind}_scales',
+                    np.load(scales, mmap_mode=mmap_mode) if os.path.exists(scales) else None)
+        return model
+
+def factor_bytes(model):
+    """Bytes taken by the factors (and scales) of a model."""
+    arrays = [model.user_factors, model.item_factors,
+              getattr(model, 'user_scales', None), getattr(model, 'item_scales', None)]
+    return int(sum(array.nbytes for array in arrays if array is not None))
+
+def load_quantized(path, dtype):
+    """Quantized copy of the model at `path`, (re)written to `path_<dtype>`
+    when missing or older than the full-precision model.
+
+    The copy is replaced in one rename (see `FactorModel.save`), so other
+    processes serving the previous copy are unaffected.
+
+    """
+    target = f'{path.rstrip(os.sep)}_{dtype}'
+    source_mtime = os.stat(os.path.join(path, 'meta.json')).st_mtime_ns
+    if not os.path.exists(os.path.join(target, 'meta.json')) or \
+            read_meta(target).get('source_mtime_ns') != source_mtime:
+        QuantizedFactorModel.from_model(FactorModel.load(path), dtype).save(
+            target, {'source': path, 'source_mtime_ns': source_mtime})
+    return QuantizedFactorModel.load(target)
+
+def _top_k_rows(scores, k):
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.sort(top, axis=1)
+
+def compare(full, quantized, ratings=None, n_users=500, n_items=100, k=10, seed=0):
+    """Ranking agreement and rating error of a quantized model.
+
+    Parameters
+    ----------
+    full, quantized : FactorModel
+        The full-precision model and its quantized copy.
+    ratings : tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray), optional
+        User ids, item ids and ratings on which to measure the RMSE of
+        both models.
+    n_users, n_items : int
+        Number of sampled users and items whose top-k are compared.
+    k : int
+        Length of the compared rankings.
+
+    Returns
+    -------
+    dict
+        Factor memory of both models, the mean top-k overlap of the
+        sampled users' item rankings and of the sampled items' user
+        rankings (what `collab_model` uses), the largest prediction
+        difference and, given ratings, both RMSEs and their difference.
+
+    """
+    rng = np.random.default_rng(seed)
+    users = rng.choice(len(full.user_ids), min(n_users, len(full.user_ids)), replace=False)
+    items = rng.choice(len(full.item_ids), min(n_items, len(full.item_ids)), replace=False)
+    item_scores = [model.user_vectors(users).dot(model.item_vectors(slice(None)).T.astype(np.float32))
+                   + np.asarray(model.item_bias) for model in (full, quantized)]
+    user_scores = [model.score_users(full.item_ids[items]).T for model in (full, quantized)]
+    report = {
+        'quantization': quantized.quantization,
+        'factor_bytes_full': factor_bytes(full),
+        'factor_bytes_quantized': factor_bytes(quantized),
+        'memory_saved': round(1 - factor_bytes(quantized) / factor_bytes(full), 4),
+        f'top{k}_item_overlap': float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(
+            _top_k_rows(item_scores[0], k), _top_k_rows(item_scores[1], k))])),
+        f'top{k}_user_overlap': float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(
+            _top_k_rows(user_scores[0], k), _top_k_rows(user_scores[1], k))])),
+        'max_prediction_diff': float(np.abs(user_scores[0] - user_scores[1]).max()),
+    }
+    if ratings is not None:
+        rating_users, rating_items, values = ratings
+        errors = [np.sqrt(np.mean((model.predict(rating_users, rating_items) - values) ** 2))
+                  for model in (full, quantized)]
+        report.update(rmse_full=float(errors[0]), rmse_quantized=float(errors[1]),
+                      rmse_drift=float(errors[1] - errors[0]))
+    return report
+
+def main(argv=None):
+    from recommenders.training import read_ratings
+    from utils.data_loader import RATINGS_PATH
+    parser = argparse.ArgumentParser(description='Compare quantized SVD factors with the full model.')
+    parser.add_argument('--model', default='resources/models/svd_factors')
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--dtypes', nargs='+', default=list(QUANTIZATIONS), choices=QUANTIZATIONS)
+    parser.add_argument('--sample', type=int, default=100000,
+                        help='ratings on which the RMSE is measured')
+    parser.add_argument('--save', action='store_true',
+                        help='also write each quantized model next to the full one')
+    args = parser.parse_args(argv)
+    full = FactorModel.load(args.model)
+    users, items, ratings = read_ratings(args.ratings)
+    sample = np.random.default_rng(0).choice(len(ratings), min(args.sample, len(ratings)), replace=False)
+    reports = []
+    for dtype in args.dtypes:
+        quantized = load_quantized(args.model, dtype) if args.save else \
+            QuantizedFactorModel.from_model(full, dtype)
+        reports.append(compare(full, quantized, (users[sample], items[sample], ratings[sample])))
+    print(json.dumps(reports, indent=2))
+
+if __name__ == '__main__':
+    main()
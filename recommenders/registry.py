@@ -0,0 +1,452 @@
+"""
+
+    Registry of recommender backends.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every backend is a scoring function that rates each
+    catalogue movie against the app user's favourites (see
+    `content_based.content_scores`). The registry imports a backend's
+    module and loads its models and indexes only the first time that
+    backend is used, so a process only pays for the algorithms it serves.
+    All backends share the catalogue from `utils.catalog`, which lets the
+    hybrid backend blend their scores movie by movie.
+
+    When a backend knows none of the favourites, or scores fewer movies
+    than requested, the list is completed from the popularity rankings of
+    `recommenders.popularity`.
+
+    Results of `recommend` are cached (see `utils.result_cache`) until one
+    of the data files or model artifacts of the backends involved changes.
+    Such a change also reloads the tables, models and indexes loaded so
+    far (see `reload`), before anything is computed from them again.
+    `RECOMMENDATION_CACHE_SIZE` sets the number of results kept in memory
+    and `RECOMMENDATION_CACHE_PATH` enables a SQLite tier shared by every
+    process.
+
+    Usage:
+
+        from recommenders import registry
+        registry.recommend(['Toy Story (1995)', 'Heat (1995)'], 'hybrid', top_n=10)
+        registry.recommend(['Toy Story (1995)'], 'content', top_n=10,
+                           filters={'exclude': ['Horror'], 'years': (1990, 1999)})
+
+"""
+# Dependencies
+import os
+import importlib
+import threading
+import numpy as np
+from recommenders.ingestion import RATINGS_STREAM_PATH
+from recommenders.popularity import POPULARITY_PATH, favourite_rows, fill
+from utils.catalog import load_catalog
+from utils.genre_index import load_genre_index
+from utils.data_loader import MOVIES_PATH, RATINGS_PATH, clear_tables
+from utils.instrumentation import count, span
+from utils.resources import clear as clear_resources, timings, warm_up
+from utils.result_cache import ResultCache, fingerprint, request_key
+from utils.scoring import IndexNotReadyError, UnknownFavouritesError
+
+# Default weight of each backend in the hybrid blend
+HYBRID_BLEND = {'content': 0.5, 'collaborative': 0.5}
+
+class Backend:
+    """A lazily loaded scoring function.
+
+    Parameters
+    ----------
+    name : str
+        Registry name of the backend.
+    module : str
+        Module defining the scoring function.
+    function : str
+        Name of the scoring function. It is called as
+        `function(favourites, method)` and returns the score of every
+        catalogue row and the catalogue rows of the favourites.
+    resources : list (str)
+        Names of the `utils.resources` entries the backend needs, loaded
+        together with the module.
+    artifacts : list (str)
+        Data files and model artifacts the scores are computed from.
+        Cached results are invalidated when any of them changes.
+    batch_function : str, optional
+        Name of a function scoring several requests in one pass, called
+        as `batch_function(favourite_lists, method)` and returning a
+        `(n_requests, n_movies)` score matrix and each request's
+        favourite rows.
+
+    """
+
+    def __init__(self, name, module, function, resources=(), artifacts=(), batch_function=None):
+        self.name = name
+        self.module = module
+        self.function = function
+        self.resources = list(resources)
+        self.artifacts = tuple(artifacts)
+        self.batch_function = batch_function
+        self._score = None
+        self._score_many = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._score is not None
+
+    def load(self):
+        """Import the backend and load its resources, once."""
+        if self._score is None:
+            with self._lock:
+                if self._score is None:
+                    with span(f'load.{self.name}'):
+                        module = importlib.import_module(self.module)
+                        if self.batch_function:
+                            self._score_many = getattr(module, self.batch_function)
+                        warm_up(self.resources)
+                    _record_versions(self.artifacts)
+                    self._score = getattr(module, self.function)
+        return self._score
+
+    def scores(self, favourites, method='sum'):
+        """Score every catalogue movie against the favourites."""
+        return self.load()(favourites, method)
+
+    def scores_many(self, favourite_lists, method='sum'):
+        """Score several requests, in one pass if the backend supports it."""
+        try:
+            score = self.load()
+            if self._score_many is not None:
+                return self._score_many(favourite_lists, method)
+        except IndexNotReadyError:
+            # Every request falls back to popularity until the index is built
+            return (np.full((len(favourite_lists), len(load_catalog())), -np.inf),
+                    [favourite_rows(favourites) for favourites in favourite_lists])
+        results = [_scores_or_nothing(score, favourites, method) for favourites in favourite_lists]
+        return (np.vstack([r[0] for r in results]) if results else np.zeros((0, 0)),
+                [r[1] for r in results])
+
+def _scores_or_nothing(score, favourites, method):
+    """`score(favourites, method)`, or `-inf` everywhere when the backend
+    knows none of the favourites."""
+    try:
+        return score(favourites, method)
+    except UnknownFavouritesError:
+        return np.full(len(load_catalog()), -np.inf), favourite_rows(favourites)
+
+# Registry name -> Backend
+_backends = {}
+
+def register(name, module, function, resources=(), artifacts=(), batch_function=None):
+    """Add a backend to the registry (replacing any of the same name)."""
+    _backends[name] = Backend(name, module, function, resources, artifacts, batch_function)
+    return _backends[name]
+
+def backend(name):
+    """Registered backend called `name`. Raises `KeyError` if unknown."""
+    try:
+        return _backends[name]
+    except KeyError:
+        raise KeyError(f"Unknown recommender {name!r}; expected one of {names()}") from None
+
+def names():
+    """Names of the registered backends, including 'hybrid'."""
+    return list(_backends) + ['hybrid']
+
+def loaded():
+    """Names of the backends loaded so far."""
+    return [name for name, entry in _backends.items() if entry.loaded]
+
+SVD_ARTIFACTS = ['resources/models/svd_factors', 'resources/models/SVD.pkl']
+register('content', 'recommenders.content_based', 'content_scores', ['content_index'],
+         ['resources/models/content_index', MOVIES_PATH], batch_function='content_scores_many')
+register('collaborative', 'recommenders.collaborative_based', 'collab_scores',
+         ['svd_model', 'user_ratings_index', 'ratings_store'],
+         SVD_ARTIFACTS + [MOVIES_PATH, RATINGS_PATH, RATINGS_STREAM_PATH])
+register('cooccurrence', 'recommenders.collaborative_based', 'cooccurrence_scores',
+         ['cooccurrence_index'], ['resources/models/cooccurrence_index', MOVIES_PATH, RATINGS_PATH])
+register('svd_factor', 'recommenders.collaborative_based', 'item_factor_scores',
+         ['svd_model', 'svd_item_index'], SVD_ARTIFACTS + [MOVIES_PATH])
+register('popularity', 'recommenders.popularity', 'popularity_scores',
+         ['popularity_index', 'genre_index'], [POPULARITY_PATH, MOVIES_PATH, RATINGS_PATH, RATINGS_STREAM_PATH])
+
+# Every backend's results may be completed from the popularity rankings,
+# which follow the ratings stream
+FALLBACK_ARTIFACTS = (POPULARITY_PATH, MOVIES_PATH, RATINGS_PATH, RATINGS_STREAM_PATH)
+# Artifacts the loaded resources follow by themselves (see
+# `RatingsStore.refresh`); their changes only invalidate cached results.
+LIVE_ARTIFACTS = (RATINGS_STREAM_PATH,)
+
+# Fingerprint of each artifact when the loaded resources last read it
+_versions = {}
+_reload_lock = threading.RLock()
+
+def _record_versions(paths):
+    """Remember the current version of `paths` as the loaded one."""
+    with _reload_lock:
+        for path in paths:
+            if path not in LIVE_ARTIFACTS:
+                _versions[path] = fingerprint([path])
+
+def reload():
+    """Drop the loaded tables, models and indexes, and load the same
+    resources again from the current files."""
+    with _reload_lock, span('reload'):
+        names = [name for name, entry in timings().items() if entry['loaded']]
+        clear_tables()
+        clear_resources()
+        for name in names:
+            try:
+                warm_up([name])
+            except IndexNotReadyError:
+                # Loaded once built (see `content_based.load_content_index`)
+                pass
+        # Record the versions only now: loading may rebuild stale indexes.
+        _versions.clear()
+        paths = list(FALLBACK_ARTIFACTS)
+        for name in loaded():
+            paths.extend(_backends[name].artifacts)
+        _record_versions(paths)
+        count('registry.reloads')
+
+def reload_if_changed(paths):
+    """Call `reload` if one of `paths` changed since it was loaded.
+
+    Paths seen for the first time are taken to be the loaded version.
+
+    Returns
+    -------
+    bool
+        Whether the resources were reloaded.
+
+    """
+    with _reload_lock:
+        stale = False
+        for path in paths:
+            if path not in LIVE_ARTIFACTS:
+                current = fingerprint([path])
+                stale |= _versions.setdefault(path, current) != current
+        if stale:
+            reload()
+        return stale
+
+# Process-wide cache of `recommend` results. Results are only computed
+# after `reload_if_changed` saw the versions they are stored under.
+cache = ResultCache(max_entries=int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 1024)),
+                    path=os.environ.get('RECOMMENDATION_CACHE_PATH'),
+                    before_check=reload_if_changed)
+
+def normalize_scores(scores):
+    """Min-max scale finite scores to [0, 1]; other scores become 0.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        Scores of one backend.
+
+    Returns
+    -------
+    numpy.ndarray
+        Scaled copy. Constant scores all become 0.
+
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    finite = np.isfinite(scores)
+    if not finite.any():
+        return np.zeros(len(scores))
+    low, high = scores[finite].min(), scores[finite].max()
+    scaled = np.zeros(len(scores))
+    if high > low:
+        scaled[finite] = (scores[finite] - low) / (high - low)
+    return scaled
+
+def hybrid_scores(favourites, method='sum', blend=None):
+    """Blend the normalised scores of several backends.
+
+    Parameters
+    ----------
+    favourites : list (str) or dict
+        Favourite titles, or a mapping of title to weight.
+    method : str
+        How each backend combines the favourites' similarities.
+    blend : dict, optional
+        Backend name to weight. Defaults to `HYBRID_BLEND`.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        Blended score of every catalogue row and the catalogue rows of
+        the favourites.
+
+    """
+    blend = blend or HYBRID_BLEND
+    weights = np.array(list(blend.values()), dtype=np.float64)
+    stacked, idx = [], None
+    for name in blend:
+        # A backend knowing none of the favourites adds nothing
+        scores, idx = _scores_or_nothing(backend(name).scores, favourites, method)
+        stacked.append(normalize_scores(scores))
+    # One weighted sum over the (backends x movies) score matrix
+    return weights.dot(np.vstack(stacked)), idx
+
+def scores(favourites, algorithm='content', method='sum', blend=None):
+    """Score every catalogue movie with one backend or the hybrid blend."""
+    if algorithm == 'hybrid':
+        return hybrid_scores(favourites, method, blend)
+    return backend(algorithm).scores(favourites, method)
+
+def apply_filters(scores, filters=None):
+    """Exclude the movies failing `filters` from a score vector.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        Score of every catalogue movie.
+    filters : dict, optional
+        Any of `include` and `exclude` (lists of genres) and `years`
+        (inclusive `(first, last)` release years, either may be None);
+        see `utils.genre_index.GenreIndex.mask`.
+
+    Returns
+    -------
+    numpy.ndarray
+        `scores`, with the excluded movies set to -inf.
+
+    """
+    if not filters:
+        return scores
+    with span('filter'):
+        return load_genre_index().apply(scores, **filters)
+
+def _filter_mask(filters):
+    """Rows passing `filters`, or None when there are no filters."""
+    return load_genre_index().mask(**filters) if filters else None
+
+def _filter_key(filters):
+    """Canonical, JSON-serialisable form of `filters` for cache keys."""
+    return sorted((name, sorted(value) if name != 'years' else list(value))
+                  for name, value in (filters or {}).items() if value)
+
+def artifacts(algorithm='content', blend=None):
+    """Files the results of `algorithm` depend on."""
+    names = list(blend or HYBRID_BLEND) if algorithm == 'hybrid' else [algorithm]
+    paths = []
+    for name in names:
+        paths.extend(path for path in backend(name).artifacts if path not in paths)
+    paths.extend(path for path in FALLBACK_ARTIFACTS if path not in paths)
+    return tuple(paths)
+
+def recommend(favourites, algorithm='content', top_n=10, method='sum', blend=None,
+              use_cache=True, filters=None):
+    """Recommend movies with a registered backend or the hybrid blend.
+
+    Parameters
+    ----------
+    favourites : list (str) or dict
+        Favourite titles, any number of them, or a mapping of title to
+        weight.
+    algorithm : str
+        One of `names()`.
+    top_n : int
+        Number of recommendations.
+    method : str
+        How the favourites' similarities are combined; see
+        `utils.scoring.AGGREGATIONS`.
+    blend : dict, optional
+        Backend weights for the 'hybrid' algorithm.
+    use_cache : bool
+        Serve repeated requests from, and store results in, `cache`.
+    filters : dict, optional
+        Genre and release-year filters; see `apply_filters`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n recommendations, excluding the favourites.
+        Unknown favourites are ignored, and popular movies of the
+        favourites' genres complete lists the backend cannot fill.
+
+    """
+    with span(f'recommend.{algorithm}'):
+        dependencies = artifacts(algorithm, blend)
+        if use_cache:
+            key = request_key(favourites, algorithm, top_n, method=method,
+                              blend=sorted((blend or {}).items()), filters=_filter_key(filters))
+            cached = cache.get(key, dependencies)
+            count('result_cache.hits' if cached is not None else 'result_cache.misses')
+            if cached is not None:
+                return cached
+        else:
+            reload_if_changed(dependencies)
+        try:
+            movie_scores, idx = scores(favourites, algorithm, method, blend)
+        except UnknownFavouritesError:
+            movie_scores, idx = np.full(len(load_catalog()), -np.inf), favourite_rows(favourites)
+        movie_scores = apply_filters(movie_scores, filters)
+        with span('ranking'):
+            titles = load_catalog().titles_at(fill(movie_scores, idx, top_n, _filter_mask(filters)))
+        if use_cache:
+            cache.put(key, titles, dependencies)
+        return titles
+
+def recommend_many(favourite_lists, algorithm='content', top_n=10, method='sum', blend=None,
+                   use_cache=True, filters=None):
+    """Recommend movies for several requests with the same algorithm.
+
+    Cached requests are answered from `cache`; the others are scored
+    together, in a single vectorised pass for backends that support it.
+
+    Parameters
+    ----------
+    favourite_lists : list
+        One set of favourites (titles or title -> weight mapping) per
+        request.
+    algorithm, top_n, method, blend, use_cache, filters
+        As for `recommend`; `top_n` and `filters` may also be lists with
+        one value per request.
+
+    Returns
+    -------
+    list (list (str))
+        Recommendations of each request, in order.
+
+    """
+    top_ns = list(top_n) if isinstance(top_n, (list, tuple)) else [top_n] * len(favourite_lists)
+    filter_list = list(filters) if isinstance(filters, (list, tuple)) else [filters] * len(favourite_lists)
+    results = [None] * len(favourite_lists)
+    keys = [None] * len(favourite_lists)
+    dependencies = artifacts(algorithm, blend)
+    if use_cache:
+        for i, (favourites, n) in enumerate(zip(favourite_lists, top_ns)):
+            keys[i] = request_key(favourites, algorithm, n, method=method,
+                                  blend=sorted((blend or {}).items()),
+                                  filters=_filter_key(filter_list[i]))
+            results[i] = cache.get(keys[i], dependencies)
+    pending = [i for i, result in enumerate(results) if result is None]
+    if use_cache:
+        count('result_cache.hits', len(results) - len(pending))
+        count('result_cache.misses', len(pending))
+    else:
+        reload_if_changed(dependencies)
+    if not pending:
+        return results
+    lists = [favourite_lists[i] for i in pending]
+    with span(f'recommend_many.{algorithm}'):
+        if algorithm == 'hybrid':
+            blend = blend or HYBRID_BLEND
+            weights = np.array(list(blend.values()), dtype=np.float64)
+            blended = None
+            for weight, name in zip(weights, blend):
+                matrix, idx = backend(name).scores_many(lists, method)
+                normalised = weight * np.vstack([normalize_scores(row) for row in matrix])
+                blended = normalised if blended is None else blended + normalised
+            matrix = blended
+        else:
+            matrix, idx = backend(algorithm).scores_many(lists, method)
+        catalog = load_catalog()
+        with span('ranking'):
+            for row, i in enumerate(pending):
+                row_scores = apply_filters(matrix[row], filter_list[i])
+                results[i] = catalog.titles_at(fill(row_scores, idx[row], top_ns[i],
+                                                    _filter_mask(filter_list[i])))
+                if use_cache:
+                    cache.put(keys[i], results[i], dependencies)
+    return results
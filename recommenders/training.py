@@ -0,0 +1,241 @@
+"""
+
+    Parallel, mini-batch training of the SVD (biased matrix factorisation)
+    model.
+
+    Author: Explore Data Science Academy.
+
+    Description: A vectorised replacement for fitting `surprise.SVD` in
+    `resources/models/train_colbased.py`. Ratings are streamed from CSV in
+    chunks into compact int32/float32 arrays and the model is fitted with
+    mini-batch SGD on the same objective as `surprise.SVD`.
+
+    Work is spread over threads with stratified SGD: users and items are
+    split into as many blocks as there are threads, and in each sub-epoch
+    every thread trains a different (user block, item block) pair, so no
+    two threads ever update the same factors. Within a block, updates are
+    applied a mini-batch at a time, with the gradients of repeated users
+    and items summed through a sparse product.
+
+    Training can warm-start from an existing model, in which case a few
+    epochs over the refreshed ratings are usually enough. The fitted model
+    is written in the array format of `FactorModel.save`, which is what
+    `collaborative_based` serves.
+
+    Usage (from the root of the repo):
+
+        python -m recommenders.training --epochs 40
+        python -m recommenders.training --init resources/models/svd_factors --epochs 5
+
+"""
+# Dependencies
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from recommenders.factor_model import FactorModel, load_factor_pickle
+from utils.data_loader import RATINGS_PATH
+
+MODEL_PATH = 'resources/models/svd_factors'
+
+def read_ratings(path=RATINGS_PATH, chunksize=1_000_000, min_rating=None):
+    """Stream a ratings CSV into compact arrays.
+
+    Parameters
+    ----------
+    path : str
+        CSV with `userId`, `movieId` and `rating` columns.
+    chunksize : int
+        Rows parsed at a time.
+    min_rating : float, optional
+        Only keep ratings of at least this value. Rows are dropped chunk
+        by chunk, so the others are never held in memory.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        int32 user ids, int32 movie ids and float32 ratings.
+
+    """
+    users, items, ratings = [], [], []
+    dtypes = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32}
+    for chunk in pd.read_csv(path, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize):
+        if min_rating is not None:
+            chunk = chunk[chunk['rating'] >= min_rating]
+        users.append(chunk['userId'].to_numpy())
+        items.append(chunk['movieId'].to_numpy())
+        ratings.append(chunk['rating'].to_numpy())
+    return np.concatenate(users), np.concatenate(items), np.concatenate(ratings)
+
+def _sum_rows(target, rows, updates):
+    """Add `updates` to `target[rows]`, summing repeated rows."""
+    unique, inverse = np.unique(rows, return_inverse=True)
+    summer = sparse.csr_matrix((np.ones(len(rows), dtype=updates.dtype), (inverse, np.arange(len(rows)))),
+                               shape=(len(unique), len(rows)))
+    target[unique] += summer.dot(updates)
+
+class _Trainer:
+    """SGD state shared by the training threads."""
+
+    def __init__(self, users, items, ratings, model, lr, reg, batch_size):
+        self.users, self.items, self.ratings = users, items, ratings
+        self.model, self.lr, self.reg, self.batch_size = model, lr, reg, batch_size
+
+    def train_block(self, positions, seed):
+        """Run SGD over the ratings at `positions`; return their squared error."""
+        m, lr, reg = self.model, self.lr, self.reg
+        positions = positions[np.random.default_rng(seed).permutation(len(positions))]
+        squared_error = 0.0
+        for start in range(0, len(positions), self.batch_size):
+            batch = positions[start:start + self.batch_size]
+            u, i = self.users[batch], self.items[batch]
+            pu, qi = m.user_factors[u], m.item_factors[i]
+            err = self.ratings[batch] - (m.global_mean + m.user_bias[u] + m.item_bias[i]
+                                         + np.einsum('ij,ij->i', pu, qi))
+            squared_error += float(err.dot(err))
+            np.add.at(m.user_bias, u, lr * (err - reg * m.user_bias[u]))
+            np.add.at(m.item_bias, i, lr * (err - reg * m.item_bias[i]))
+            _sum_rows(m.user_factors, u, lr * (err[:, None] * qi - reg * pu))
+            _sum_rows(m.item_factors, i, lr * (err[:, None] * pu - reg * qi))
+        return squared_error
+
+def _initial_model(user_ids, item_ids, global_mean, rating_scale, n_factors, init_std,
+                   init=None, seed=0):
+    """Random factors, copying users and items known to `init` if given."""
+    rng = np.random.default_rng(seed)
+    if init is not None:
+        n_factors = init.user_factors.shape[1]
+    model = FactorModel(rng.normal(0, init_std, (len(user_ids), n_factors)).astype(np.float32),
+                        np.zeros(len(user_ids), dtype=np.float32),
+                        rng.normal(0, init_std, (len(item_ids), n_factors)).astype(np.float32),
+                        np.zeros(len(item_ids), dtype=np.float32),
+                        global_mean, user_ids, item_ids, rating_scale)
+    if init is not None:
+        for new_ids, old_rows, factors, bias, old_factors, old_bias in (
+                (user_ids, init.user_rows(user_ids.tolist()), model.user_factors, model.user_bias,
+                 init.user_factors, init.user_bias),
+                (item_ids, init.item_rows(item_ids.tolist()), model.item_factors, model.item_bias,
+                 init.item_factors, init.item_bias)):
+            known = old_rows >= 0
+            factors[known] = old_factors[old_rows[known]]
+            bias[known] = old_bias[old_rows[known]]
+    return model
+
+def rmse(model, users, items, ratings):
+    """Root-mean-square error of the clipped predictions (inner rows)."""
+    estimates = (model.global_mean + model.user_bias[users] + model.item_bias[items]
+                 + np.einsum('ij,ij->i', model.user_factors[users], model.item_factors[items]))
+    return float(np.sqrt(np.mean((ratings - np.clip(estimates, *model.rating_scale)) ** 2)))
+
+def train(users, items, ratings, n_factors=200, n_epochs=40, lr=0.005, reg=0.02,
+          init_std=0.05, batch_size=4096, threads=None, init=None, holdout=0.0,
+          seed=0, verbose=True):
+    """Fit a biased matrix-factorisation model with parallel mini-batch SGD.
+
+    Parameters
+    ----------
+    users, items, ratings : numpy.ndarray
+        Raw user ids, raw movie ids and ratings, e.g. from `read_ratings`.
+    n_factors : int
+        Number of latent factors (ignored when warm-starting).
+    n_epochs : int
+        Passes over the training ratings.
+    lr, reg : float
+        Learning rate and L2 regularisation, as in `surprise.SVD`.
+    init_std : float
+        Standard deviation of the random initial factors.
+    batch_size : int
+        Ratings per mini-batch.
+    threads : int, optional
+        Training threads. Defaults to the number of CPUs.
+    init : FactorModel, optional
+        Model to warm-start from. Its factors and biases are reused for
+        the users and movies it knows.
+    holdout : float
+        Fraction of ratings held out to report a test RMSE per epoch.
+    seed : int
+        Random seed.
+    verbose : bool
+        Print the per-epoch report.
+
+    Returns
+    -------
+    tuple(FactorModel, list[dict])
+        The fitted model and, per epoch, its `seconds`, `train_rmse` and
+        (with a holdout) `test_rmse`.
+
+    """
+    threads = threads or os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+    test = np.zeros(len(ratings), dtype=bool)
+    if holdout:
+        test[rng.permutation(len(ratings))[:int(holdout * len(ratings))]] = True
+    user_ids, user_rows = np.unique(users, return_inverse=True)
+    item_ids, item_rows = np.unique(items, return_inverse=True)
+    user_rows, item_rows = user_rows.astype(np.int32), item_rows.astype(np.int32)
+    model = _initial_model(user_ids, item_ids, float(ratings[~test].mean()),
+                           (float(ratings.min()), float(ratings.max())),
+                           n_factors, init_std, init, seed)
+    trainer = _Trainer(user_rows, item_rows, ratings, model, lr, reg, batch_size)
+    # Stratify the training ratings into threads x threads blocks.
+    user_block = rng.permutation(len(user_ids))[user_rows] % threads
+    item_block = rng.permutation(len(item_ids))[item_rows] % threads
+    train_positions = np.flatnonzero(~test)
+    block_of = (user_block * threads + item_block)[train_positions]
+    order = np.argsort(block_of, kind='stable')
+    bounds = np.searchsorted(block_of[order], np.arange(threads * threads + 1))
+    blocks = [train_positions[order[bounds[b]:bounds[b + 1]]] for b in range(threads * threads)]
+    history = []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for epoch in range(n_epochs):
+            start = time.perf_counter()
+            squared_error = 0.0
+            for shift in range(threads):
+                # Thread t trains user block t against item block t + shift.
+                jobs = [(blocks[t * threads + (t + shift) % threads], seed + epoch * threads + t)
+                        for t in range(threads)]
+                squared_error += sum(pool.map(lambda job: trainer.train_block(*job), jobs))
+            report = {'epoch': epoch + 1,
+                      'seconds': round(time.perf_counter() - start, 4),
+                      'train_rmse': round(float(np.sqrt(squared_error / max(len(train_positions), 1))), 5)}
+            if holdout:
+                report['test_rmse'] = round(rmse(model, user_rows[test], item_rows[test], ratings[test]), 5)
+            history.append(report)
+            if verbose:
+                print(report)
+    return model, history
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the SVD model with parallel mini-batch SGD.')
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--output', default=MODEL_PATH)
+    parser.add_argument('--init', default=None,
+                        help='model directory or pickled model to warm-start from')
+    parser.add_argument('--factors', type=int, default=200)
+    parser.add_argument('--epochs', type=int, default=40)
+    parser.add_argument('--lr', type=float, default=0.005)
+    parser.add_argument('--reg', type=float, default=0.02)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--holdout', type=float, default=0.0)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    users, items, ratings = read_ratings(args.ratings)
+    init = None
+    if args.init:
+        # Copy the arrays: the output may overwrite the files they map.
+        init = FactorModel.load(args.init, mmap_mode=None) if os.path.isdir(args.init) \
+            else load_factor_pickle(args.init)
+    print(f"Loaded {len(ratings)} ratings in {time.perf_counter() - start:.2f}s")
+    model, _ = train(users, items, ratings, args.factors, args.epochs, args.lr, args.reg,
+                     batch_size=args.batch_size, threads=args.threads, init=init,
+                     holdout=args.holdout)
+    model.save(args.output, {'source': 'recommenders.training', 'epochs': args.epochs,
+                             'lr': args.lr, 'reg': args.reg, 'warm_start': args.init})
+    print(f"Training completed in {time.perf_counter() - start:.2f}s. Model saved to: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+"""Run the tests from the root of the repo, where the resource paths resolve."""
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Backends that need the SVD model (resources/models/SVD.pkl or its export)
+SVD_BACKENDS = ('collaborative', 'svd_factor')
+
+def has_svd_model():
+    return os.path.exists('resources/models/SVD.pkl') or \
+        os.path.exists('resources/models/svd_factors/meta.json')
+
+@pytest.fixture
+def needs_backend():
+    """Skip a test of a backend whose model is not available here."""
+    def check(algorithm):
+        if (algorithm in SVD_BACKENDS or algorithm == 'hybrid') and not has_svd_model():
+            pytest.skip('the SVD model is not available')
+    return check
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from edsa_api import MAX_TOP_N, MicroBatcher, RecommendationServer, RequestError, parse_request
+
+def request(**fields):
+    return dict({'movies': ['Toy Story (1995)']}, **fields)
+
+def test_defaults_are_filled_in():
+    parsed = parse_request(request())
+    assert parsed == {'movies': ['Toy Story (1995)'], 'algorithm': 'content', 'top_n': 10,
+                      'method': 'sum', 'filters': None}
+
+def test_valid_filters_are_accepted():
+    parsed = parse_request(request(filters={'include': ['Comedy'], 'exclude': [], 'years': [1990, None]}))
+    assert parsed['filters'] == {'include': ['Comedy'], 'exclude': [], 'years': (1990, None)}
+
+@pytest.mark.parametrize('payload', [
+    [],
+    {'movies': []},
+    {'movies': 'Toy Story (1995)'},
+    request(algorithm='nope'),
+    request(top_n=0),
+    request(top_n=True),
+    request(top_n=2.5),
+    request(top_n=MAX_TOP_N + 1),
+    request(method=['sum']),
+    request(method='median'),
+    request(filters=['Comedy']),
+    request(filters={'genres': ['Comedy']}),
+    request(filters={'include': 'Comedy'}),
+    request(filters={'exclude': ['Horror', 3]}),
+    request(filters={'years': [1990]}),
+    request(filters={'years': ['1990', 1999]}),
+    request(filters={'years': [1990, True]}),
+    request(filters={'years': 1990}),
+])
+def test_invalid_requests_are_rejected_with_400(payload):
+    with pytest.raises(RequestError) as error:
+        parse_request(payload)
+    assert error.value.status == 400
+
+def handle(method, path, processes=False):
+    server = RecommendationServer(MicroBatcher(executor=None), processes)
+    return asyncio.run(server.handle(method, path, b''))
+
+@pytest.mark.parametrize('path', ['/titles', '/health', '/metrics', '/metrics/prometheus'])
+def test_get_endpoints_reject_other_methods_with_405(path):
+    with pytest.raises(RequestError) as error:
+        handle('POST', path)
+    assert error.value.status == 405
+
+def test_worker_process_state_is_not_reported_by_the_server_process():
+    _, health = handle('GET', '/health', processes=True)
+    _, metrics = handle('GET', '/metrics', processes=True)
+    assert 'loaded' not in health
+    assert set(metrics) == {'batching'}
+    with pytest.raises(RequestError) as error:
+        handle('GET', '/metrics/prometheus', processes=True)
+    assert error.value.status == 404
+
+def test_thread_mode_reports_its_own_state():
+    _, health = handle('GET', '/health')
+    _, metrics = handle('GET', '/metrics')
+    assert 'loaded' in health
+    assert {'batching', 'cache', 'ratings_stream', 'stages'} <= set(metrics)
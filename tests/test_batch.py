@@ -0,0 +1,12 @@
+from recommenders import batch
+
+def test_workers_only_warm_the_selected_engines_resources():
+    names = batch.worker_resources(['content'])
+    assert {'content_index', 'popularity_index'} <= set(names)
+    assert not {'svd_model', 'ratings_store', 'cooccurrence_index'} & set(names)
+
+def test_collab_workers_warm_the_backend_of_the_collab_mode(monkeypatch):
+    monkeypatch.setitem(batch.BACKENDS, 'collab', 'svd_factor')
+    names = batch.worker_resources(['collab'])
+    assert {'svd_model', 'svd_item_index'} <= set(names)
+    assert 'content_index' not in names
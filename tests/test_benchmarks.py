@@ -0,0 +1,26 @@
+import json
+from benchmarks.run import compare
+
+def write(path, metrics, errors=None, collab_mode='cooccurrence'):
+    path.write_text(json.dumps({'meta': {'collab_mode': collab_mode}, 'metrics': metrics,
+                                'errors': errors or {}}))
+    return str(path)
+
+def test_missing_metrics_and_errors_are_regressions(tmp_path):
+    baseline = write(tmp_path / 'baseline.json', {'a': 1.0, 'b': 2.0})
+    current = write(tmp_path / 'current.json', {'a': 1.05}, {'collab_model': 'RuntimeError: boom'})
+    rows = {row['metric']: row for row in compare(baseline, current, threshold=0.1)}
+    assert not rows['a']['regressed']
+    assert rows['b']['regressed'] and rows['b']['current'] is None
+    assert rows['error.collab_model']['regressed']
+
+def test_identical_runs_do_not_regress(tmp_path):
+    baseline = write(tmp_path / 'baseline.json', {'a': 1.0, 'b': 2.0})
+    assert not any(row['regressed'] for row in compare(baseline, baseline))
+
+def test_runs_of_different_collab_modes_are_not_comparable(tmp_path):
+    baseline = write(tmp_path / 'baseline.json', {'a': 1.0})
+    current = write(tmp_path / 'current.json', {'a': 1.0}, collab_mode='item_factors')
+    rows = {row['metric']: row for row in compare(baseline, current)}
+    assert rows['meta.collab_mode']['regressed']
+    assert not rows['a']['regressed']
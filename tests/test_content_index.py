@@ -0,0 +1,41 @@
+import threading
+import numpy as np
+import pytest
+from recommenders import content_based, registry
+from recommenders.popularity import fill
+from utils import resources
+from utils.catalog import load_catalog
+from utils.scoring import IndexNotReadyError
+
+FAVOURITES = ['Fargo (1996)']
+
+@pytest.fixture
+def missing_index(monkeypatch):
+    """Pretend the content index is missing; its build waits for `release`."""
+    release, started = threading.Event(), threading.Event()
+    def build_content_index(path):
+        started.set()
+        release.wait(10)
+    monkeypatch.setattr(content_based, '_current_index', lambda path: None)
+    monkeypatch.setattr(content_based, 'build_content_index', build_content_index)
+    resources.clear('content_index')
+    yield started
+    release.set()
+    content_based._builder.join()
+    resources.clear('content_index')
+
+def test_a_missing_index_is_built_off_the_request_path(missing_index):
+    with pytest.raises(IndexNotReadyError):
+        content_based.load_content_index()
+    assert missing_index.wait(5)
+    builder = content_based._builder
+    with pytest.raises(IndexNotReadyError):
+        content_based.load_content_index()
+    assert content_based._builder is builder
+
+def test_popular_movies_are_served_while_the_index_is_built(missing_index):
+    catalog = load_catalog()
+    popular = catalog.titles_at(fill(np.full(len(catalog), -np.inf), catalog.title_rows(FAVOURITES), 5))
+    assert content_based.content_model(FAVOURITES, 5) == popular
+    assert registry.recommend(FAVOURITES, 'content', top_n=5, use_cache=False) == popular
+    assert registry.recommend_many([FAVOURITES], 'content', top_n=5, use_cache=False) == [popular]
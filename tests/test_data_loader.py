@@ -0,0 +1,32 @@
+import os
+import numpy as np
+import pandas as pd
+from utils.data_loader import load_frame, load_table
+
+def write_movies(path, rows):
+    pd.DataFrame(rows, columns=['movieId', 'title', 'genres']).to_csv(path, index=False)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def test_missing_values_survive_the_cache(tmp_path):
+    movies = str(tmp_path / 'movies.csv')
+    write_movies(movies, [(1, 'A (1990)', 'Drama'), (2, None, 'Comedy'), (3, 'C (1992)', None)])
+    frame = load_frame(movies)
+    assert frame['title'].isna().tolist() == [False, True, False]
+    assert frame['genres'].isna().tolist() == [False, False, True]
+    assert frame.dropna()['movieId'].tolist() == [1]
+
+def test_missing_ids_load_as_nan(tmp_path):
+    links = tmp_path / 'links.csv'
+    links.write_text('movieId,imdbId,tmdbId\n1,114709,862\n2,113497,\n')
+    table = load_table(str(links))
+    assert table['imdbId'].dtype == np.int32
+    assert np.isnan(table['tmdbId']).tolist() == [False, True]
+
+def test_running_processes_see_a_changed_csv(tmp_path):
+    movies = str(tmp_path / 'movies.csv')
+    write_movies(movies, [(1, 'A (1990)', 'Drama')])
+    assert list(load_table(movies)['title']) == ['A (1990)']
+    write_movies(movies, [(1, 'A (1990)', 'Drama'), (2, 'B (1991)', 'Comedy')])
+    assert list(load_table(movies)['title']) == ['A (1990)', 'B (1991)']
+    assert sorted(os.listdir(tmp_path / '.cache')) == ['movies']
@@ -0,0 +1,11 @@
+import numpy as np
+from recommenders.evaluation import load_ratings, time_split, write_split
+
+def test_split_files_can_be_evaluated_again(tmp_path):
+    ratings = load_ratings()
+    test, _ = time_split(ratings, 0.2)
+    write_split(ratings, test, str(tmp_path))
+    train = load_ratings(str(tmp_path / 'train.csv'))
+    assert len(train['userId']) == (~test).sum()
+    for column in ('userId', 'movieId', 'rating', 'timestamp'):
+        assert np.array_equal(train[column], np.asarray(ratings[column])[~test])
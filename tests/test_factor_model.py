@@ -0,0 +1,21 @@
+import os
+import numpy as np
+import pytest
+from recommenders.factor_model import FactorModel, convert, read_meta
+
+PICKLE_PATH = 'resources/models/SVD.pkl'
+pytestmark = pytest.mark.skipif(not os.path.exists(PICKLE_PATH), reason='the SVD model is not available')
+
+def test_convert_matches_the_pickled_model(tmp_path):
+    path = str(tmp_path / 'factors')
+    assert convert(PICKLE_PATH, path, sample=200) < 1e-6
+    assert read_meta(path)['source'] == PICKLE_PATH
+
+def test_convert_refuses_a_model_that_predicts_differently(tmp_path):
+    path = str(tmp_path / 'factors')
+    convert(PICKLE_PATH, path, sample=50)
+    before = np.array(FactorModel.load(path).item_factors)
+    with pytest.raises(ValueError):
+        convert(PICKLE_PATH, path, sample=50, tolerance=-1.0)
+    assert np.array_equal(FactorModel.load(path).item_factors, before)
+    assert os.listdir(tmp_path) == ['factors']
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from recommenders import popularity
+from recommenders.ingestion import RatingsStore, append_ratings, load_user_ratings
+from recommenders.popularity import load_popularity_index, popular_rows
+from utils.catalog import load_catalog
+
+NEW_USER = 10_000_000
+
+@pytest.fixture
+def store(tmp_path):
+    return RatingsStore(load_user_ratings(), load_catalog(), path=str(tmp_path / 'stream.csv'))
+
+def test_streamed_ratings_update_the_movie_aggregates(store):
+    catalog = load_catalog()
+    row = int(catalog.rows([31])[0])
+    counts, sums = store.item_stats()
+    append_ratings([(NEW_USER, 31, 4.0)], store.path)
+    store.refresh()
+    new_counts, new_sums = store.item_stats()
+    assert new_counts[row] == counts[row] + 1
+    assert new_sums[row] == pytest.approx(sums[row] + 4.0)
+    # A later rating of the same movie replaces the earlier one.
+    append_ratings([(NEW_USER, 31, 1.0)], store.path)
+    store.refresh()
+    new_counts, new_sums = store.item_stats()
+    assert new_counts[row] == counts[row] + 1
+    assert new_sums[row] == pytest.approx(sums[row] + 1.0)
+
+def test_snapshot_aggregates_match_the_popularity_index(store):
+    counts, _ = store.item_stats()
+    assert np.array_equal(counts, load_popularity_index()['counts'])
+
+def test_popularity_fallback_follows_the_stream(store, monkeypatch):
+    monkeypatch.setattr(popularity, 'RATINGS_STREAM_PATH', store.path)
+    def live_ratings():
+        store.refresh()
+        return store
+    monkeypatch.setattr(popularity, 'live_ratings', live_ratings)
+    counts = np.asarray(load_popularity_index()['counts'])
+    unrated = int(np.flatnonzero(counts == 0)[0])
+    assert unrated not in popular_rows(10)
+    movie = int(load_catalog().movie_ids[unrated])
+    append_ratings([(NEW_USER + user, movie, 5.0) for user in range(1000)], store.path)
+    assert popular_rows(1)[0] == unrated
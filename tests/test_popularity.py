@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from recommenders import registry
+from recommenders.popularity import favourite_genres, load_popularity_index, popular_rows
+from utils.catalog import load_catalog
+from utils.genre_index import load_genre_index
+
+UNKNOWN = ['No Such Movie (2099)']
+
+def test_popular_rows_follow_the_bayesian_average():
+    index = load_popularity_index()
+    rows = popular_rows(20)
+    scores = np.asarray(index['scores'])[rows]
+    assert np.all(np.asarray(index['counts'])[rows] > 0)
+    assert np.all(np.diff(scores) <= 0)
+
+def test_popular_rows_of_a_genre_skip_excluded_rows():
+    genres = load_genre_index()
+    first = popular_rows(5, ['Horror'])
+    rows = popular_rows(5, ['Horror'], exclude=first[:2])
+    assert not set(rows) & set(first[:2])
+    assert all('Horror' in genres.genres_of(row) for row in rows)
+
+@pytest.mark.parametrize('algorithm', registry.names())
+def test_unknown_favourites_fall_back_to_the_overall_ranking(algorithm, needs_backend):
+    needs_backend(algorithm)
+    recommended = registry.recommend(UNKNOWN, algorithm, top_n=10, use_cache=False)
+    assert recommended == load_catalog().titles_at(popular_rows(10))
+
+def test_fallback_keeps_to_the_favourites_genres_and_the_filters():
+    catalog, genres = load_catalog(), load_genre_index()
+    unrated = int(np.flatnonzero(np.asarray(load_popularity_index()['counts']) == 0)[0])
+    favourite = catalog.title(unrated)
+    wanted = favourite_genres([unrated])
+    recommended = registry.recommend([favourite], 'cooccurrence', top_n=10, use_cache=False,
+                                     filters={'years': (1990, 1999)})
+    assert len(recommended) == 10 and favourite not in recommended
+    for title in recommended:
+        row = catalog.title_row(title)
+        assert 1990 <= genres.years[row] <= 1999
+        if wanted:
+            assert set(genres.genres_of(row)) & set(wanted)
+
+def test_models_fall_back_instead_of_raising():
+    from recommenders.content_based import content_model
+    from recommenders.collaborative_based import collab_model
+    assert len(content_model(UNKNOWN, 10)) == 10
+    assert len(collab_model(UNKNOWN, 10)) == 10
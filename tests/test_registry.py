@@ -0,0 +1,42 @@
+import pytest
+from recommenders import collaborative_based, registry
+from recommenders.content_based import content_model
+from utils.catalog import load_catalog
+
+FAVOURITES = ['Matrix, The (1999)', 'Fargo (1996)', 'Shrek (2001)']
+
+@pytest.mark.parametrize('algorithm', registry.names())
+def test_favourites_are_never_recommended(algorithm, needs_backend):
+    needs_backend(algorithm)
+    recommended = registry.recommend(FAVOURITES, algorithm, top_n=20, use_cache=False)
+    assert len(recommended) == 20
+    assert not set(recommended) & set(FAVOURITES)
+
+@pytest.mark.parametrize('algorithm', registry.names())
+def test_batched_favourites_are_never_recommended(algorithm, needs_backend):
+    needs_backend(algorithm)
+    lists = [FAVOURITES, FAVOURITES[:1], FAVOURITES[1:]]
+    for favourites, recommended in zip(lists, registry.recommend_many(lists, algorithm, 10, use_cache=False)):
+        assert len(recommended) == 10
+        assert not set(recommended) & set(favourites)
+
+@pytest.mark.parametrize('algorithm', registry.names())
+def test_movies_sharing_a_favourites_title_are_never_recommended(algorithm, needs_backend):
+    needs_backend(algorithm)
+    assert len(load_catalog().movie_ids_for_title('Aladdin (1992)')) > 1
+    assert 'Aladdin (1992)' not in registry.recommend(['Aladdin (1992)'], algorithm, top_n=20, use_cache=False)
+
+def test_content_model_skips_duplicates_of_the_favourites():
+    assert 'Aladdin (1992)' not in content_model(['Aladdin (1992)'], 5)
+
+def test_every_collab_mode_maps_to_a_registered_backend():
+    for mode, backend in collaborative_based.COLLAB_MODES.items():
+        assert collaborative_based.collab_backend(mode) == backend
+        assert backend in registry.names()
+
+def test_unknown_collab_modes_are_rejected(monkeypatch):
+    with pytest.raises(ValueError):
+        collaborative_based.collab_backend('item-factors')
+    monkeypatch.setattr(collaborative_based, 'COLLAB_MODE', 'svd')
+    with pytest.raises(ValueError):
+        collaborative_based.collab_model(FAVOURITES, 5)
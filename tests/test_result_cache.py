@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pytest
+from recommenders import registry
+from recommenders.popularity import favourite_rows
+from utils import resources
+from utils.catalog import load_catalog
+from utils.data_loader import load_table
+from utils.resources import resource
+from utils.result_cache import ResultCache, request_key
+
+FAVOURITES = ['Fargo (1996)', 'Shrek (2001)']
+
+@pytest.fixture
+def artifacts(tmp_path):
+    model = tmp_path / 'model'
+    model.mkdir()
+    (model / 'item_factors.npy').write_bytes(b'v1')
+    ratings = tmp_path / 'ratings.csv'
+    ratings.write_text('userId,movieId,rating,timestamp\n1,1,4.0,0\n')
+    return str(model), str(ratings)
+
+def bump(path, data=None):
+    """Rewrite (or just touch) `path` with a later modification time."""
+    if data is not None:
+        with open(path, 'ab') as f:
+            f.write(data)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def test_results_are_served_until_a_dependency_changes(artifacts):
+    cache = ResultCache(check_interval=0)
+    cache.put('key', ['a', 'b'], artifacts)
+    assert cache.get('key', artifacts) == ['a', 'b']
+    bump(artifacts[1], b'2,1,3.5,0\n')
+    assert cache.get('key', artifacts) is None
+    assert cache.stats()['invalidations'] == 1
+
+@pytest.mark.parametrize('change', ['rewrite', 'add', 'remove'])
+def test_changing_a_model_directory_invalidates_results(artifacts, change):
+    cache = ResultCache(check_interval=0)
+    cache.put('key', ['a'], artifacts)
+    model = artifacts[0]
+    if change == 'rewrite':
+        bump(os.path.join(model, 'item_factors.npy'), b'v2')
+    elif change == 'add':
+        open(os.path.join(model, 'meta.json'), 'w').close()
+    else:
+        os.remove(os.path.join(model, 'item_factors.npy'))
+    assert cache.get('key', artifacts) is None
+
+def test_disk_tier_discards_results_of_older_versions(artifacts, tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    ResultCache(path=path, check_interval=0).put('key', ['a'], artifacts)
+    assert ResultCache(path=path, check_interval=0).get('key', artifacts) == ['a']
+    bump(artifacts[1])
+    cache = ResultCache(path=path, check_interval=0)
+    assert cache.get('key', artifacts) is None
+    assert cache.stats()['disk_hits'] == 0
+
+def test_request_keys_ignore_the_order_of_the_favourites():
+    assert request_key(FAVOURITES, 'content', 10) == request_key(FAVOURITES[::-1], 'content', 10)
+    assert request_key(FAVOURITES, 'content', 10) != request_key(FAVOURITES, 'content', 5)
+
+def file_scores(favourites, method='sum'):
+    """Scores of a test backend, read from the file of `load_file_scores`."""
+    return np.array(load_file_scores(), dtype=np.float64), favourite_rows(favourites)
+
+@pytest.fixture
+def file_backend(tmp_path, monkeypatch):
+    """A registry backend whose model is a .npy file of catalogue scores."""
+    path = str(tmp_path / 'scores.npy')
+    np.save(path, np.zeros(len(load_catalog())))
+    monkeypatch.setitem(globals(), 'load_file_scores', resource('test.file_scores')(lambda: np.load(path)))
+    monkeypatch.setattr(registry, 'cache', ResultCache(path=str(tmp_path / 'cache.sqlite'), check_interval=0,
+                                                       before_check=registry.reload_if_changed))
+    monkeypatch.setitem(registry._backends, 'from_file', registry.Backend(
+        'from_file', __name__, 'file_scores', ['test.file_scores'], [path]))
+    yield path
+    resources._registry.pop('test.file_scores', None)
+
+def rewrite_scores(path, row):
+    scores = np.zeros(len(load_catalog()))
+    scores[row] = 1.0
+    np.save(path, scores)
+    bump(path)
+
+def test_recommend_recomputes_from_the_changed_model(file_backend):
+    catalog = load_catalog()
+    rewrite_scores(file_backend, 10)
+    assert registry.recommend(FAVOURITES, 'from_file', top_n=1) == catalog.titles_at([10])
+    assert registry.recommend(FAVOURITES, 'from_file', top_n=1) == catalog.titles_at([10])
+    rewrite_scores(file_backend, 20)
+    assert registry.recommend(FAVOURITES, 'from_file', top_n=1) == catalog.titles_at([20])
+    stats = registry.cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 2)
+    # The disk tier holds the recomputed result, for every process.
+    disk = ResultCache(path=os.path.join(os.path.dirname(file_backend), 'cache.sqlite'), check_interval=0)
+    key = request_key(FAVOURITES, 'from_file', 1, method='sum', blend=[], filters=registry._filter_key(None))
+    assert disk.get(key, registry.artifacts('from_file')) == catalog.titles_at([20])
+
+def test_uncached_requests_also_see_the_changed_model(file_backend):
+    catalog = load_catalog()
+    rewrite_scores(file_backend, 10)
+    assert registry.recommend(FAVOURITES, 'from_file', top_n=1, use_cache=False) == catalog.titles_at([10])
+    rewrite_scores(file_backend, 20)
+    assert registry.recommend_many([FAVOURITES], 'from_file', top_n=1, use_cache=False) == \
+        [catalog.titles_at([20])]
+
+def test_reload_reads_tables_again(tmp_path):
+    movies = tmp_path / 'movies.csv'
+    movies.write_text('movieId,title,genres\n1,Old (1990),Drama\n')
+    assert list(load_table(str(movies))['title']) == ['Old (1990)']
+    movies.write_text('movieId,title,genres\n1,New (1990),Drama\n')
+    bump(str(movies))
+    assert registry.reload_if_changed([str(movies)]) is False
+    registry._versions[str(movies)] = 'older'
+    assert registry.reload_if_changed([str(movies)]) is True
+    assert list(load_table(str(movies))['title']) == ['New (1990)']
+
+def test_collaborative_results_depend_on_the_model_and_every_ratings_file():
+    paths = registry.artifacts('collaborative')
+    for path in ('resources/models/svd_factors', registry.RATINGS_PATH, registry.RATINGS_STREAM_PATH):
+        assert path in paths
@@ -0,0 +1,181 @@
+"""
+
+    Approximate nearest-neighbour search over dense embeddings.
+
+    Author: Explore Data Science Academy.
+
+    Description: A small inverted-file (IVF) index implemented in NumPy.
+    Vectors are L2-normalised (so inner product equals cosine similarity)
+    and clustered with spherical k-means; a query only scores the vectors
+    of its `n_probe` closest clusters. `recall_at_k` and `tune` compare the
+    index against exact brute-force search to pick `n_probe`.
+
+"""
+# Dependencies
+import time
+import numpy as np
+
+def normalize(vectors):
+    """L2-normalise the rows of a dense matrix (zero rows stay zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _top_k(scores, k):
+    """Positions of the k largest scores, best first."""
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+def brute_force(vectors, queries, k):
+    """Exact top-k cosine neighbours of each query.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Indexed vectors, one per row.
+    queries : numpy.ndarray
+        Query vectors, one per row.
+    k : int
+        Number of neighbours to return per query.
+
+    Returns
+    -------
+    list[numpy.ndarray]
+        Row positions in `vectors` of each query's neighbours, best first.
+
+    """
+    scores = normalize(queries).dot(normalize(vectors).T)
+    return [_top_k(row, k) for row in scores]
+
+class IVFIndex:
+    """Inverted-file index for cosine similarity search.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Vectors to index, one per row (e.g. SVD item factors `qi`).
+    n_lists : int, optional
+        Number of k-means clusters. Defaults to `sqrt(n_vectors)`.
+    n_iter : int
+        Number of k-means iterations.
+    seed : int
+        Random seed for the k-means initialisation.
+
+    """
+
+    def __init__(self, vectors, n_lists=None, n_iter=10, seed=0):
+        data = normalize(vectors)
+        n_vectors = data.shape[0]
+        n_lists = min(n_lists or max(1, int(np.sqrt(n_vectors))), n_vectors)
+        rng = np.random.default_rng(seed)
+        centroids = data[rng.choice(n_vectors, n_lists, replace=False)]
+        for _ in range(n_iter):
+            assign = np.argmax(data.dot(centroids.T), axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            counts = np.bincount(assign, minlength=n_lists)
+            # Re-seed empty clusters with random vectors
+            empty = counts == 0
+            sums[empty] = data[rng.choice(n_vectors, empty.sum(), replace=False)]
+            centroids = normalize(sums)
+        assign = np.argmax(data.dot(centroids.T), axis=1)
+        # Store the vectors grouped by cluster so each list is contiguous.
+        self.order = np.argsort(assign, kind='stable')
+        self.offsets = np.searchsorted(assign[self.order], np.arange(n_lists + 1))
+        self.vectors = np.ascontiguousarray(data[self.order])
+        self.centroids = centroids
+        self._ranges = [np.arange(self.offsets[c], self.offsets[c + 1]) for c in range(n_lists)]
+        self._lists = [self.vectors[self.offsets[c]:self.offsets[c + 1]] for c in range(n_lists)]
+        self.n_probe = min(16, n_lists)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def search(self, queries, k, n_probe=None):
+        """Approximate top-k cosine neighbours of each query.
+
+        Parameters
+        ----------
+        queries : numpy.ndarray
+            Query vectors, one per row.
+        k : int
+            Number of neighbours to return per query.
+        n_probe : int, optional
+            Number of clusters scanned per query. Higher is more accurate
+            and slower. Defaults to the index's `n_probe` attribute.
+
+        Returns
+        -------
+        tuple(list[numpy.ndarray], list[numpy.ndarray])
+            For each query, row positions of its neighbours in the
+            original `vectors` (best first) and their cosine similarity.
+
+        """
+        queries = normalize(np.atleast_2d(queries))
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        probes = np.argpartition(-queries.dot(self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        neighbours, similarities = [], []
+        for query, probed in zip(queries, probes):
+            # Lists are contiguous, so each one is scored through a view.
+            scores = np.concatenate([self._lists[c].dot(query) for c in probed])
+            candidates = np.concatenate([self._ranges[c] for c in probed])
+            top = _top_k(scores, k)
+            neighbours.append(self.order[candidates[top]])
+            similarities.append(scores[top])
+        return neighbours, similarities
+
+def recall_at_k(index, vectors, queries, k, n_probe=None):
+    """Mean fraction of the exact top-k neighbours found by the index.
+
+    Parameters
+    ----------
+    index : IVFIndex
+        Index built over `vectors`.
+    vectors : numpy.ndarray
+        The indexed vectors.
+    queries : numpy.ndarray
+        Query vectors, one per row.
+    k : int
+        Neighbourhood size.
+    n_probe : int, optional
+        Clusters scanned per query.
+
+    Returns
+    -------
+    float
+        Recall@k averaged over the queries.
+
+    """
+    exact = brute_force(vectors, queries, k)
+    approx, _ = index.search(queries, k, n_probe)
+    return float(np.mean([len(np.intersect1d(e, a)) / len(e) for e, a in zip(exact, approx)]))
+
+def tune(index, vectors, queries, k, probes=(1, 2, 4, 8, 16, 32)):
+    """Measure recall@k and per-query latency for several `n_probe` values.
+
+    Returns
+    -------
+    list[dict]
+        One entry per `n_probe` with `recall` and `ms_per_query`.
+
+    """
+    results = []
+    for n_probe in probes:
+        start = time.perf_counter()
+        index.search(queries, k, n_probe)
+        elapsed = time.perf_counter() - start
+        results.append({'n_probe': n_probe,
+                        'recall': recall_at_k(index, vectors, queries, k, n_probe),
+                        'ms_per_query': 1000 * elapsed / len(queries)})
+    return results
+
+if __name__ == '__main__':
+    # Tune the SVD item index: python -m utils.ann
+    from recommenders.collaborative_based import load_factor_model
+    item_factors = load_factor_model().item_factors
+    sample = np.random.default_rng(0).choice(len(item_factors), 500, replace=False)
+    index = IVFIndex(item_factors)
+    for row in tune(index, item_factors, item_factors[sample], k=10):
+        print(row)
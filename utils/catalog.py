@@ -0,0 +1,168 @@
+"""
+
+    Movie catalogue with constant-time id and title lookups.
+
+    Author: Explore Data Science Academy.
+
+    Description: A single, read-only view of movies.csv and links.csv that
+    is built once per process and shared by the app and both recommenders,
+    replacing repeated linear scans over the `title` column.
+
+"""
+# Data handling dependencies
+from types import MappingProxyType
+import numpy as np
+from utils.data_loader import MOVIES_PATH, LINKS_PATH, load_frame
+from utils.resources import resource
+
+def _read_only(array):
+    """Return `array` with its write flag cleared."""
+    array = np.asarray(array)
+    array.setflags(write=False)
+    return array
+
+class MovieCatalog:
+    """Immutable lookup tables over the MovieLens movies.
+
+    Rows follow the order of movies.csv. Titles are not unique in the
+    MovieLens data (e.g. remakes released in the same year); a title
+    always resolves to its first row in movies.csv, and
+    `movie_ids_for_title` exposes every movie sharing the title.
+
+    Parameters
+    ----------
+    movies : pandas.DataFrame
+        Columns `movieId`, `title` and `genres`.
+    links : pandas.DataFrame, optional
+        Columns `movieId`, `imdbId` and `tmdbId`. Missing external ids
+        are stored as -1.
+
+    """
+
+    __slots__ = ('movie_ids', 'titles', 'genres', 'imdb_ids', 'tmdb_ids',
+                 '_row_of_id', '_id_of_title', '_ids_of_title')
+
+    def __init__(self, movies, links=None):
+        movies = movies.dropna().reset_index(drop=True)
+        movie_ids = movies['movieId'].to_numpy(dtype=np.int64)
+        titles = movies['title'].to_numpy(dtype=object)
+        imdb_ids = np.full(len(movies), -1, dtype=np.int64)
+        tmdb_ids = np.full(len(movies), -1, dtype=np.int64)
+        row_of_id = {movie_id: row for row, movie_id in enumerate(movie_ids.tolist())}
+        if links is not None:
+            rows = links['movieId'].map(row_of_id)
+            known = rows.notna().to_numpy()
+            rows = rows[known].astype(np.int64).to_numpy()
+            imdb_ids[rows] = links['imdbId'].fillna(-1).to_numpy(dtype=np.int64)[known]
+            tmdb_ids[rows] = links['tmdbId'].fillna(-1).to_numpy(dtype=np.int64)[known]
+        ids_of_title = {}
+        for title, movie_id in zip(titles.tolist(), movie_ids.tolist()):
+            ids_of_title.setdefault(title, []).append(movie_id)
+        object.__setattr__(self, 'movie_ids', _read_only(movie_ids))
+        object.__setattr__(self, 'titles', _read_only(titles))
+        object.__setattr__(self, 'genres', _read_only(movies['genres'].to_numpy(dtype=object)))
+        object.__setattr__(self, 'imdb_ids', _read_only(imdb_ids))
+        object.__setattr__(self, 'tmdb_ids', _read_only(tmdb_ids))
+        object.__setattr__(self, '_row_of_id', MappingProxyType(row_of_id))
+        object.__setattr__(self, '_id_of_title',
+                           MappingProxyType({title: ids[0] for title, ids in ids_of_title.items()}))
+        object.__setattr__(self, '_ids_of_title',
+                           MappingProxyType({title: tuple(ids) for title, ids in ids_of_title.items()}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('MovieCatalog is immutable')
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def __contains__(self, title):
+        return title in self._id_of_title
+
+    def movie_id(self, title):
+        """MovieLens id of `title`. Raises `KeyError` for unknown titles."""
+        return self._id_of_title[title]
+
+    def movie_ids_for_title(self, title):
+        """All MovieLens ids sharing `title`, in movies.csv order."""
+        return self._ids_of_title.get(title, ())
+
+    def row(self, movie_id):
+        """Catalogue row of `movie_id`. Raises `KeyError` for unknown ids."""
+        return self._row_of_id[movie_id]
+
+    def rows(self, movie_ids, missing=None):
+        """Catalogue rows of several movie ids.
+
+        Parameters
+        ----------
+        movie_ids : iterable
+            MovieLens ids.
+        missing : int, optional
+            Row used for unknown ids. By default unknown ids raise `KeyError`.
+
+        Returns
+        -------
+        numpy.ndarray
+            int64 row positions.
+
+        """
+        if missing is None:
+            return np.array([self._row_of_id[m] for m in movie_ids], dtype=np.int64)
+        return np.array([self._row_of_id.get(m, missing) for m in movie_ids], dtype=np.int64)
+
+    def title_row(self, title):
+        """Catalogue row of `title`. Raises `KeyError` for unknown titles."""
+        return self._row_of_id[self._id_of_title[title]]
+
+    def title_rows(self, titles):
+        """Catalogue rows of several titles, as an int64 array."""
+        return np.array([self.title_row(title) for title in titles], dtype=np.int64)
+
+    def all_title_rows(self, titles):
+        """Catalogue rows of every movie called one of `titles`, titles
+        shared by several movies included, as an int64 array."""
+        return self.rows([movie_id for title in titles for movie_id in self.movie_ids_for_title(title)])
+
+    def title(self, row):
+        """Title stored at catalogue `row`."""
+        return self.titles[row]
+
+    def titles_at(self, rows):
+        """Titles stored at several catalogue rows, as a list."""
+        return self.titles[np.asarray(rows, dtype=np.int64)].tolist()
+
+    def title_of_id(self, movie_id):
+        """Title of `movie_id`. Raises `KeyError` for unknown ids."""
+        return self.titles[self._row_of_id[movie_id]]
+
+    def tmdb_id(self, title):
+        """TMDB id of `title`, or None if it has no link."""
+        tmdb_id = self.tmdb_ids[self.title_row(title)]
+        return int(tmdb_id) if tmdb_id >= 0 else None
+
+    def imdb_id(self, title):
+        """IMDb id of `title`, or None if it has no link."""
+        imdb_id = self.imdb_ids[self.title_row(title)]
+        return int(imdb_id) if imdb_id >= 0 else None
+
+@resource('catalog')
+def load_catalog(path_to_movies=MOVIES_PATH, path_to_links=LINKS_PATH):
+    """Build the shared movie catalogue (once per process and set of paths).
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Path to movies.csv.
+    path_to_links : str or None
+        Path to links.csv, or None to build the catalogue without
+        external ids.
+
+    Returns
+    -------
+    MovieCatalog
+        The catalogue.
+
+    """
+    movies = load_frame(path_to_movies)
+    links = load_frame(path_to_links) if path_to_links else None
+    return MovieCatalog(movies, links)
@@ -4,10 +4,250 @@
 
     Author: Explore Data Science Academy.
 
+    Description: The MovieLens CSVs are converted, on first use, into a
+    typed columnar cache (one `.npy` file per column) stored next to the
+    CSV in a `.cache` directory. Subsequent loads memory-map the cached
+    columns, so every module and every worker process shares the same
+    read-only pages instead of parsing the CSVs again. Each load checks
+    the CSV's size and modification time, so a changed CSV is converted
+    and loaded again, also in running processes.
+
 """
 # Data handling dependencies
+import os
+import json
+import shutil
+import tempfile
+import threading
+import contextlib
 import pandas as pd
 import numpy as np
+from utils.instrumentation import span
+
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+LINKS_PATH = 'resources/data/links.csv'
+
+# Bump whenever the on-disk layout below changes.
+CACHE_VERSION = 2
+# Rows parsed per chunk while converting a CSV.
+CHUNK_SIZE = 1_000_000
+
+# Column types of the known MovieLens tables. `str` columns are stored as
+# one UTF-8 blob and `category` columns as int32 codes into a dictionary.
+# Missing values load as pandas reads them: numeric columns with any are
+# stored as float64 with NaN, strings get a mask and categories code -1.
+SCHEMAS = {
+    'movies': {'movieId': np.int32, 'title': str, 'genres': 'category'},
+    'ratings': {'userId': np.int32, 'movieId': np.int32,
+                'rating': np.float32, 'timestamp': np.uint32},
+    'links': {'movieId': np.int32, 'imdbId': np.int32, 'tmdbId': np.int32},
+}
+# Strings inside a blob are separated by this character.
+_SEPARATOR = '\n'
+
+# Absolute CSV path -> (source stamp, columns) of the tables loaded so far
+_tables = {}
+_tables_lock = threading.Lock()
+
+def _table_name(path):
+    """Schema name of a CSV path, e.g. 'movies' for '.../movies.csv'."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name not in SCHEMAS:
+        raise ValueError(f"No column schema defined for '{path}'")
+    return name
+
+def _cache_dir(path):
+    """Directory holding the cached columns of the CSV at `path`."""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.cache', _table_name(path))
+
+def _source_stamp(path):
+    """Identify the version of a CSV by its size and modification time."""
+    stat = os.stat(path)
+    return {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _save_strings(path, strings):
+    """Store a sequence of strings as a single UTF-8 uint8 array."""
+    blob = _SEPARATOR.join(strings).encode('utf-8')
+    np.save(path, np.frombuffer(blob, dtype=np.uint8))
+
+def _load_strings(path):
+    """Inverse of `_save_strings`."""
+    blob = np.load(path, mmap_mode='r')
+    if blob.size == 0:
+        return []
+    return bytes(blob).decode('utf-8').split(_SEPARATOR)
+
+@contextlib.contextmanager
+def staged_directory(target):
+    """Write a directory of files and move it into place in one rename.
+
+    Processes may have the files of `target` memory-mapped, so they must
+    never be truncated or rewritten in place. The block writes into a
+    new staging directory next to `target`, which replaces `target` only
+    if the block succeeds; readers keep the pages of the old files.
+
+    Parameters
+    ----------
+    target : str
+        Directory to (re)create.
+
+    Yields
+    ------
+    str
+        The staging directory to write into.
+
+    """
+    parent = os.path.dirname(os.path.abspath(target))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=f'.{os.path.basename(os.path.normpath(target))}.')
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    os.chmod(staging, 0o755)
+    previous = None
+    if os.path.exists(target):
+        previous = tempfile.mkdtemp(dir=parent, prefix=f'.{os.path.basename(os.path.normpath(target))}.old.')
+        os.replace(target, os.path.join(previous, 'replaced'))
+    os.replace(staging, target)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+def build_cache(path):
+    """Convert a MovieLens CSV into its typed columnar cache.
+
+    The CSV is parsed in chunks and the cache is written with
+    `staged_directory`, so concurrent readers never see a half-written
+    or missing cache.
+
+    Parameters
+    ----------
+    path : str
+        Path to movies.csv, ratings.csv or links.csv.
+
+    Returns
+    -------
+    str
+        The cache directory.
+
+    """
+    schema = SCHEMAS[_table_name(path)]
+    parts = {col: [] for col in schema}
+    for chunk in pd.read_csv(path, chunksize=CHUNK_SIZE):
+        for col, kind in schema.items():
+            values = chunk[col].to_numpy()
+            if kind not in (str, 'category'):
+                # Chunks with missing values stay float64 (and NaN).
+                values = values.astype(np.float64 if pd.isna(values).any() else kind)
+            parts[col].append(values)
+    with staged_directory(_cache_dir(path)) as staging:
+        for col, kind in schema.items():
+            values = np.concatenate(parts[col]) if parts[col] else \
+                np.empty(0, dtype=object if kind in (str, 'category') else kind)
+            missing = pd.isna(values)
+            if kind is str:
+                _save_strings(os.path.join(staging, f'{col}.utf8.npy'), values[~missing].astype(str).tolist())
+                if missing.any():
+                    np.save(os.path.join(staging, f'{col}.missing.npy'), missing)
+            elif kind == 'category':
+                categories, codes = np.unique(values[~missing].astype(str), return_inverse=True)
+                all_codes = np.full(len(values), -1, dtype=np.int32)
+                all_codes[~missing] = codes
+                np.save(os.path.join(staging, f'{col}.codes.npy'), all_codes)
+                _save_strings(os.path.join(staging, f'{col}.categories.utf8.npy'), categories.tolist())
+            else:
+                np.save(os.path.join(staging, f'{col}.npy'), values)
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump(_source_stamp(path), f)
+    return _cache_dir(path)
+
+def _cache_is_fresh(path):
+    """Check whether the cache of `path` matches the current CSV."""
+    try:
+        with open(os.path.join(_cache_dir(path), 'manifest.json')) as f:
+            return json.load(f) == _source_stamp(path)
+    except (OSError, ValueError):
+        return False
+
+def _read_table(path):
+    if not _cache_is_fresh(path):
+        with span(f'data_load.parse_csv.{_table_name(path)}'):
+            build_cache(path)
+    cache = _cache_dir(path)
+    table = {}
+    for col, kind in SCHEMAS[_table_name(path)].items():
+        if kind is str:
+            strings = _load_strings(os.path.join(cache, f'{col}.utf8.npy'))
+            mask = os.path.join(cache, f'{col}.missing.npy')
+            if os.path.exists(mask):
+                missing = np.load(mask)
+                table[col] = np.full(len(missing), np.nan, dtype=object)
+                table[col][~missing] = strings
+            else:
+                table[col] = np.array(strings, dtype=object)
+        elif kind == 'category':
+            categories = np.array(_load_strings(os.path.join(cache, f'{col}.categories.utf8.npy')), dtype=object)
+            codes = np.load(os.path.join(cache, f'{col}.codes.npy'), mmap_mode='r')
+            table[col] = pd.Categorical.from_codes(codes, categories)
+        else:
+            table[col] = np.load(os.path.join(cache, f'{col}.npy'), mmap_mode='r')
+    return table
+
+def clear_tables():
+    """Forget the tables loaded so far, so that the next `load_table`
+    maps their caches again."""
+    with _tables_lock:
+        _tables.clear()
+
+def load_table(path):
+    """Load the columns of a MovieLens CSV through the columnar cache.
+
+    The cache is (re)built when missing or older than the CSV. Loaded
+    tables are shared process-wide until the CSV changes; numeric
+    columns are read-only memory-mapped arrays, so callers must not
+    modify them in place.
+
+    Parameters
+    ----------
+    path : str
+        Path to movies.csv, ratings.csv or links.csv.
+
+    Returns
+    -------
+    dict
+        Column name to array. Genres are returned as a `pandas.Categorical`
+        over the distinct genre strings.
+
+    """
+    path = os.path.abspath(path)
+    stamp = _source_stamp(path)
+    with _tables_lock:
+        loaded = _tables.get(path)
+        if loaded is None or loaded[0] != stamp:
+            loaded = _tables[path] = (stamp, _read_table(path))
+        return loaded[1]
+
+def load_frame(path, columns=None):
+    """Load a MovieLens CSV as a DataFrame backed by the columnar cache.
+
+    Parameters
+    ----------
+    path : str
+        Path to movies.csv, ratings.csv or links.csv.
+    columns : list[str], optional
+        Subset of columns to include.
+
+    Returns
+    -------
+    Pandas DataFrame
+        Frame whose numeric columns share memory with the cache.
+
+    """
+    table = load_table(path)
+    columns = columns or list(table)
+    return pd.DataFrame({col: table[col] for col in columns}, copy=False)
 
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
@@ -24,7 +264,7 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
+    df = load_frame(path_to_movies)
     df = df.dropna()
     movie_list = df['title'].to_list()
     return movie_list
@@ -0,0 +1,148 @@
+"""
+
+    Genre and release-year index of the movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Genres are stored in movies.csv as pipe-separated
+    strings. `GenreIndex` parses them once per process into one bitmask
+    per movie (one bit per genre), a posting list of catalogue rows per
+    genre, and the release year parsed from each title. Recommendations
+    can then be restricted to, or kept away from, some genres and to a
+    range of release years with a few vectorised operations over the
+    catalogue, before the top-N is selected.
+
+"""
+# Dependencies
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.catalog import load_catalog
+from utils.resources import resource
+
+NO_GENRES = '(no genres listed)'
+# Year stored for titles without a parsable release year
+UNKNOWN_YEAR = 0
+# Number of distinct filters whose masks are kept
+MASK_CACHE_SIZE = 256
+
+_YEAR = re.compile(r'\((\d{4})(?:[-–]\d{0,4})?\)\s*$')
+
+def parse_year(title):
+    """Release year at the end of a MovieLens title, or None."""
+    match = _YEAR.search(title)
+    return int(match.group(1)) if match else None
+
+def strip_year(title):
+    """MovieLens title without the release year at its end."""
+    return _YEAR.sub('', title)
+
+class GenreIndex:
+    """Genre bitmasks, genre posting lists and release years of movies.
+
+    Parameters
+    ----------
+    titles, genres : sequence (str)
+        Title and pipe-separated genres of every catalogue row.
+
+    """
+
+    def __init__(self, titles, genres):
+        combinations, codes = np.unique(np.asarray(genres, dtype=object).astype(str), return_inverse=True)
+        split = [[] if combo == NO_GENRES else combo.split('|') for combo in combinations]
+        self.genres = sorted({genre for parts in split for genre in parts})
+        if len(self.genres) > 64:
+            raise ValueError(f'At most 64 genres are supported, found {len(self.genres)}')
+        self.bit = {genre: np.uint64(1) << np.uint64(i) for i, genre in enumerate(self.genres)}
+        combo_bits = np.array([sum((int(self.bit[g]) for g in set(parts)), 0) for parts in split],
+                              dtype=np.uint64)
+        self.bits = combo_bits[codes.ravel()]
+        self.postings = {genre: np.flatnonzero(self.bits & bit).astype(np.int32)
+                         for genre, bit in self.bit.items()}
+        self.years = np.array([parse_year(title) or UNKNOWN_YEAR for title in titles], dtype=np.int16)
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.bits)
+
+    def year_range(self):
+        """Earliest and latest known release year."""
+        known = self.years[self.years != UNKNOWN_YEAR]
+        return int(known.min()), int(known.max())
+
+    def _genre_bits(self, genres):
+        bits = np.uint64(0)
+        for genre in genres or ():
+            if genre not in self.bit:
+                raise ValueError(f'Unknown genre {genre!r}; expected one of {self.genres}')
+            bits |= self.bit[genre]
+        return bits
+
+    def rows(self, genre):
+        """Catalogue rows of every movie of `genre`, ascending."""
+        return self.postings[genre]
+
+    def genres_of(self, row):
+        """Genres of the movie at catalogue `row`."""
+        return [genre for genre, bit in self.bit.items() if self.bits[row] & bit]
+
+    def mask(self, include=None, exclude=None, years=None):
+        """Catalogue rows passing a filter, as a boolean mask.
+
+        Masks are cached per filter, so repeated filters cost a lookup.
+
+        Parameters
+        ----------
+        include : list (str), optional
+            Keep only movies with at least one of these genres.
+        exclude : list (str), optional
+            Drop movies with any of these genres.
+        years : tuple(int or None, int or None), optional
+            Inclusive range of release years; either end may be None.
+            Movies without a known year are dropped when a range is given.
+
+        Returns
+        -------
+        numpy.ndarray
+            Read-only boolean mask over the catalogue rows.
+
+        """
+        key = (tuple(sorted(include or ())), tuple(sorted(exclude or ())), tuple(years or ()))
+        with self._lock:
+            cached = self._masks.get(key)
+            if cached is not None:
+                self._masks.move_to_end(key)
+                return cached
+        keep = np.ones(len(self.bits), dtype=bool)
+        if include:
+            keep &= (self.bits & self._genre_bits(include)) != 0
+        if exclude:
+            keep &= (self.bits & self._genre_bits(exclude)) == 0
+        if years:
+            low, high = years
+            keep &= self.years != UNKNOWN_YEAR
+            if low is not None:
+                keep &= self.years >= low
+            if high is not None:
+                keep &= self.years <= high
+        keep.setflags(write=False)
+        with self._lock:
+            self._masks[key] = keep
+            while len(self._masks) > MASK_CACHE_SIZE:
+                self._masks.popitem(last=False)
+        return keep
+
+    def apply(self, scores, include=None, exclude=None, years=None):
+        """Copy of `scores` with the movies failing the filter set to -inf,
+        so that they are never ranked."""
+        if not (include or exclude or years):
+            return scores
+        return np.where(self.mask(include, exclude, years), scores, -np.inf)
+
+@resource('genre_index')
+def load_genre_index():
+    """Build the genre index of the shared catalogue (once per process)."""
+    catalog = load_catalog()
+    return GenreIndex(catalog.titles, catalog.genres)
@@ -0,0 +1,212 @@
+"""
+
+    Timing spans, counters and profiling hooks for the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: `span` times a named stage (data load, candidate
+    generation, similarity, ranking, poster fetch, ...). Every span feeds
+    process-wide aggregates (count, total and a latency histogram) and, if
+    the code runs inside a `trace`, the per-request breakdown of that
+    trace. `count` maintains counters such as cache hits the same way.
+
+    A trace can also capture a cProfile report or tracemalloc allocation
+    statistics of the request (`PROFILE_REQUESTS=cprofile|tracemalloc`).
+    The aggregates can be exported as JSON (`write_metrics`, or after
+    every trace to `METRICS_PATH`) or as Prometheus text
+    (`prometheus_text`).
+
+"""
+# Dependencies
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+# Capture mode applied to traces that do not choose one
+PROFILE_MODE = os.environ.get('PROFILE_REQUESTS') or None
+METRICS_PATH = os.environ.get('METRICS_PATH') or None
+
+_lock = threading.Lock()
+_local = threading.local()
+# Span name -> [count, total seconds, max seconds, per-bucket counts]
+_spans = {}
+_counters = {}
+# Label -> most recent finished Trace
+_last = {}
+
+class Trace:
+    """Spans and counters recorded while handling one request."""
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.spans = []
+        self.counters = {}
+        self.profile = None
+        self.memory = None
+
+    def breakdown(self):
+        """Stages in start order, with their nesting depth, milliseconds
+        and share of the whole request."""
+        total = self.seconds or (time.perf_counter() - self.started)
+        return [{'stage': name, 'depth': depth, 'ms': round(1000 * seconds, 3),
+                 'share': round(seconds / total, 4) if total else None}
+                for _, name, depth, seconds in sorted(self.spans, key=lambda s: s[0])]
+
+    def to_dict(self):
+        return {'label': self.label,
+                'ms': round(1000 * self.seconds, 3) if self.seconds is not None else None,
+                'stages': self.breakdown(),
+                'counters': dict(self.counters),
+                'profile': self.profile,
+                'memory': self.memory}
+
+def _record(name, seconds):
+    with _lock:
+        entry = _spans.get(name)
+        if entry is None:
+            entry = _spans[name] = [0, 0.0, 0.0, [0] * len(BUCKETS)]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry[3][i] += 1
+                break
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as stage `name`."""
+    current = getattr(_local, 'trace', None)
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _local.depth = depth
+        _record(name, seconds)
+        if current is not None:
+            current.spans.append((start, name, depth, seconds))
+
+def count(name, value=1):
+    """Add `value` to counter `name` (and to the current trace's)."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + value
+
+@contextmanager
+def trace(label, profile=PROFILE_MODE):
+    """Record the stages of one request.
+
+    Parameters
+    ----------
+    label : str
+        Kind of request, e.g. 'recommend'. `last_trace(label)` returns the
+        most recent trace with this label.
+    profile : str, optional
+        'cprofile' to attach the 25 most expensive functions, or
+        'tracemalloc' to attach the allocated and peak bytes and the top
+        allocation sites. Defaults to `PROFILE_REQUESTS`.
+
+    Yields
+    ------
+    Trace
+        The trace being recorded.
+
+    """
+    current = Trace(label)
+    previous = getattr(_local, 'trace', None)
+    _local.trace = current
+    profiler = None
+    if profile == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == 'tracemalloc':
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        size_before = tracemalloc.get_traced_memory()[0]
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - current.started
+        if profiler is not None:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+            current.profile = out.getvalue()
+        elif profile == 'tracemalloc':
+            size, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().compare_to(before, 'lineno')[:10]
+            current.memory = {'allocated_bytes': size - size_before,
+                              'peak_bytes': peak - size_before,
+                              'top': [str(stat) for stat in top]}
+            if not tracing:
+                tracemalloc.stop()
+            count('alloc_bytes', max(size - size_before, 0))
+        _local.trace = previous
+        _record(f'trace.{label}', current.seconds)
+        with _lock:
+            _last[label] = current
+        if METRICS_PATH:
+            write_metrics(METRICS_PATH)
+
+def last_trace(label='recommend'):
+    """The most recent finished trace with `label`, or None."""
+    return _last.get(label)
+
+def metrics():
+    """Process-wide span aggregates and counters."""
+    with _lock:
+        return {'spans': {name: {'count': c, 'total_ms': round(1000 * total, 3),
+                                 'mean_ms': round(1000 * total / c, 3) if c else None,
+                                 'max_ms': round(1000 * peak, 3)}
+                          for name, (c, total, peak, _) in _spans.items()},
+                'counters': dict(_counters)}
+
+def write_metrics(path):
+    """Write `metrics()` and the latest traces to a JSON file (atomically)."""
+    data = dict(metrics(), last_traces={label: t.to_dict() for label, t in list(_last.items())})
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    scratch = f'{path}.{os.getpid()}.tmp'
+    with open(scratch, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(scratch, path)
+
+def _metric_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+def prometheus_text():
+    """Span histograms and counters in the Prometheus text format."""
+    lines = ['# TYPE recommender_stage_seconds histogram']
+    with _lock:
+        spans = {name: (c, total, list(buckets)) for name, (c, total, _, buckets) in _spans.items()}
+        counters = dict(_counters)
+    for name, (c, total, buckets) in sorted(spans.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS, buckets):
+            cumulative += n
+            lines.append(f'recommender_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'recommender_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {c}')
+        lines.append(f'recommender_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+        lines.append(f'recommender_stage_seconds_count{{stage="{name}"}} {c}')
+    for name, value in sorted(counters.items()):
+        metric = f'recommender_{_metric_name(name)}_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,216 @@
+"""
+
+    Cached, concurrent movie poster resolution.
+
+    Author: Explore Data Science Academy.
+
+    Description: Resolves TMDB movie ids to poster image URLs. Lookups go
+    through an in-process LRU, then a persistent SQLite cache (with a TTL
+    for found posters and a shorter one for movies without a poster), and
+    only then to the TMDB API over a pooled HTTP session. Batches of ids
+    are fetched concurrently.
+
+    The API location is configurable (`TMDB_API_URL`), and `serve_stub`
+    starts a local TMDB stand-in so that pages can be rendered and timed
+    offline.
+
+"""
+# Dependencies
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from requests.adapters import HTTPAdapter
+from utils.instrumentation import count, span
+
+API_URL = os.environ.get('TMDB_API_URL', 'https://api.themoviedb.org/3')
+API_KEY = os.environ.get('TMDB_API_KEY', 'c7ec19ffdd3279641fb606d19ceb9bb1')
+IMAGE_URL = 'https://image.tmdb.org/t/p/w500/'
+CACHE_PATH = 'resources/data/.cache/posters.sqlite'
+
+# Found posters are kept for a week, misses for a day.
+POSTER_TTL = 7 * 24 * 3600
+MISSING_TTL = 24 * 3600
+
+class PosterResolver:
+    """Resolve TMDB ids to poster URLs with layered caching.
+
+    Parameters
+    ----------
+    api_url : str
+        Base URL of the TMDB v3 API (or of a local stub).
+    api_key : str
+        TMDB API key.
+    cache_path : str or None
+        SQLite file for the persistent cache, or None to disable it.
+    ttl, missing_ttl : float
+        Seconds for which found posters and misses stay cached.
+    lru_size : int
+        Number of ids kept in the in-process LRU.
+    max_workers : int
+        Concurrent requests issued by `resolve_many`.
+    timeout : float
+        Per-request timeout in seconds.
+
+    """
+
+    def __init__(self, api_url=API_URL, api_key=API_KEY, cache_path=CACHE_PATH,
+                 ttl=POSTER_TTL, missing_ttl=MISSING_TTL, lru_size=4096,
+                 max_workers=10, timeout=5.0):
+        self.api_url = api_url.rstrip('/')
+        self.api_key = api_key
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.lru_size = lru_size
+        self.timeout = timeout
+        self.errors = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._db = None
+        if cache_path:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS posters '
+                             '(tmdb_id INTEGER PRIMARY KEY, url TEXT, expires REAL)')
+            self._db.commit()
+
+    def _cached(self, tmdb_id, now):
+        """Return `(hit, url)` from the LRU or the persistent cache."""
+        with self._lock:
+            entry = self._lru.get(tmdb_id)
+            if entry is not None and entry[1] > now:
+                self._lru.move_to_end(tmdb_id)
+                return True, entry[0]
+            if self._db is None:
+                return False, None
+            row = self._db.execute('SELECT url, expires FROM posters WHERE tmdb_id = ?',
+                                   (tmdb_id,)).fetchone()
+        if row is not None and row[1] > now:
+            self._remember(tmdb_id, row[0], row[1], persist=False)
+            return True, row[0]
+        return False, None
+
+    def _remember(self, tmdb_id, url, expires, persist=True):
+        """Store a lookup result in the LRU and, optionally, on disk."""
+        with self._lock:
+            self._lru[tmdb_id] = (url, expires)
+            self._lru.move_to_end(tmdb_id)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+            if persist and self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO posters VALUES (?, ?, ?)',
+                                 (tmdb_id, url, expires))
+                self._db.commit()
+
+    def _fetch(self, tmdb_id):
+        """Ask the API for the poster of `tmdb_id` and cache the answer."""
+        try:
+            response = self._session.get(f'{self.api_url}/movie/{tmdb_id}',
+                                         params={'api_key': self.api_key, 'language': 'en-US'},
+                                         timeout=self.timeout)
+            if response.status_code == 404:
+                # The movie is unknown to TMDB: cache the miss.
+                self._remember(tmdb_id, None, time.time() + self.missing_ttl)
+                return None
+            response.raise_for_status()
+            poster_path = response.json().get('poster_path')
+        except (requests.exceptions.RequestException, ValueError):
+            # Transient failures are not cached.
+            with self._lock:
+                self.errors += 1
+            return None
+        url = IMAGE_URL + poster_path.lstrip('/') if poster_path else None
+        self._remember(tmdb_id, url, time.time() + (self.ttl if url else self.missing_ttl))
+        return url
+
+    def resolve(self, tmdb_id):
+        """Return the poster URL of `tmdb_id`, or None if there is none."""
+        return self.resolve_many([tmdb_id])[0]
+
+    def resolve_many(self, tmdb_ids):
+        """Return the poster URLs of several ids, fetching misses concurrently.
+
+        Parameters
+        ----------
+        tmdb_ids : list
+            TMDB ids; None entries resolve to None.
+
+        Returns
+        -------
+        list
+            Poster URL (or None) for each id, in order.
+
+        """
+        now = time.time()
+        urls, pending = {}, []
+        with span('posters.fetch'):
+            for tmdb_id in dict.fromkeys(tmdb_ids):
+                if tmdb_id is None:
+                    continue
+                hit, url = self._cached(int(tmdb_id), now)
+                if hit:
+                    urls[tmdb_id] = url
+                else:
+                    pending.append(tmdb_id)
+            count('posters.cache_hits', len(urls))
+            count('posters.api_requests', len(pending))
+            for tmdb_id, url in zip(pending, self._pool.map(self._fetch, [int(t) for t in pending])):
+                urls[tmdb_id] = url
+        return [urls.get(tmdb_id) for tmdb_id in tmdb_ids]
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Answer `/movie/<id>` the way TMDB does, from an in-memory dict."""
+
+    posters = {}
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        tmdb_id = self.path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        if not tmdb_id.isdigit() or int(tmdb_id) not in self.posters:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps({'id': int(tmdb_id), 'poster_path': self.posters[int(tmdb_id)]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve_stub(posters, port=0, delay=0.0):
+    """Start a local stand-in for the TMDB movie endpoint.
+
+    Parameters
+    ----------
+    posters : dict
+        TMDB id to poster path (or None). Unknown ids answer 404.
+    port : int
+        Port to listen on; 0 picks a free one.
+    delay : float
+        Seconds to wait before answering, to emulate network latency.
+
+    Returns
+    -------
+    tuple(ThreadingHTTPServer, str)
+        The running server (call `shutdown()` to stop it) and the API
+        URL to pass to `PosterResolver`.
+
+    """
+    handler = type('StubHandler', (_StubHandler,), {'posters': dict(posters), 'delay': delay})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
@@ -0,0 +1,128 @@
+"""
+
+    Process-wide registry of expensive, shared resources.
+
+    Author: Explore Data Science Academy.
+
+    Description: Streamlit re-executes the app script on every widget
+    interaction and for every session. Loaders decorated with `resource`
+    run at most once per server process (per distinct set of arguments),
+    in the same spirit as `st.cache_resource`, but they also work outside
+    of Streamlit (batch jobs, benchmarks) and record how long the cold
+    load and the subsequent warm lookups took.
+
+"""
+# Dependencies
+import time
+import functools
+import threading
+from utils.instrumentation import span
+
+# Resource name -> _Resource, shared by every rerun of the app script.
+_registry = {}
+_registry_lock = threading.Lock()
+
+class _Resource:
+    """Cached values and timings of one registered loader."""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.values = {}
+        self.cold_seconds = 0.0
+        self.warm_calls = 0
+        self.warm_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, args, kwargs):
+        start = time.perf_counter()
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            value = self.values[key]
+        except KeyError:
+            with self.lock:
+                if key not in self.values:
+                    with span(f'resource.{self.name}'):
+                        self.values[key] = self.loader(*args, **kwargs)
+                    self.cold_seconds += time.perf_counter() - start
+                    return self.values[key]
+            value = self.values[key]
+        self.warm_calls += 1
+        self.warm_seconds += time.perf_counter() - start
+        return value
+
+def resource(name):
+    """Register a loader whose result is shared for the process lifetime.
+
+    Parameters
+    ----------
+    name : str
+        Unique resource name, used in `timings` and `warm_up`. Re-registering
+        a name (e.g. when Streamlit re-runs the app script) keeps the
+        values that were already loaded.
+
+    Returns
+    -------
+    callable
+        Decorator. The decorated loader's arguments must be hashable.
+
+    """
+    def decorator(loader):
+        with _registry_lock:
+            entry = _registry.get(name)
+            if entry is None:
+                entry = _registry[name] = _Resource(name, loader)
+            else:
+                entry.loader = loader
+
+        @functools.wraps(loader)
+        def get(*args, **kwargs):
+            return entry.get(args, kwargs)
+        get.resource_name = name
+        return get
+    return decorator
+
+def warm_up(names=None):
+    """Load registered resources (with their default arguments) up-front.
+
+    Parameters
+    ----------
+    names : list[str], optional
+        Resources to load. Defaults to every registered resource.
+
+    Returns
+    -------
+    dict
+        Timings, as returned by `timings`.
+
+    """
+    for name in names or list(_registry):
+        _registry[name].get((), {})
+    return timings()
+
+def timings():
+    """Report cold-load and warm-lookup timings of every resource.
+
+    Returns
+    -------
+    dict
+        Resource name to `loaded` (number of cached values),
+        `cold_seconds` (total time spent loading), `warm_calls` and
+        `warm_seconds_mean` (average cached lookup time).
+
+    """
+    return {
+        name: {
+            'loaded': len(entry.values),
+            'cold_seconds': round(entry.cold_seconds, 6),
+            'warm_calls': entry.warm_calls,
+            'warm_seconds_mean': round(entry.warm_seconds / entry.warm_calls, 9) if entry.warm_calls else None,
+        }
+        for name, entry in _registry.items()
+    }
+
+def clear(name=None):
+    """Drop the cached values of one resource, or of all of them."""
+    for entry in ([_registry[name]] if name else list(_registry.values())):
+        with entry.lock:
+            entry.values.clear()
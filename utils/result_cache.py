@@ -0,0 +1,183 @@
+"""
+
+    Cache of recommendation results.
+
+    Author: Explore Data Science Academy.
+
+    Description: App users tend to ask for the same recommendations
+    repeatedly. `ResultCache` keeps recent results in an in-process LRU
+    and, optionally, in a SQLite file shared by every process. Each result
+    is stored with a fingerprint (size and modification time) of the data
+    files and model artifacts it was computed from, and is discarded as
+    soon as one of them changes. Fingerprints are re-checked at most once
+    per `check_interval` seconds, so that a hit costs a dictionary lookup.
+
+"""
+# Dependencies
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_PATH = 'resources/data/.cache/recommendations.sqlite'
+
+def fingerprint(paths):
+    """Size and modification time of files (and of the files directly
+    inside directories), as a short hex digest. Missing paths count too."""
+    parts = []
+    for path in paths:
+        entries = [path]
+        if os.path.isdir(path):
+            entries = sorted(os.path.join(path, name) for name in os.listdir(path))
+        for entry in entries:
+            try:
+                stat = os.stat(entry)
+                parts.append(f'{entry}:{stat.st_size}:{stat.st_mtime_ns}')
+            except OSError:
+                parts.append(f'{entry}:missing')
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:16]
+
+def request_key(favourites, algorithm, top_n, **options):
+    """Normalised cache key of a recommendation request.
+
+    The favourites are order-insensitive: a list of titles is treated as
+    weight 1 per title, repeated titles add up, and titles are sorted.
+
+    """
+    items = favourites.items() if isinstance(favourites, dict) else ((title, 1.0) for title in favourites)
+    weights = {}
+    for title, weight in items:
+        weights[title] = weights.get(title, 0.0) + float(weight)
+    return json.dumps([sorted(weights.items()), algorithm, int(top_n), sorted(options.items())],
+                      ensure_ascii=False)
+
+class ResultCache:
+    """Bounded LRU of recommendation results with an optional disk tier.
+
+    Parameters
+    ----------
+    max_entries : int
+        Number of results kept in memory.
+    path : str or None
+        SQLite file for the persistent tier, or None to disable it.
+    max_disk_entries : int
+        Number of results kept on disk; the oldest are dropped first.
+    check_interval : float
+        Seconds for which a dependency fingerprint is trusted before the
+        files are looked at again.
+    before_check : callable, optional
+        Called with the dependencies every time the files are looked at
+        again, before they are fingerprinted. It lets the caller reload
+        whatever it computes results from when the files changed, so that
+        results stored under the new fingerprint are computed from them.
+
+    """
+
+    def __init__(self, max_entries=1024, path=None, max_disk_entries=100000, check_interval=1.0,
+                 before_check=None):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.check_interval = check_interval
+        self.before_check = before_check
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lru = OrderedDict()
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                             '(key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT, created REAL)')
+            self._db.commit()
+
+    def _fingerprint(self, dependencies):
+        """Fingerprint of `dependencies`, recomputed at most every `check_interval`."""
+        now = time.monotonic()
+        cached = self._fingerprints.get(dependencies)
+        if cached is not None and now - cached[1] < self.check_interval:
+            return cached[0]
+        if self.before_check is not None:
+            self.before_check(dependencies)
+        value = fingerprint(dependencies)
+        self._fingerprints[dependencies] = (value, now)
+        return value
+
+    def get(self, key, dependencies=()):
+        """Cached result of `key`, or None if missing or stale.
+
+        Parameters
+        ----------
+        key : str
+            Request key, e.g. from `request_key`.
+        dependencies : tuple (str)
+            Files and directories the result was computed from.
+
+        """
+        dependencies = tuple(dependencies)
+        with self._lock:
+            current = self._fingerprint(dependencies)
+            entry = self._lru.get(key)
+            if entry is not None:
+                if entry[0] == current:
+                    self._lru.move_to_end(key)
+                    self.hits += 1
+                    return list(entry[1])
+                del self._lru[key]
+                self.invalidations += 1
+            if self._db is not None:
+                row = self._db.execute('SELECT fingerprint, value FROM results WHERE key = ?',
+                                       (key,)).fetchone()
+                if row is not None and row[0] == current:
+                    value = json.loads(row[1])
+                    self._store(key, current, value)
+                    self.disk_hits += 1
+                    return list(value)
+                if row is not None:
+                    self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def _store(self, key, current, value):
+        self._lru[key] = (current, value)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def put(self, key, value, dependencies=()):
+        """Store the result `value` (a JSON-serialisable list) of `key`."""
+        value = list(value)
+        with self._lock:
+            current = self._fingerprint(tuple(dependencies))
+            self._store(key, current, value)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                 (key, current, json.dumps(value), time.time()))
+                self._db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                                 'ORDER BY created DESC LIMIT -1 OFFSET ?)', (self.max_disk_entries,))
+                self._db.commit()
+
+    def clear(self):
+        """Drop every cached result, in memory and on disk."""
+        with self._lock:
+            self._lru.clear()
+            self._fingerprints.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+
+    def stats(self):
+        """Hit/miss counters and the number of results held in memory."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+                'entries': len(self._lru)}
@@ -0,0 +1,175 @@
+"""
+
+    Aggregation of per-favourite similarity scores.
+
+    Author: Explore Data Science Academy.
+
+    Description: Both recommenders score every movie against each of the
+    app user's favourites and then need one ranking. The helpers below
+    accept any number of favourites with optional weights, combine the
+    per-favourite score vectors in a single NumPy pass and select the
+    top-N movies with a linear-time partition instead of sorting whole
+    score vectors.
+
+"""
+# Dependencies
+import numpy as np
+from scipy import sparse
+
+# Ways of combining the weighted scores of the favourites:
+#   'sum'      - sum over favourites of weight * score,
+#   'max'      - best weight * score over the favourites,
+#   'weighted' - weighted mean, i.e. 'sum' divided by the total weight.
+AGGREGATIONS = ('sum', 'max', 'weighted')
+
+class UnknownFavouritesError(ValueError):
+    """Raised by a scoring function when none of the favourites is known
+    to it, so that callers can fall back to another ranking."""
+
+class IndexNotReadyError(UnknownFavouritesError):
+    """Raised by a scoring function whose index is still being built;
+    callers fall back to another ranking as for unknown favourites."""
+
+def favourite_weights(favourites, known=None):
+    """Split favourites into titles and weights.
+
+    Parameters
+    ----------
+    favourites : list (str) or dict
+        Favourite titles, each with a weight of 1, or a mapping of title
+        to weight. Repeated titles have their weights added up.
+    known : callable, optional
+        Only keep the titles for which `known(title)` is true (e.g.
+        `catalog.__contains__`).
+
+    Returns
+    -------
+    tuple(list (str), numpy.ndarray)
+        Distinct titles, in first-seen order, and their float64 weights.
+
+    """
+    items = favourites.items() if isinstance(favourites, dict) else ((title, 1.0) for title in favourites)
+    weights = {}
+    for title, weight in items:
+        if known is None or known(title):
+            weights[title] = weights.get(title, 0.0) + float(weight)
+    return list(weights), np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+
+def aggregate(scores, weights=None, method='sum'):
+    """Combine the score vectors of several favourites into one.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray or scipy.sparse matrix
+        One row of scores per favourite, one column per movie. Missing
+        entries of a sparse matrix count as a score of 0.
+    weights : array-like, optional
+        Weight of each favourite. Defaults to 1 for every favourite.
+    method : str
+        One of `AGGREGATIONS`.
+
+    Returns
+    -------
+    numpy.ndarray
+        float64 score of every movie.
+
+    """
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {method!r}; expected one of {AGGREGATIONS}")
+    n_favourites = scores.shape[0]
+    weights = np.ones(n_favourites) if weights is None else np.asarray(weights, dtype=np.float64)
+    if n_favourites == 0:
+        return np.zeros(scores.shape[1])
+    if method == 'max':
+        weighted = sparse.diags(weights).dot(scores) if sparse.issparse(scores) else weights[:, None] * scores
+        totals = weighted.max(axis=0)
+        return np.asarray(totals.todense() if sparse.issparse(totals) else totals, dtype=np.float64).ravel()
+    totals = np.asarray(scores.T.dot(weights), dtype=np.float64).ravel()
+    if method == 'weighted' and weights.sum() > 0:
+        totals /= weights.sum()
+    return totals
+
+def top_n(scores, n, exclude=None):
+    """Positions of the `n` highest scores, best first.
+
+    Runs in linear time via `numpy.partition`; only the selected scores
+    are sorted. Ties are broken by lowest position, so results are
+    deterministic.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        Score of every movie.
+    n : int
+        Number of positions to return.
+    exclude : array-like, optional
+        Positions that must not be returned (e.g. the favourites).
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to `n` int64 positions. Positions with a score of `-inf` or
+        NaN are never returned.
+
+    """
+    scores = np.array(scores, dtype=np.float64)
+    if exclude is not None:
+        scores[np.asarray(exclude, dtype=np.int64)] = -np.inf
+    finite = np.flatnonzero(np.isfinite(scores))
+    n = min(n, len(finite))
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    values = scores[finite]
+    # Partitioning is slow when most scores are tied (e.g. the zeros of
+    # movies no favourite is similar to, or filtered-out movies), so only
+    # the scores above the lowest one are partitioned.
+    low = values.min()
+    rest = finite[values > low]
+    if len(rest) < n:
+        top = np.concatenate([rest, finite[values == low][:n - len(rest)]])
+    else:
+        values = scores[rest]
+        kth = np.partition(values, len(values) - n)[len(values) - n]
+        above = rest[values > kth]
+        top = np.concatenate([above, rest[values == kth][:n - len(above)]])
+    return top[np.lexsort((top, -scores[top]))]
+
+def aggregate_groups(scores, groups, weights=None, method='sum'):
+    """Combine the score rows of several requests' favourites at once.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray or scipy.sparse matrix
+        One row per favourite, over all requests, one column per movie.
+    groups : array-like
+        Request (0 to n_requests - 1) that each row belongs to.
+    weights : array-like, optional
+        Weight of each row. Defaults to 1.
+    method : str
+        One of `AGGREGATIONS`.
+
+    Returns
+    -------
+    numpy.ndarray
+        float64 scores of shape `(n_requests, n_movies)`. 'sum' and
+        'weighted' are computed for every request in a single sparse
+        product.
+
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    weights = np.ones(len(groups)) if weights is None else np.asarray(weights, dtype=np.float64)
+    if method == 'max':
+        return np.vstack([aggregate(scores[groups == g], weights[groups == g], method)
+                          for g in range(n_groups)] or [np.zeros((0, scores.shape[1]))])
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {method!r}; expected one of {AGGREGATIONS}")
+    # Requests x favourites matrix holding each favourite's weight
+    combine = sparse.csr_matrix((weights, (groups, np.arange(len(groups)))),
+                                shape=(n_groups, len(groups)))
+    totals = combine.dot(scores)
+    totals = np.asarray(totals.todense() if sparse.issparse(totals) else totals, dtype=np.float64)
+    if method == 'weighted':
+        total_weight = np.bincount(groups, weights=weights, minlength=n_groups)
+        totals /= np.where(total_weight > 0, total_weight, 1.0)[:, None]
+    return totals
@@ -0,0 +1,234 @@
+"""
+
+    Sparse top-K item-similarity index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Helper functions to compute, persist and load the K most
+    similar items for every row of a sparse feature matrix. Similarities
+    are computed in row blocks so that the full dense item-item matrix is
+    never materialised.
+
+"""
+# Data handling dependencies
+import os
+import json
+import numpy as np
+from scipy import sparse
+from utils.data_loader import staged_directory
+
+# Feature matrices at most this wide are multiplied in dense form
+DENSE_FEATURE_LIMIT = 1024
+# In wider matrices, features present in more than this share of the
+# rows (e.g. genres and years) are still multiplied in dense form
+DENSE_FEATURE_SHARE = 0.01
+
+def l2_normalize_rows(matrix):
+    """Scale every row of a sparse matrix to unit L2 norm.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse matrix
+        Item feature matrix with one row per item.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Row-normalised float32 copy of `matrix`. All-zero rows are kept
+        as all-zero rows.
+
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(matrix).tocsr().astype(np.float32)
+
+def _top_k_block(block, k):
+    """Select the k largest entries of every row of a dense block.
+
+    Ties at the k-th score are resolved in favour of the lowest column,
+    which keeps the result deterministic even when most scores are equal
+    (a case in which `numpy.argpartition` is also very slow).
+
+    """
+    n_cols = block.shape[1]
+    threshold = np.partition(block, n_cols - k, axis=1)[:, n_cols - k]
+    above = block > threshold[:, None]
+    tied = block == threshold[:, None]
+    needed = k - above.sum(axis=1)
+    # Keep the first `needed` tied columns of every row (rank among ties).
+    rows, cols = np.nonzero(tied)
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    chosen = rank < needed[rows]
+    keep = above
+    keep[rows[chosen], cols[chosen]] = True
+    top = np.nonzero(keep)[1].reshape(block.shape[0], k)
+    top_scores = np.take_along_axis(block, top, axis=1)
+    # Columns are ascending, so a stable sort keeps ties in column order.
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def _unique_rows(matrix):
+    """Return the first position of every distinct row and each row's group."""
+    first, groups = {}, np.empty(matrix.shape[0], dtype=np.int64)
+    for i in range(matrix.shape[0]):
+        lo, hi = matrix.indptr[i], matrix.indptr[i + 1]
+        key = matrix.indices[lo:hi].tobytes() + matrix.data[lo:hi].tobytes()
+        groups[i] = first.setdefault(key, len(first))
+    return groups
+
+def top_k_similarity(matrix, k=50, block_size=512):
+    """Compute the top-k cosine neighbours of every row of `matrix`.
+
+    Rows with identical features share a single similarity computation,
+    which matters for genre features where ~62k movies have fewer than
+    2k distinct genre combinations.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse matrix
+        Item feature matrix with one row per item.
+    k : int
+        Number of neighbours to keep per item.
+    block_size : int
+        Number of rows scored at a time. Peak memory is roughly
+        `block_size * n_items * 4` bytes.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        `(neighbours, scores)` arrays of shape `(n_items, k)`. Neighbours
+        are int32 row positions sorted by descending similarity (ties are
+        broken by row position); an item is never its own neighbour.
+
+    """
+    normed = l2_normalize_rows(matrix)
+    normed.sort_indices()
+    n_items = normed.shape[0]
+    k = min(k, n_items - 1)
+    groups = _unique_rows(normed)
+    _, representatives = np.unique(groups, return_index=True)
+    queries = normed[representatives]
+    # One spare neighbour per query, as an item must not be its own neighbour.
+    group_top = np.empty((len(representatives), k + 1), dtype=np.int32)
+    group_scores = np.empty((len(representatives), k + 1), dtype=np.float32)
+    # With a narrow vocabulary a dense right-hand side is far cheaper
+    # than a sparse-sparse product whose result is nearly dense anyway.
+    # A wide vocabulary is split: its few frequent features are multiplied
+    # densely and only the long tail of rare ones sparsely.
+    if normed.shape[1] <= DENSE_FEATURE_LIMIT:
+        dense = np.arange(normed.shape[1])
+    else:
+        frequency = np.bincount(normed.indices, minlength=normed.shape[1])
+        dense = np.argsort(-frequency, kind='stable')[:DENSE_FEATURE_LIMIT]
+        dense = np.sort(dense[frequency[dense] > DENSE_FEATURE_SHARE * n_items])
+    rare = np.setdiff1d(np.arange(normed.shape[1]), dense)
+    dense_t = normed[:, dense].T.toarray()
+    rare_t = normed[:, rare].T.tocsc() if len(rare) else None
+    for start in range(0, queries.shape[0], block_size):
+        stop = min(start + block_size, queries.shape[0])
+        block = queries[start:stop][:, dense].toarray().dot(dense_t)
+        if rare_t is not None:
+            block += queries[start:stop][:, rare].dot(rare_t).toarray()
+        group_top[start:stop], group_scores[start:stop] = _top_k_block(block, k + 1)
+    # Expand back to items, dropping the item itself (or else the spare).
+    neighbours = group_top[groups]
+    scores = group_scores[groups]
+    drop = neighbours == np.arange(n_items)[:, None]
+    drop[~drop.any(axis=1), -1] = True
+    return neighbours[~drop].reshape(n_items, k), scores[~drop].reshape(n_items, k)
+
+def top_k_sparse_rows(matrix, k, skip=None):
+    """Select the k largest positive entries of every row of a sparse matrix.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse matrix
+        Similarity rows, e.g. a block of an item-item product.
+    k : int
+        Number of entries to keep per row.
+    skip : array-like, optional
+        One column per row that must not be selected (e.g. the item
+        itself).
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        `(columns, scores)` arrays of shape `(n_rows, k)`, sorted by
+        descending score with ties broken by column. Rows with fewer than
+        k entries are padded with column -1 and score 0.
+
+    """
+    matrix = sparse.csr_matrix(matrix)
+    n_rows = matrix.shape[0]
+    rows = np.repeat(np.arange(n_rows), np.diff(matrix.indptr))
+    cols, data = matrix.indices, matrix.data
+    valid = data > 0
+    if skip is not None:
+        valid &= cols != np.asarray(skip)[rows]
+    rows, cols, data = rows[valid], cols[valid], data[valid]
+    order = np.lexsort((cols, -data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    chosen = rank < k
+    top = np.full((n_rows, k), -1, dtype=np.int32)
+    top_scores = np.zeros((n_rows, k), dtype=np.float32)
+    top[rows[chosen], rank[chosen]] = cols[chosen]
+    top_scores[rows[chosen], rank[chosen]] = data[chosen]
+    return top, top_scores
+
+def save_index(path, item_ids, neighbours, scores, meta=None):
+    """Persist a top-k index as memory-mappable `.npy` files.
+
+    The files are written to a staging directory which then replaces
+    `path` in one rename, so processes reading the previous index through
+    memory maps are unaffected.
+
+    Parameters
+    ----------
+    path : str
+        Directory in which to store the index. Created if missing.
+    item_ids : array-like
+        Identifier (e.g. MovieLens movieId) of every indexed row.
+    neighbours : numpy.ndarray
+        Neighbour row positions as returned by `top_k_similarity` (or
+        `top_k_sparse_rows`, where -1 marks a missing neighbour).
+    scores : numpy.ndarray
+        Neighbour similarity scores as returned by `top_k_similarity`.
+    meta : dict, optional
+        Extra JSON-serialisable information stored alongside the arrays.
+
+    """
+    meta = dict(meta or {}, n_items=int(neighbours.shape[0]), k=int(neighbours.shape[1]))
+    with staged_directory(path) as staging:
+        np.save(os.path.join(staging, 'item_ids.npy'), np.asarray(item_ids, dtype=np.int32))
+        np.save(os.path.join(staging, 'neighbours.npy'), neighbours.astype(np.int32))
+        np.save(os.path.join(staging, 'scores.npy'), scores.astype(np.float32))
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+def load_index(path, mmap_mode='r'):
+    """Load a top-k index written by `save_index`.
+
+    Parameters
+    ----------
+    path : str
+        Directory containing the index.
+    mmap_mode : str or None
+        Passed on to `numpy.load`. The default memory-maps the arrays
+        read-only so that the index costs almost nothing to open.
+
+    Returns
+    -------
+    dict
+        Keys `item_ids`, `neighbours`, `scores` and `meta`.
+
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return {
+        'item_ids': np.load(os.path.join(path, 'item_ids.npy'), mmap_mode=mmap_mode),
+        'neighbours': np.load(os.path.join(path, 'neighbours.npy'), mmap_mode=mmap_mode),
+        'scores': np.load(os.path.join(path, 'scores.npy'), mmap_mode=mmap_mode),
+        'meta': meta,
+    }
@@ -0,0 +1,161 @@
+"""
+
+    Typeahead search over the movie titles.
+
+    Author: Explore Data Science Academy.
+
+    Description: `TitleIndex` finds catalogue titles matching what an app
+    user has typed so far, so that any of the ~62k movies can be picked
+    without sending every title to the browser. Titles are normalised
+    (case, accents, punctuation and trailing articles such as ", The" are
+    ignored) and matched in two ways:
+
+      - prefix matches, via binary search over a sorted array holding the
+        title from each word onwards, so "knight" finds "The Dark Knight";
+      - fuzzy matches, via an inverted index of character trigrams ranked
+        by Dice similarity, so that misspelt queries still find a title.
+
+    Prefix matches rank first (whole-title prefixes before word prefixes,
+    then shorter titles first); fuzzy matches fill the remaining places.
+
+"""
+# Dependencies
+import re
+import unicodedata
+import numpy as np
+from utils.catalog import load_catalog
+from utils.resources import resource
+
+# Fuzzy matches must share at least this Dice similarity with the query
+MIN_SIMILARITY = 0.3
+
+_ARTICLE = re.compile(r'^(.*), (the|a|an|le|la|les|l\'|el|los|der|die|das)( \(.*)?$', re.IGNORECASE)
+_WORD = re.compile(r'[a-z0-9]+')
+ARTICLES = frozenset(['the', 'a', 'an', 'le', 'la', 'les', 'l', 'el', 'los', 'der', 'die', 'das'])
+
+def normalize(text):
+    """Lower-case words of a title or query, as a single spaced string.
+
+    A trailing article is moved to the front ("Matrix, The (1999)"
+    becomes "the matrix 1999") and accents are stripped.
+
+    """
+    text = _ARTICLE.sub(r'\2 \1\3', text.strip())
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return ' '.join(_WORD.findall(text))
+
+def trigrams(text):
+    """Distinct character trigrams of a normalised string, padded with spaces."""
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TitleIndex:
+    """Prefix and fuzzy search over a list of titles.
+
+    Parameters
+    ----------
+    titles : sequence (str)
+        Titles to search, e.g. `MovieCatalog.titles`. Results are
+        positions in this sequence; a repeated title is only found at its
+        first position.
+
+    """
+
+    def __init__(self, titles):
+        self.titles = list(titles)
+        keys = [normalize(title) for title in self.titles]
+        self.lengths = np.array([len(key) for key in keys], dtype=np.int32)
+        # Every title from each of its words onwards, sorted for bisection
+        # (repeated titles are only indexed at their first position)
+        first = {title: row for row, title in reversed(list(enumerate(self.titles)))}
+        indexed = [row for row in range(len(keys)) if first[self.titles[row]] == row]
+        suffixes, rows, leading = [], [], []
+        for row in indexed:
+            key = keys[row]
+            starts = [0] + [i + 1 for i, c in enumerate(key) if c == ' ']
+            suffixes.extend(key[start:] for start in starts)
+            rows.extend([row] * len(starts))
+            # A match after a leading article counts as a whole-title match
+            leading.extend(start == 0 or (n == 1 and key[:start - 1] in ARTICLES)
+                           for n, start in enumerate(starts))
+        suffixes = np.array(suffixes)
+        order = np.argsort(suffixes, kind='stable')
+        self.suffixes = suffixes[order]
+        self.suffix_rows = np.array(rows, dtype=np.int32)[order]
+        self.suffix_leading = np.array(leading, dtype=bool)[order]
+        # Trigram -> rows inverted index, in CSR form
+        vocabulary, grams, counts = {}, [], []
+        for row in indexed:
+            row_grams = [vocabulary.setdefault(g, len(vocabulary)) for g in trigrams(keys[row])]
+            grams.extend(row_grams)
+            counts.append(len(row_grams))
+        grams = np.array(grams, dtype=np.int32)
+        posting_rows = np.repeat(np.array(indexed, dtype=np.int32), counts)
+        order = np.argsort(grams, kind='stable')
+        self.vocabulary = vocabulary
+        self.posting_rows = posting_rows[order]
+        self.posting_ptr = np.concatenate([[0], np.cumsum(np.bincount(grams, minlength=len(vocabulary)))])
+        self.n_trigrams = np.bincount(posting_rows, minlength=len(keys))
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _prefix_rows(self, query, limit):
+        lo, hi = np.searchsorted(self.suffixes, [query, query + '\uffff'])
+        if lo == hi:
+            return np.empty(0, dtype=np.int64)
+        rows = self.suffix_rows[lo:hi]
+        order = np.lexsort((rows, self.lengths[rows], ~self.suffix_leading[lo:hi]))
+        rows = rows[order]
+        # Keep the best-ranked match of every title
+        _, first = np.unique(rows, return_index=True)
+        return rows[np.sort(first)][:limit].astype(np.int64)
+
+    def _fuzzy_rows(self, query, limit, exclude):
+        grams = [self.vocabulary[g] for g in trigrams(query) if g in self.vocabulary]
+        if not grams:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate([self.posting_rows[self.posting_ptr[g]:self.posting_ptr[g + 1]]
+                                     for g in grams])
+        shared = np.bincount(candidates, minlength=len(self.titles))
+        similarity = 2.0 * shared / (len(trigrams(query)) + self.n_trigrams)
+        similarity[exclude] = 0.0
+        similarity[similarity < MIN_SIMILARITY] = 0.0
+        n = min(limit, int(np.count_nonzero(similarity)))
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-similarity, n - 1)[:n]
+        return top[np.lexsort((top, -similarity[top]))].astype(np.int64)
+
+    def search_rows(self, query, limit=10):
+        """Positions of the titles best matching `query`, best first.
+
+        Parameters
+        ----------
+        query : str
+            Text typed so far; may be a prefix of any word of the title.
+        limit : int
+            Largest number of positions returned.
+
+        Returns
+        -------
+        numpy.ndarray
+            Up to `limit` int64 positions in `titles`.
+
+        """
+        query = normalize(query)
+        if not query or limit <= 0:
+            return np.empty(0, dtype=np.int64)
+        rows = self._prefix_rows(query, limit)
+        if len(rows) < limit:
+            rows = np.concatenate([rows, self._fuzzy_rows(query, limit - len(rows), rows)])
+        return rows
+
+    def search(self, query, limit=10):
+        """Titles best matching `query`, best first (see `search_rows`)."""
+        return [self.titles[row] for row in self.search_rows(query, limit)]
+
+@resource('title_index')
+def load_title_index():
+    """Build the search index over the shared catalogue (once per process)."""
+    return TitleIndex(load_catalog().titles)